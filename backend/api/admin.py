@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import UserProfile, ClaimQuery
+from .models import UserProfile, ClaimQuery, IngestionJob
 
 admin.site.register(UserProfile)
 admin.site.register(ClaimQuery)
+admin.site.register(IngestionJob)
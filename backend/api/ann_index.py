@@ -0,0 +1,625 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+import uuid
+
+import numpy as np
+
+from .embeddings import build_embedding_matrix, top_k_indices
+from .doc_store import load_array
+
+# Inverted-file (IVF) index over normalized chunk embeddings. Vectors are
+# bucketed by their nearest k-means centroid; a search scores only the
+# `n_probe` buckets whose centroids are closest to the query. Raising n_probe
+# trades latency for recall (n_probe == n_lists is an exact scan).
+ANN_DIR = os.environ.get("ANN_INDEX_DIR", os.path.join(os.path.dirname(__file__), "ann_index"))
+DEFAULT_N_PROBE = int(os.environ.get("ANN_N_PROBE", 8))
+# Below this many vectors the index stays a single flat list (exact search)
+MIN_TRAIN_SIZE = int(os.environ.get("ANN_MIN_TRAIN_SIZE", 2048))
+# Re-run k-means once the index has grown this much past its training set
+RETRAIN_GROWTH = 4.0
+# Rewrite the base without removed documents once they are this share of the rows
+MAX_DEAD_FRACTION = float(os.environ.get("ANN_MAX_DEAD_FRACTION", 0.25))
+KMEANS_SAMPLE_PER_LIST = 256
+
+
+def default_n_lists(n):
+    return int(min(4096, max(1, np.sqrt(n))))
+
+
+def _assign(vectors, centroids, batch=8192):
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        out[start:start + batch] = np.argmax(vectors[start:start + batch] @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(vectors, n_lists, iters=10, seed=0):
+    """Spherical k-means on unit vectors; returns (n_lists, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = n_lists * KMEANS_SAMPLE_PER_LIST
+    if len(vectors) > sample_size:
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+
+    for _ in range(iters):
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        starts = (np.cumsum(counts) - counts)[filled]
+        sums[filled] = np.add.reduceat(vectors[order], starts, axis=0)
+        # Empty clusters are re-seeded from random points
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(len(vectors), empty.size, replace=False)]
+        centroids = build_embedding_matrix(sums)
+    return centroids
+
+
+def _group_by_list(vectors, docs, chunks, assign, n_lists):
+    """Rows sorted by list id, plus the (n_lists + 1) offsets of each list's run."""
+    order = np.argsort(assign, kind="stable")
+    offsets = np.searchsorted(assign[order], np.arange(n_lists + 1)).astype(np.int64)
+    return vectors[order], docs[order], chunks[order], offsets
+
+
+def _write_lists(path, vectors, docs, chunks, offsets):
+    np.save(os.path.join(path, "vectors.npy"), vectors)
+    np.save(os.path.join(path, "docs.npy"), docs)
+    np.save(os.path.join(path, "chunks.npy"), chunks)
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+
+
+def _read_lists(path, mmap=True):
+    """Per-list (vectors, docs, chunks) slices of a base or segment directory; None for empty lists."""
+    vectors_path = os.path.join(path, "vectors.npy")
+    vectors = load_array(vectors_path) if mmap else np.load(vectors_path)
+    docs = np.load(os.path.join(path, "docs.npy"))
+    chunks = np.load(os.path.join(path, "chunks.npy"))
+    offsets = np.load(os.path.join(path, "offsets.npy"))
+    return [
+        (vectors[start:end], docs[start:end], chunks[start:end]) if end > start else None
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def _new_dir(parent):
+    path = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(path)
+    return path
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class IVFIndex:
+    """
+    On disk an index is a base (every list's vectors, written when the index
+    is trained or compacted) plus append segments, one per save, laid out the
+    same way. Adding a document writes only its own segment and the small
+    JSON header; removing one only marks its key None in the header, and
+    searches skip its rows until the next compaction. Segments are merged
+    size-tiered (a segment is folded into the next one once that one is no
+    larger), so there are O(log n) of them and each row is rewritten
+    O(log n) times. Retraining, or tombstones passing
+    ANN_MAX_DEAD_FRACTION of the rows, rewrites the base without them.
+    """
+
+    def __init__(self, n_probe=DEFAULT_N_PROBE):
+        self.n_probe = n_probe
+        self.centroids = None
+        self.trained_on = 0
+        self.doc_keys = []      # None once removed, until the next compaction
+        self.doc_sizes = []     # chunk rows per document, parallel to doc_keys
+        self._doc_index = {}
+        # per list: list of (vectors, doc_idx, chunk_idx) blocks
+        self._lists = [[]]
+        self.segments = []      # on-disk append segments, oldest first: [name, rows]
+        self._pending = []      # (vectors, docs, chunks, list ids) added since the last save
+        self._rewrite = True    # the next save writes a new base
+        self._alive = None
+        # Running counts, so len() and the training thresholds cost O(1)
+        self._live_rows = 0
+        self._dead_rows = 0     # rows of removed documents still stored
+        self._dead_docs = 0     # removed documents not yet renumbered away
+
+    @property
+    def n_lists(self):
+        return len(self._lists)
+
+    @property
+    def tombstoned(self):
+        """Rows of removed documents still stored."""
+        return self._dead_rows
+
+    def _rows(self):
+        return self._live_rows + self._dead_rows
+
+    def __len__(self):
+        return self._live_rows
+
+    def _count(self):
+        """Recompute the running counts from doc_keys and doc_sizes."""
+        self._live_rows = sum(size for key, size in zip(self.doc_keys, self.doc_sizes) if key is not None)
+        self._dead_rows = sum(size for key, size in zip(self.doc_keys, self.doc_sizes) if key is None)
+        self._dead_docs = sum(key is None for key in self.doc_keys)
+
+    def documents(self):
+        return [key for key in self.doc_keys if key is not None]
+
+    def _alive_docs(self):
+        if self._alive is None:
+            self._alive = np.array([key is not None for key in self.doc_keys], dtype=bool)
+        return self._alive
+
+    def _list(self, list_id):
+        blocks = self._lists[list_id]
+        if len(blocks) > 1:
+            blocks[:] = [tuple(np.concatenate(parts) for parts in zip(*blocks))]
+        return blocks[0] if blocks else None
+
+    def _live(self):
+        """
+        Every row of a live document, with documents renumbered so removed
+        keys are dropped from doc_keys; None when there are no rows left.
+        """
+        alive = self._alive_docs()
+        remap = np.full(len(self.doc_keys), -1, dtype=np.int32)
+        remap[alive] = np.arange(int(alive.sum()), dtype=np.int32)
+        self.doc_keys = [key for key in self.doc_keys if key is not None]
+        self.doc_sizes = [size for size, keep in zip(self.doc_sizes, alive) if keep]
+        self._doc_index = {key: i for i, key in enumerate(self.doc_keys)}
+        self._alive = None
+        self._dead_rows = self._dead_docs = 0
+
+        parts = [block for blocks in self._lists for block in blocks]
+        if not parts:
+            return None
+        vectors, docs, chunks = (np.concatenate(cols) for cols in zip(*parts))
+        keep = alive[docs]
+        if not keep.any():
+            return None
+        return vectors[keep], remap[docs[keep]], chunks[keep]
+
+    def _bucket(self, data):
+        """Replace the contents with `data` bucketed by the current centroids; the next save rewrites the base."""
+        self._pending = []
+        self._rewrite = True
+        if data is None:
+            self._lists = [[] for _ in range(len(self.centroids) if self.centroids is not None else 1)]
+            return
+        vectors, docs, chunks = data
+        if self.centroids is None:
+            self._lists = [[(vectors, docs, chunks)]]
+            return
+        n_lists = len(self.centroids)
+        vectors, docs, chunks, offsets = _group_by_list(vectors, docs, chunks, _assign(vectors, self.centroids), n_lists)
+        self._lists = [
+            [(vectors[start:end], docs[start:end], chunks[start:end])] if end > start else []
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def add(self, doc_key, vectors):
+        """Add one document's chunk vectors (rows need not be normalized)."""
+        self.add_many([(doc_key, vectors)])
+
+    def add_many(self, documents):
+        """
+        Add (doc_key, vectors) pairs in one pass: their rows are bucketed
+        together and training is considered once, after all of them.
+        """
+        parts = []
+        for doc_key, vectors in documents:
+            doc_key = str(doc_key)
+            self.remove(doc_key)
+            vectors = build_embedding_matrix(vectors)
+            if not len(vectors):
+                continue
+            doc_idx = len(self.doc_keys)
+            self.doc_keys.append(doc_key)
+            self.doc_sizes.append(len(vectors))
+            self._doc_index[doc_key] = doc_idx
+            self._live_rows += len(vectors)
+            parts.append((
+                vectors, np.full(len(vectors), doc_idx, dtype=np.int32), np.arange(len(vectors), dtype=np.int32),
+            ))
+        if not parts:
+            return
+        self._alive = None
+        vectors, docs, chunks = (np.concatenate(cols) for cols in zip(*parts))
+
+        if self.centroids is None:
+            assign = np.zeros(len(vectors), dtype=np.int32)
+        else:
+            assign = _assign(vectors, self.centroids)
+        for list_id in np.unique(assign):
+            mask = assign == list_id
+            self._lists[list_id].append((vectors[mask], docs[mask], chunks[mask]))
+        self._pending.append((vectors, docs, chunks, assign))
+        self.maybe_train()
+
+    def remove(self, doc_key):
+        """Tombstone a document; its rows are dropped at the next compaction."""
+        doc_idx = self._doc_index.pop(str(doc_key), None)
+        if doc_idx is None:
+            return
+        self.doc_keys[doc_idx] = None
+        self._alive = None
+        self._live_rows -= self.doc_sizes[doc_idx]
+        self._dead_rows += self.doc_sizes[doc_idx]
+        self._dead_docs += 1
+
+    def compact(self):
+        """Drop removed documents' rows; the next save rewrites the base."""
+        self._bucket(self._live())
+
+    def clear(self):
+        """Drop every document and the centroids; the next save rewrites the base."""
+        self.centroids = None
+        self.trained_on = 0
+        self.doc_keys = []
+        self.doc_sizes = []
+        self._doc_index = {}
+        self._alive = None
+        self._live_rows = self._dead_rows = self._dead_docs = 0
+        self._bucket(None)
+
+    def maybe_train(self, n_lists=None):
+        n = len(self)
+        if n < MIN_TRAIN_SIZE:
+            return False
+        if self.centroids is not None and n < self.trained_on * RETRAIN_GROWTH:
+            return False
+        self.train(n_lists)
+        return True
+
+    def train(self, n_lists=None):
+        """(Re)compute centroids from the live contents and rebucket everything, compacting tombstones."""
+        data = self._live()
+        if data is None:
+            self._bucket(None)
+            return
+        vectors = data[0]
+        n_lists = min(n_lists or default_n_lists(len(vectors)), len(vectors))
+        self.centroids = kmeans(vectors, n_lists)
+        self.trained_on = len(vectors)
+        self._bucket(data)
+
+    def search(self, query, k=10, n_probe=None):
+        """
+        Returns:
+            list: up to k tuples (doc_key, chunk_index, similarity), best first
+        """
+        query = build_embedding_matrix(query)[0]
+        if self.centroids is None:
+            probe = range(self.n_lists)
+        else:
+            n_probe = min(n_probe or self.n_probe, self.n_lists)
+            centroid_scores = self.centroids @ query
+            probe = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+
+        scores, docs, chunks = [], [], []
+        for list_id in probe:
+            # Blocks are scored in place; base and segment slices stay memory-mapped
+            for block_vectors, block_docs, block_chunks in self._lists[list_id]:
+                scores.append(block_vectors @ query)
+                docs.append(block_docs)
+                chunks.append(block_chunks)
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        docs = np.concatenate(docs)
+        chunks = np.concatenate(chunks)
+        if self._dead_docs:
+            # also masks rows a segment merge has already purged on disk
+            keep = self._alive_docs()[docs]
+            scores, docs, chunks = scores[keep], docs[keep], chunks[keep]
+
+        return [
+            (self.doc_keys[docs[i]], int(chunks[i]), float(scores[i]))
+            for i in top_k_indices(scores, k)
+        ]
+
+    def _dim(self):
+        if self.centroids is not None:
+            return self.centroids.shape[1]
+        for blocks in self._lists:
+            for block in blocks:
+                return block[0].shape[1]
+        return 0
+
+    def _header(self):
+        return {
+            "n_probe": self.n_probe,
+            "trained_on": self.trained_on,
+            "n_lists": self.n_lists,
+            "doc_keys": self.doc_keys,
+            "doc_sizes": self.doc_sizes,
+            "segments": self.segments,
+        }
+
+    def save(self, path):
+        """
+        Persist changes since the index was loaded: a new append segment for
+        added documents, or a new base after training or compaction. The
+        JSON header is replaced last, so readers see the old or new state.
+        """
+        rows = self._rows()
+        if not self._rewrite and rows and self.tombstoned > rows * MAX_DEAD_FRACTION:
+            self.compact()
+        if self._rewrite or not os.path.isdir(path):
+            self._save_base(path)
+            return
+        if self._pending:
+            vectors, docs, chunks, assign = (np.concatenate(cols) for cols in zip(*self._pending))
+            name = uuid.uuid4().hex
+            tmp_path = _new_dir(path)
+            try:
+                _write_lists(tmp_path, *_group_by_list(vectors, docs, chunks, assign, self.n_lists))
+                os.replace(tmp_path, os.path.join(path, name))
+            except Exception:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            self.segments.append([name, len(docs)])
+            self._pending = []
+        merged = self._merge_segments(path)
+        _write_json(os.path.join(path, "index.json"), self._header())
+        for name in merged:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    def _merge_segments(self, path):
+        """Fold newer segments into older ones while the older one is no larger; return the replaced names."""
+        replaced = []
+        while len(self.segments) >= 2 and self.segments[-2][1] <= self.segments[-1][1]:
+            (older, _), (newer, _) = self.segments[-2:]
+            alive = self._alive_docs()
+            parts = [_read_lists(os.path.join(path, name)) for name in (older, newer)]
+            vectors, docs, chunks, sizes = [], [], [], []
+            purged = set()
+            for entries in zip(*parts):
+                blocks = [entry for entry in entries if entry is not None]
+                if blocks:
+                    v, d, c = (np.concatenate(cols) for cols in zip(*blocks))
+                    keep = alive[d]
+                    purged.update(np.unique(d[~keep]).tolist())
+                    blocks = (v[keep], d[keep], c[keep])
+                    vectors.append(blocks[0])
+                    docs.append(blocks[1])
+                    chunks.append(blocks[2])
+                sizes.append(len(blocks[1]) if blocks else 0)
+            offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+            dim = self._dim()
+            name = uuid.uuid4().hex
+            tmp_path = _new_dir(path)
+            try:
+                _write_lists(
+                    tmp_path,
+                    np.concatenate(vectors) if vectors else np.zeros((0, dim), dtype=np.float32),
+                    np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32),
+                    np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32),
+                    offsets,
+                )
+                os.replace(tmp_path, os.path.join(path, name))
+            except Exception:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            self.segments[-2:] = [[name, int(offsets[-1])]]
+            replaced.extend((older, newer))
+            # A document's rows all sit in one segment, so the removed ones
+            # seen here are now gone from disk
+            for doc in purged:
+                self._dead_rows -= self.doc_sizes[doc]
+                self.doc_sizes[doc] = 0
+        return replaced
+
+    def _save_base(self, path):
+        parent = os.path.dirname(path) or "."
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = _new_dir(parent)
+        try:
+            entries = [self._list(i) for i in range(self.n_lists)]
+            sizes = [0 if e is None else len(e[1]) for e in entries]
+            offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+            present = [e for e in entries if e is not None]
+            _write_lists(
+                tmp_path,
+                np.concatenate([e[0] for e in present]) if present else np.zeros((0, self._dim()), dtype=np.float32),
+                np.concatenate([e[1] for e in present]) if present else np.zeros(0, dtype=np.int32),
+                np.concatenate([e[2] for e in present]) if present else np.zeros(0, dtype=np.int32),
+                offsets,
+            )
+            if self.centroids is not None:
+                np.save(os.path.join(tmp_path, "centroids.npy"), self.centroids)
+            self.segments = []
+            _write_json(os.path.join(tmp_path, "index.json"), self._header())
+            # Swap by renaming: the old directory is moved aside, never missing
+            # while the new one is not yet in place
+            old_path = None
+            if os.path.isdir(path):
+                old_path = f"{tmp_path}-old"
+                os.rename(path, old_path)
+            os.replace(tmp_path, path)
+            if old_path is not None:
+                shutil.rmtree(old_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._pending = []
+        self._rewrite = False
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "index.json"), encoding="utf-8") as f:
+            header = json.load(f)
+        index = cls(n_probe=header["n_probe"])
+        index.trained_on = header["trained_on"]
+        index.doc_keys = header["doc_keys"]
+        index.doc_sizes = header.get("doc_sizes") or [0] * len(index.doc_keys)
+        index.segments = header.get("segments", [])
+        index._doc_index = {key: i for i, key in enumerate(index.doc_keys) if key is not None}
+        index._count()
+        centroids_path = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+        index._lists = [[entry] if entry is not None else [] for entry in _read_lists(path, mmap=mmap)]
+        for name, _ in index.segments:
+            for blocks, entry in zip(index._lists, _read_lists(os.path.join(path, name), mmap=mmap)):
+                if entry is not None:
+                    blocks.append(entry)
+        index._rewrite = False
+        return index
+
+
+def brute_force_search(vectors, query, k=10):
+    """
+    Exact top-k row indices for `query`; the recall baseline. `vectors` must
+    already be normalized (see build_embedding_matrix).
+    """
+    return top_k_indices(vectors @ build_embedding_matrix(query)[0], k)
+
+
+class IndexRegistry:
+    """
+    One IVFIndex per organization, persisted under ANN_DIR. Updates take an
+    exclusive file lock so several workers can add/remove documents safely;
+    readers reload whenever the on-disk header is newer than theirs.
+    """
+
+    def __init__(self, root=ANN_DIR):
+        self.root = root
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def _path(self, org_key):
+        return os.path.join(self.root, hashlib.sha256(org_key.encode("utf-8")).hexdigest()[:32])
+
+    def _version(self, path):
+        # The header is replaced on every save, so its inode changes too
+        try:
+            st = os.stat(os.path.join(path, "index.json"))
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _load(self, path):
+        """(version, index) for the copy on disk, or (None, None)."""
+        for _ in range(3):
+            version = self._version(path)
+            if version is None:
+                return None, None
+            try:
+                return version, IVFIndex.load(path)
+            except (OSError, ValueError):
+                # A writer merged segments or rewrote the base between reading
+                # the header and the files it names; read the new header
+                continue
+        raise RuntimeError(f"ANN index at {path} kept changing while loading")
+
+    def get(self, org_key):
+        """Return the organization's index, or None if it has not been built."""
+        path = self._path(org_key)
+        version = self._version(path)
+        with self._lock:
+            loaded = self._loaded.get(org_key)
+        if loaded is not None and (version is None or loaded[0] == version):
+            return loaded[1]
+        version, index = self._load(path)
+        if index is None:
+            return None
+        with self._lock:
+            self._loaded[org_key] = (version, index)
+        return index
+
+    def update(self, org_key, fn):
+        """Apply fn(index) under the organization's lock and persist the changes."""
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(org_key)
+        with open(path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = IVFIndex.load(path) if self._version(path) else IVFIndex()
+                fn(index)
+                index.save(path)
+                version, index = self._load(path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        with self._lock:
+            self._loaded[org_key] = (version, index)
+        return index
+
+    def add_document(self, org_key, document_id, embeddings):
+        return self.update(org_key, lambda index: index.add(document_id, embeddings))
+
+    def remove_document(self, org_key, document_id):
+        if self._version(self._path(org_key)) is None:
+            return None
+        return self.update(org_key, lambda index: index.remove(document_id))
+
+    def build(self, org_key, documents):
+        """Rebuild from scratch from an iterable of (document_id, embeddings)."""
+        def fill(index):
+            index.clear()
+            index.add_many(documents)
+        return self.update(org_key, fill)
+
+
+def benchmark(vectors, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32), n_lists=None):
+    """
+    Recall@k of the IVF index against brute-force search, plus mean query latency.
+
+    Returns:
+        list: one dict per n_probe value
+    """
+    vectors = build_embedding_matrix(vectors)
+    index = IVFIndex()
+    index.add("bench", vectors)
+    index.train(n_lists)
+    truth = [set(brute_force_search(vectors, q, k).tolist()) for q in queries]
+
+    start = time.perf_counter()
+    for q in queries:
+        brute_force_search(vectors, q, k)
+    brute_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    results = []
+    for n_probe in n_probes:
+        if n_probe > index.n_lists:
+            break
+        hits = 0
+        start = time.perf_counter()
+        found = [index.search(q, k=k, n_probe=n_probe) for q in queries]
+        elapsed = time.perf_counter() - start
+        for expected, got in zip(truth, found):
+            hits += len(expected & {chunk for _, chunk, _ in got})
+        results.append({
+            "n_lists": index.n_lists,
+            "n_probe": n_probe,
+            "recall": hits / max(sum(len(t) for t in truth), 1),
+            "ms_per_query": elapsed * 1000 / max(len(queries), 1),
+            "brute_force_ms_per_query": brute_ms,
+        })
+    return results
+
+
+def build_benchmark(n_docs, rows_per_doc=50, dim=50, seed=0):
+    """Seconds to build an index from `n_docs` synthetic documents, as IndexRegistry.build does."""
+    rng = np.random.default_rng(seed)
+    documents = [(str(i), rng.standard_normal((rows_per_doc, dim)).astype(np.float32)) for i in range(n_docs)]
+    start = time.perf_counter()
+    index = IVFIndex()
+    index.add_many(documents)
+    return time.perf_counter() - start
+
+
+index_registry = IndexRegistry()
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .query_cache import normalize_query, make_backend
+
+# Memoizes LLM answers. The exact key is (tenant, document content hash,
+# retrieved chunks, normalized question, model, kind), so a hit is a request
+# whose prompt would have been identical. Chunks are identified by the digest
+# of their text, which is stable for a given content hash.
+#
+# With ANSWER_CACHE_SIMILARITY set (e.g. 0.97), a miss falls back to the most
+# similar cached question for the same tenant and document; its answer is
+# reused when the question embeddings' cosine similarity reaches the
+# threshold. Averaged word vectors barely move on "not", so keep it high.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "True") == "True"
+ANSWER_CACHE_BACKEND = os.environ.get("ANSWER_CACHE_BACKEND", "local")
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 6 * 60 * 60))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 20000))
+ANSWER_CACHE_MAX_BYTES = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0))
+# Near-duplicate lookup keeps this many questions per (tenant, document)...
+SEMANTIC_MAX_PER_DOCUMENT = int(os.environ.get("ANSWER_CACHE_SEMANTIC_MAX_PER_DOC", 512))
+# ...for this many (tenant, document) pairs, least recently used dropped first
+SEMANTIC_MAX_DOCUMENTS = int(os.environ.get("ANSWER_CACHE_SEMANTIC_MAX_DOCS", 1024))
+
+
+def chunk_digest(top_chunks):
+    digest = hashlib.sha256()
+    for text, _ in top_chunks:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+class _QuestionIndex:
+    """Unit-normalized question embeddings and their exact cache keys, oldest first."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.keys = []
+        self.vectors = None
+
+    def add(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return
+        row = (vector / norm)[None, :]
+        self.keys.append(key)
+        self.vectors = row if self.vectors is None else np.vstack([self.vectors, row])[-self.max_size:]
+        self.keys = self.keys[-self.max_size:]
+
+    def nearest(self, vector):
+        if self.vectors is None:
+            return None, 0.0
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None, 0.0
+        scores = self.vectors @ (vector / norm)
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+
+class AnswerCache:
+    def __init__(self, backend=None, similarity=ANSWER_CACHE_SIMILARITY, enabled=ANSWER_CACHE_ENABLED):
+        if backend is None:
+            kwargs = {"ttl": ANSWER_CACHE_TTL}
+            if ANSWER_CACHE_BACKEND == "local":
+                kwargs.update(max_entries=ANSWER_CACHE_MAX_ENTRIES, max_bytes=ANSWER_CACHE_MAX_BYTES)
+            else:
+                kwargs.update(prefix="policyintel:answer:")
+            backend = make_backend(ANSWER_CACHE_BACKEND, **kwargs)
+        self.backend = backend
+        self.similarity = similarity
+        self.enabled = enabled
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._questions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, tenant, content_hash, top_chunks, question, model, kind):
+        payload = json.dumps(
+            [tenant, content_hash, chunk_digest(top_chunks), normalize_query(question), model, kind]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _scope(self, tenant, content_hash, model, kind):
+        return (tenant, content_hash, model, kind)
+
+    def get(self, tenant, content_hash, top_chunks, question, model, kind, embedding=None, adapt=None):
+        """
+        Cached answer for this exact prompt, else for a near-duplicate question;
+        None on a miss. `adapt(answer)` fits a near-duplicate's answer to this
+        question, or returns None to count it as a miss.
+        """
+        if not self.enabled or not content_hash:
+            return None
+        value = self.backend.get(self.key(tenant, content_hash, top_chunks, question, model, kind))
+        semantic = False
+        if value is None and self.similarity > 0 and embedding is not None:
+            with self._lock:
+                index = self._questions.get(self._scope(tenant, content_hash, model, kind))
+                near_key, score = index.nearest(embedding) if index is not None else (None, 0.0)
+            if near_key is not None and score >= self.similarity:
+                value = self.backend.get(near_key)
+                if value is not None and adapt is not None:
+                    value = adapt(json.loads(value))
+                    value = json.dumps(value) if value is not None else None
+                semantic = value is not None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            elif semantic:
+                self.semantic_hits += 1
+            else:
+                self.hits += 1
+        return json.loads(value) if value is not None else None
+
+    def set(self, tenant, content_hash, top_chunks, question, model, kind, answer, embedding=None):
+        if not self.enabled or not content_hash:
+            return
+        key = self.key(tenant, content_hash, top_chunks, question, model, kind)
+        self.backend.set(key, json.dumps(answer))
+        if self.similarity > 0 and embedding is not None:
+            scope = self._scope(tenant, content_hash, model, kind)
+            with self._lock:
+                index = self._questions.get(scope)
+                if index is None:
+                    index = self._questions[scope] = _QuestionIndex(SEMANTIC_MAX_PER_DOCUMENT)
+                self._questions.move_to_end(scope)
+                index.add(key, embedding)
+                while len(self._questions) > SEMANTIC_MAX_DOCUMENTS:
+                    self._questions.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits, semantic_hits, misses = self.hits, self.semantic_hits, self.misses
+        lookups = hits + semantic_hits + misses
+        return {
+            "hits": hits + semantic_hits,
+            "semantic_hits": semantic_hits,
+            "misses": misses,
+            "hit_rate": (hits + semantic_hits) / lookups if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .warmup import WARMUP_ON_STARTUP, warm_up
+        if WARMUP_ON_STARTUP:
+            warm_up()
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import asyncio
+import functools
+import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.authtoken.models import Token
+
+from .pipeline import process_document, DocumentParseError, DocumentProcessingError
+from .llm_processor import (
+    hybrid_parse_input_async, make_decision_async, analyze_claim_async, answer_question_async, SINGLE_CALL_MODE,
+)
+from .llm_fanout import fan_out_async
+from .models import organization_key
+from .doc_store import document_store
+from .downloader import downloader, DownloadError, DownloadTooLarge
+from .metrics import timed_await
+from .views import (
+    _retrieve, _missing_document, _cached_claim, _store_claim, _save_claim_query,
+    _document_url, _retrieve_questions, _cached_answers, _store_answers,
+    MAX_FILE_SIZE, MAX_PAGES, MAX_PARAGRAPHS, MAX_QUESTIONS, LLM_TIMEOUT, DOWNLOAD_TIMEOUT, REQUEST_DEADLINE,
+)
+
+# Async versions of the LLM-bound endpoints for serving over ASGI
+# (insurance_backend.asgi under uvicorn). Downloads and LLM calls are awaited
+# on the event loop, so an in-flight request holds no thread; parsing,
+# embedding and retrieval run in a small thread pool, and ORM calls go
+# through sync_to_async. With ASYNC_VIEWS=True, api.urls routes
+# /api/analyze/ and /api/v1/hackrx/run here instead of to api.views.
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "False") == "True"
+ASYNC_CPU_WORKERS = int(os.environ.get("ASYNC_CPU_WORKERS", os.cpu_count() or 4))
+
+_cpu_pool = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS)
+# The event loop keeps only weak references to tasks
+_background_tasks = set()
+
+
+async def _offload(func, *args, **kwargs):
+    """Run blocking `func` in the CPU pool, in a copy of the request's context (stage timings)."""
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, call)
+
+
+def _background(coro):
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _json_body(request):
+    """The request's JSON object; ValueError when the body is not one."""
+    data = json.loads(request.body or b"{}")
+    if not isinstance(data, dict):
+        raise ValueError("JSON body must be an object")
+    return data
+
+
+def _unauthorized(detail):
+    response = JsonResponse({"detail": detail}, status=401)
+    response["WWW-Authenticate"] = "Token"
+    return response
+
+
+async def _authenticate(request):
+    """DRF TokenAuthentication for a plain async view: (user, None) or (None, 401 response)."""
+    auth = request.headers.get("Authorization", "").split()
+    if len(auth) != 2 or auth[0].lower() != "token":
+        return None, _unauthorized("Authentication credentials were not provided.")
+    token = await Token.objects.select_related("user").filter(key=auth[1]).afirst()
+    if token is None or not token.user.is_active:
+        return None, _unauthorized("Invalid token.")
+    return token.user, None
+
+
+@csrf_exempt
+@require_POST
+async def analyze_query(request):
+    user, denied = await _authenticate(request)
+    if denied is not None:
+        return denied
+    try:
+        data = _json_body(request)
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON body"}, status=400)
+    query = data.get('query')
+    document_id = data.get('document_id')
+
+    if not query:
+        return JsonResponse({"error": "Query is required"}, status=400)
+
+    stored = await _offload(document_store.get, document_id) if document_id else None
+    if stored is None:
+        body, status = await sync_to_async(_missing_document)(document_id)
+        return JsonResponse(body, status=status)
+
+    tenant = await sync_to_async(organization_key)(user)
+    # In two-call mode the parse call runs while we embed and retrieve
+    parse_task = None if SINGLE_CALL_MODE else _background(hybrid_parse_input_async(query))
+    query_embedding, top_chunks = await _offload(_retrieve, query, stored)
+    cached = await _offload(_cached_claim, tenant, stored, query, query_embedding, top_chunks)
+    if cached is not None:
+        # A pending parse call finishes in the background and lands in the parse cache
+        parsed_input, result = cached
+    else:
+        if parse_task is None:
+            parsed_input, result = await analyze_claim_async(
+                query, top_chunks, source_name=stored.filename, query_vector=query_embedding, offload=_offload,
+            )
+        else:
+            parsed_input = await parse_task
+            result = await make_decision_async(
+                parsed_input, top_chunks, source_name=stored.filename, query=query,
+                query_vector=query_embedding, offload=_offload,
+            )
+        await _offload(_store_claim, tenant, stored, query, query_embedding, top_chunks, parsed_input, result)
+
+    await sync_to_async(_save_claim_query)(user, document_id, query, parsed_input, result)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+@require_POST
+async def hackrx_run(request):
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    try:
+        try:
+            data = _json_body(request)
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON body"}, status=400)
+        raw_doc_url = data.get("documents")
+        questions = data.get("questions", [])
+
+        if not questions or not isinstance(questions, list):
+            return JsonResponse({"error": "Missing or invalid questions list"}, status=400)
+        if len(questions) > MAX_QUESTIONS:
+            return JsonResponse({"error": f"Too many questions in request (limit: {MAX_QUESTIONS})"}, status=400)
+        if not raw_doc_url:
+            return JsonResponse({"error": "Missing documents"}, status=400)
+        document_url = _document_url(raw_doc_url)
+
+        try:
+            with timed_await("download"):
+                body = await downloader.fetch_async(
+                    document_url, MAX_FILE_SIZE, timeout=DOWNLOAD_TIMEOUT, deadline=deadline,
+                )
+        except DownloadTooLarge:
+            return JsonResponse({"error": f"Document too large for hackathon limits (max {MAX_FILE_SIZE//1024}KB)."}, status=400)
+        except DownloadError:
+            return JsonResponse({"error": "Failed to fetch document from provided URL."}, status=400)
+
+        filename = urlparse(document_url).path.split("/")[-1]
+        try:
+            processed = await _offload(
+                process_document, body, filename, max_pages=MAX_PAGES, max_paragraphs=MAX_PARAGRAPHS,
+            )
+        except DocumentParseError:
+            return JsonResponse({"error": "Unsupported or unparseable document format."}, status=400)
+        except DocumentProcessingError:
+            return JsonResponse({"answers": ["Error during document chunking/embedding."] * len(questions)})
+        finally:
+            body.close()
+        if not processed.chunks:
+            return JsonResponse({"answers": ["Document could not be parsed, or is empty."] * len(questions)})
+
+        try:
+            question_embeddings, top_chunks_per_question = await _offload(_retrieve_questions, processed, questions)
+        except Exception:
+            return JsonResponse({"answers": ["Internal error processing this question."] * len(questions)})
+
+        answers = await _offload(_cached_answers, processed, questions, question_embeddings, top_chunks_per_question)
+        misses = [i for i, answer in enumerate(answers) if answer is None]
+        fresh = await fan_out_async(
+            lambda i, remaining: answer_question_async(
+                questions[i], top_chunks_per_question[i], timeout=min(LLM_TIMEOUT, remaining),
+                query_vector=question_embeddings[i], offload=_offload,
+            ),
+            misses,
+            deadline,
+        )
+        await _offload(
+            _store_answers, processed, questions, question_embeddings, top_chunks_per_question, answers, misses, fresh,
+        )
+        return JsonResponse({"answers": answers})
+
+    except Exception as e:
+        print("[ERROR in hackrx_run]")
+        print("Exception:", str(e))
+        print(traceback.format_exc())
+        return JsonResponse({"error": "Fatal internal server error."}, status=500)
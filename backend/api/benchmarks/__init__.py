@@ -0,0 +1,2 @@
+# Offline benchmark suite; run it with `python manage.py benchmark`.
+from .suite import run_suite, compare  # noqa: F401
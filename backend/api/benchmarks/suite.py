@@ -0,0 +1,374 @@
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import tempfile
+import threading
+import statistics
+import functools
+import http.server
+from io import BytesIO
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import synthetic
+
+DEFAULT_SIZES = (10, 100, 1000)
+DEFAULT_FORMATS = ("pdf", "docx")
+DEFAULT_REPEAT = 3
+QUERIES = 50
+# Component benchmarks process whole documents, whatever the view limits are
+UNLIMITED_PARAGRAPHS = 10 ** 9
+# A regression must be this much slower relatively, and absolutely, to count
+DEFAULT_THRESHOLD = 0.10
+MIN_DELTA_SECONDS = 0.002
+
+
+def measure(func, repeat=DEFAULT_REPEAT, warmup=1):
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(name, times, items=None, unit=None, **params):
+    median = statistics.median(times)
+    result = {
+        "name": name,
+        "params": params,
+        "runs": len(times),
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.fmean(times),
+        "max_s": max(times),
+    }
+    if items:
+        result["items"] = items
+        result["unit"] = unit
+        result["throughput_per_s"] = items / median if median > 0 else None
+    return result
+
+
+@contextmanager
+def isolated_environment(dim=50):
+    """
+    Point every on-disk store at a temp directory and swap in the synthetic
+    model and the stub Groq clients for the duration of the block.
+    """
+    from api import embeddings, llm_client, ingestion
+    from api.doc_store import document_store
+    from api.content_cache import content_cache
+    from api.downloader import downloader
+    from api.ann_index import index_registry
+
+    root = tempfile.mkdtemp(prefix="policyintel-bench-")
+    saved = {
+        (embeddings, "_model"): embeddings._model,
+        (llm_client, "groq_client"): llm_client.groq_client,
+        (llm_client, "async_groq_client"): llm_client.async_groq_client,
+        (ingestion, "INGEST_DIR"): ingestion.INGEST_DIR,
+        (ingestion, "INGEST_WORKERS"): ingestion.INGEST_WORKERS,
+        (document_store, "root"): document_store.root,
+        (content_cache, "root"): content_cache.root,
+        (downloader, "cache_dir"): downloader.cache_dir,
+        (index_registry, "root"): index_registry.root,
+    }
+    embeddings._model = synthetic.make_word_vectors(dim=dim)
+    llm_client.groq_client = synthetic.StubGroq()
+    async_stub = synthetic.AsyncStubGroq()
+    llm_client.async_groq_client = lambda: async_stub
+    ingestion.INGEST_DIR = os.path.join(root, "ingest")
+    # Uploads are benchmarked end to end, so jobs must run in this process
+    ingestion.INGEST_WORKERS = max(ingestion.INGEST_WORKERS, 1)
+    document_store.root = os.path.join(root, "doc_store")
+    content_cache.root = os.path.join(root, "content_cache")
+    downloader.cache_dir = os.path.join(root, "download_cache")
+    index_registry.root = os.path.join(root, "ann_index")
+    try:
+        yield root
+    finally:
+        for (obj, attr), value in saved.items():
+            setattr(obj, attr, value)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def component_benchmarks(sizes, formats, repeat, log=print):
+    from api.document_parser import parse_document, split_text_to_chunks, extract_text_from_docx, extract_text_python_docx
+    from api.embeddings import embed_chunks, embed_queries, build_embedding_matrix, get_top_k_chunks
+    from api.bm25 import BM25Index, hybrid_top_k
+    from api.prompt_builder import build_context
+
+    results = []
+    queries = synthetic.questions(QUERIES)
+    for pages in sizes:
+        texts = {}
+        for fmt in formats:
+            data = synthetic.make_document(fmt, pages)
+            filename = f"bench.{fmt}"
+
+            def parse():
+                return parse_document(BytesIO(data), filename, max_pages=pages, max_paragraphs=UNLIMITED_PARAGRAPHS)
+
+            texts[fmt] = parse()
+            results.append(summarize(
+                f"parse_document.{fmt}.{pages}", measure(parse, repeat), items=pages, unit="pages",
+                format=fmt, pages=pages, bytes=len(data),
+            ))
+            log(results[-1])
+
+            if fmt == "docx":
+                # The streaming reader against the python-docx one it replaced
+                for name, extract in (("stream", extract_text_from_docx), ("python_docx", extract_text_python_docx)):
+                    results.append(summarize(
+                        f"extract_docx.{name}.{pages}",
+                        measure(lambda: extract(BytesIO(data), max_paragraphs=UNLIMITED_PARAGRAPHS), repeat),
+                        items=pages, unit="pages", pages=pages, bytes=len(data),
+                    ))
+                    log(results[-1])
+
+        # Chunking onwards runs on the PDF text when there is one, so results
+        # stay comparable between runs with different --formats
+        source = "pdf" if "pdf" in texts else formats[0]
+        text = texts[source]
+        chunks = split_text_to_chunks(text)
+        words = len(text.split())
+        results.append(summarize(
+            f"split_text_to_chunks.{pages}", measure(lambda: split_text_to_chunks(text), repeat),
+            items=words, unit="words", pages=pages, chunks=len(chunks), source=source,
+        ))
+        log(results[-1])
+
+        results.append(summarize(
+            f"embed_chunks.{pages}", measure(lambda: embed_chunks(chunks), repeat),
+            items=len(chunks), unit="chunks", pages=pages,
+        ))
+        log(results[-1])
+
+        matrix = build_embedding_matrix(embed_chunks(chunks))
+        query_vectors = embed_queries(queries)
+        bm25 = BM25Index.build(chunks)
+
+        def top_k():
+            for q in query_vectors:
+                get_top_k_chunks(q, matrix, chunks, k=3)
+
+        def hybrid():
+            for query, q in zip(queries, query_vectors):
+                hybrid_top_k(query, q, matrix, chunks, bm25=bm25, k=3)
+
+        results.append(summarize(
+            f"get_top_k_chunks.{pages}", measure(top_k, repeat),
+            items=len(queries), unit="queries", pages=pages, chunks=len(chunks),
+        ))
+        log(results[-1])
+        results.append(summarize(
+            f"hybrid_top_k.{pages}", measure(hybrid, repeat),
+            items=len(queries), unit="queries", pages=pages, chunks=len(chunks),
+        ))
+        log(results[-1])
+
+        retrieved = [hybrid_top_k(query, q, matrix, chunks, bm25=bm25, k=3) for query, q in zip(queries, query_vectors)]
+
+        def prompt_context():
+            for query, q, top in zip(queries, query_vectors, retrieved):
+                build_context(query, top, query_vector=q, call="benchmark")
+
+        results.append(summarize(
+            f"build_context.{pages}", measure(prompt_context, repeat),
+            items=len(queries), unit="queries", pages=pages, chunks=len(chunks),
+        ))
+        log(results[-1])
+    return results
+
+
+@contextmanager
+def test_database():
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.test.runner import DiscoverRunner
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+@contextmanager
+def file_server(directory):
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _wait_for_job(client, job_id, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}/").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(f"ingestion job {job_id} did not finish")
+
+
+def view_benchmarks(sizes, repeat, root, log=print):
+    """Upload, analyze and hackrx_run through the Django test client, each request cold."""
+    from rest_framework.test import APIClient
+    from api import views
+
+    results = []
+    client = APIClient()
+    token = client.post("/api/signup/", {
+        "username": "bench", "password": "bench", "organization": "Bench",
+    }, format="json").json()["token"]
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    seed = iter(range(1, 10 ** 6))
+    document_id = None
+    for pages in sizes:
+        def upload():
+            data = synthetic.make_pdf(pages, seed=next(seed))
+            start = time.perf_counter()
+            response = client.post("/api/upload/", {"file": _named(data, "bench.pdf")})
+            job = _wait_for_job(client, response.json()["job_id"])
+            if job["status"] != "succeeded":
+                raise RuntimeError(f"upload failed: {job['error']}")
+            return time.perf_counter() - start, job["document_id"]
+
+        times = []
+        for _ in range(repeat):
+            elapsed, document_id = upload()
+            times.append(elapsed)
+        results.append(summarize(f"view.upload.{pages}", times, items=pages, unit="pages", pages=pages))
+        log(results[-1])
+
+    queries = iter(synthetic.questions(10 ** 4, seed=1))
+
+    def analyze():
+        response = client.post("/api/analyze/", {"query": next(queries), "document_id": document_id}, format="json")
+        assert response.status_code == 200, response.content
+
+    results.append(summarize(
+        "view.analyze", measure(analyze, max(repeat, 10)), items=1, unit="requests", pages=sizes[-1],
+    ))
+    log(results[-1])
+
+    www = os.path.join(root, "www")
+    os.makedirs(www, exist_ok=True)
+    questions = synthetic.questions(5, seed=2)
+    with file_server(www) as base_url:
+        for pages in sizes:
+            if len(synthetic.make_pdf(pages)) > views.MAX_FILE_SIZE:
+                log({"name": f"view.hackrx_run.{pages}", "skipped": "over MAX_FILE_SIZE"})
+                continue
+
+            def hackrx():
+                name = f"doc-{next(seed)}.pdf"
+                with open(os.path.join(www, name), "wb") as f:
+                    f.write(synthetic.make_pdf(pages, seed=next(seed)))
+                response = client.post("/api/v1/hackrx/run", {
+                    "documents": f"{base_url}/{name}", "questions": questions,
+                }, format="json")
+                assert response.status_code == 200, response.content
+
+            results.append(summarize(
+                f"view.hackrx_run.{pages}", measure(hackrx, repeat), items=len(questions), unit="questions",
+                pages=pages,
+            ))
+            log(results[-1])
+    return results
+
+
+def _named(data, name):
+    buf = BytesIO(data)
+    buf.name = name
+    return buf
+
+
+def environment_info():
+    import django
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "django": django.get_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def run_suite(sizes=DEFAULT_SIZES, formats=DEFAULT_FORMATS, repeat=DEFAULT_REPEAT, views=True, log=print):
+    """
+    Run the component benchmarks and, with `views`, the end-to-end view
+    benchmarks against a throwaway test database.
+
+    Returns:
+        dict: {"environment": ..., "config": ..., "results": [...]}
+    """
+    with isolated_environment() as root:
+        results = component_benchmarks(sizes, formats, repeat, log=log)
+        if views:
+            with test_database():
+                results += view_benchmarks(sizes, repeat, root, log=log)
+    return {
+        "environment": environment_info(),
+        "config": {"sizes": list(sizes), "formats": list(formats), "repeat": repeat, "views": views},
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD, min_delta=MIN_DELTA_SECONDS):
+    """
+    Median timings of `current` against `baseline` (both run_suite outputs),
+    matched by benchmark name.
+
+    Returns:
+        list: one dict per shared benchmark, with "regression" set when it
+        is more than `threshold` (relative) and `min_delta` seconds slower
+    """
+    base = {r["name"]: r for r in baseline["results"] if "median_s" in r}
+    rows = []
+    for result in current["results"]:
+        before = base.get(result["name"])
+        if before is None or "median_s" not in result:
+            continue
+        old, new = before["median_s"], result["median_s"]
+        change = (new - old) / old if old > 0 else 0.0
+        rows.append({
+            "name": result["name"],
+            "baseline_s": old,
+            "current_s": new,
+            "change": change,
+            "regression": change > threshold and new - old > min_delta,
+        })
+    return rows
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,158 @@
+import io
+import json
+import random
+from types import SimpleNamespace
+
+import numpy as np
+
+# Deterministic stand-ins for real inputs so the benchmark suite runs offline:
+# policy-like text rendered as PDF or DOCX, a small word-vector model in place
+# of GloVe, and a Groq client that answers instantly.
+
+VOCABULARY = """
+policy insured hospital treatment surgery knee hip cataract cancer dental maternity claim premium
+coverage benefit exclusion waiting period days months years sum assured deductible co-payment
+pre-existing disease illness accident injury emergency ambulance room rent icu daycare procedure
+network provider reimbursement cashless approval document certificate medical practitioner
+diagnosis prescription consultation physiotherapy organ donor transplant renewal grace lapse
+nominee beneficiary proposal declaration condition clause section schedule endorsement limit
+""".split()
+FILLER = "the a of to and in for is be with any under shall by on per".split()
+QUESTION_TEMPLATES = [
+    "Is {a} covered under the policy?",
+    "What is the waiting period for {a}?",
+    "Does the policy cover {a} after {b}?",
+    "{age}M {a} in Pune, {months}-month-old policy",
+    "What are the exclusions for {a} and {b}?",
+]
+
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+PARAGRAPHS_PER_PAGE = 8
+
+
+def sentence(rng, words=WORDS_PER_LINE):
+    out = []
+    for i in range(words):
+        out.append(rng.choice(FILLER) if i % 3 == 1 else rng.choice(VOCABULARY))
+    return " ".join(out).capitalize() + "."
+
+
+def page_lines(rng, lines=LINES_PER_PAGE):
+    return [sentence(rng) for _ in range(lines)]
+
+
+def questions(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        rng.choice(QUESTION_TEMPLATES).format(
+            a=rng.choice(VOCABULARY), b=rng.choice(VOCABULARY),
+            age=rng.randint(20, 70), months=rng.randint(1, 36),
+        )
+        for _ in range(n)
+    ]
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages, seed=0):
+    """A `pages`-page PDF with one text line per sentence, written directly (no PDF library)."""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for _ in range(pages):
+        text = " T* ".join(f"({_pdf_escape(line)}) Tj" for line in page_lines(rng))
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids),
+    )
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def make_docx(pages, seed=0):
+    """A DOCX with PARAGRAPHS_PER_PAGE paragraphs per "page" and a page break after each."""
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+
+    rng = random.Random(seed)
+    doc = Document()
+    per_paragraph = LINES_PER_PAGE // PARAGRAPHS_PER_PAGE
+    for _ in range(pages):
+        lines = page_lines(rng)
+        for i in range(0, len(lines), per_paragraph):
+            doc.add_paragraph(" ".join(lines[i:i + per_paragraph]))
+        doc.paragraphs[-1].add_run().add_break(WD_BREAK.PAGE)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def make_document(fmt, pages, seed=0):
+    if fmt == "pdf":
+        return make_pdf(pages, seed=seed)
+    if fmt == "docx":
+        return make_docx(pages, seed=seed)
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def make_word_vectors(dim=50, seed=0):
+    """Random vectors for the synthetic vocabulary, in the compact layout GloVe is served from."""
+    from api.word_vectors import CompactVectors
+
+    rng = np.random.default_rng(seed)
+    words = sorted(set(VOCABULARY + FILLER))
+    return CompactVectors.from_words(words, rng.standard_normal((len(words), dim)).astype(np.float32))
+
+
+class StubGroq:
+    """Answers every chat completion immediately with a fixed decision."""
+
+    CONTENT = json.dumps({
+        "input": {"age": 46, "gender": "male", "procedure": "knee surgery",
+                  "location": "Pune", "policy_duration": "3 months"},
+        "decision": "Approved",
+        "justification": "Covered after the waiting period.",
+    })
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=self)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.CONTENT))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0),
+        )
+
+
+class AsyncStubGroq(StubGroq):
+    """StubGroq with the AsyncGroq interface, for the async views."""
+
+    async def create(self, **kwargs):
+        return super().create(**kwargs)
@@ -0,0 +1,166 @@
+import io
+import os
+import re
+
+import numpy as np
+
+from .embeddings import cosine_scores, top_k_indices
+
+# Per-document inverted index (term -> chunks containing it, with term
+# frequencies) scored with Okapi BM25 and fused with the embedding cosine
+# scores. Averaged GloVe vectors blur exact policy terms; BM25 does not.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Weight of the cosine score in the fused score; the rest goes to BM25
+HYBRID_ALPHA = float(os.environ.get("HYBRID_ALPHA", 0.5))
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have he her his i if in into is it its me my of on or our
+she that the their them they this to was we were what when which who will with you your
+""".split())
+
+TERMS_FILE = "bm25_terms.txt"
+POSTINGS_FILE = "bm25_postings.npy"
+
+
+def tokenize(text):
+    """Lowercased terms; hyphenated words such as "pre-existing" stay whole."""
+    return [t for t in TERM_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Builder:
+    """Accumulates chunks one at a time, so it can sit on a chunk stream."""
+
+    def __init__(self):
+        self.term_ids = {}
+        self.postings = []  # per term: list of (chunk, tf)
+        self.doc_lengths = []
+
+    def add(self, text):
+        chunk = len(self.doc_lengths)
+        terms = tokenize(text)
+        self.doc_lengths.append(len(terms))
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.postings)
+                self.postings.append([])
+            self.postings[term_id].append((chunk, tf))
+
+    def build(self):
+        terms = [None] * len(self.term_ids)
+        for term, term_id in self.term_ids.items():
+            terms[term_id] = term
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in self.postings])
+        flat = np.array(
+            [entry for posting in self.postings for entry in posting], dtype=np.int32
+        ).reshape(-1, 2)
+        return BM25Index(terms, offsets, flat[:, 0], flat[:, 1], np.asarray(self.doc_lengths, dtype=np.int32))
+
+
+class BM25Index:
+    def __init__(self, terms, offsets, chunk_ids, tfs, doc_lengths):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.chunk_ids = chunk_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.num_chunks = len(doc_lengths)
+        self.avgdl = float(doc_lengths.mean()) if self.num_chunks else 0.0
+
+    @classmethod
+    def build(cls, chunks):
+        builder = BM25Builder()
+        for chunk in chunks:
+            builder.add(chunk)
+        return builder.build()
+
+    def scores(self, query):
+        out = np.zeros(self.num_chunks, dtype=np.float32)
+        if not self.num_chunks or not self.avgdl:
+            return out
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.chunk_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1.0 + (self.num_chunks - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[rows] / self.avgdl)
+            out[rows] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+        return out
+
+    def to_files(self):
+        """Serialized form for write_bundle(extra_files=...)."""
+        buf = io.BytesIO()
+        packed = np.concatenate([
+            np.array([len(self.terms), len(self.chunk_ids), self.num_chunks], dtype=np.int64),
+            self.offsets.astype(np.int64),
+            self.chunk_ids.astype(np.int64),
+            self.tfs.astype(np.int64),
+            self.doc_lengths.astype(np.int64),
+        ])
+        np.save(buf, packed)
+        return {
+            TERMS_FILE: "\n".join(self.terms).encode("utf-8"),
+            POSTINGS_FILE: buf.getvalue(),
+        }
+
+    @classmethod
+    def load(cls, path):
+        """Load from a bundle directory; returns None when it has no BM25 files."""
+        terms_path = os.path.join(path, TERMS_FILE)
+        postings_path = os.path.join(path, POSTINGS_FILE)
+        if not (os.path.exists(terms_path) and os.path.exists(postings_path)):
+            return None
+        with open(terms_path, "rb") as f:
+            raw = f.read().decode("utf-8")
+        terms = raw.split("\n") if raw else []
+        packed = np.load(postings_path)
+        n_terms, n_postings, n_chunks = (int(x) for x in packed[:3])
+        pos = 3
+        offsets = packed[pos:pos + n_terms + 1]
+        pos += n_terms + 1
+        chunk_ids = packed[pos:pos + n_postings].astype(np.int32)
+        pos += n_postings
+        tfs = packed[pos:pos + n_postings].astype(np.int32)
+        pos += n_postings
+        doc_lengths = packed[pos:pos + n_chunks].astype(np.int32)
+        return cls(terms, offsets, chunk_ids, tfs, doc_lengths)
+
+
+def fuse_scores(cosine, lexical, alpha=HYBRID_ALPHA):
+    """
+    Weighted sum of cosine similarity and max-normalized BM25, so the fused
+    score stays on the cosine scale (and in the "similarity" % shown to users).
+    """
+    top = lexical.max() if lexical.size else 0.0
+    if top <= 0:
+        return cosine
+    return alpha * cosine + (1.0 - alpha) * (lexical / top)
+
+
+def hybrid_top_k_batch(queries, query_embeddings, chunk_embeddings, chunks, bm25=None, k=3, alpha=HYBRID_ALPHA):
+    """
+    Like embeddings.get_top_k_chunks_batch, but fuses in BM25 scores when the
+    document has an inverted index. Without one it is pure cosine ranking.
+    """
+    cosine = cosine_scores(query_embeddings, chunk_embeddings)
+    results = []
+    for query, row in zip(queries, cosine):
+        if bm25 is not None and bm25.num_chunks == len(row):
+            row = fuse_scores(row, bm25.scores(query), alpha)
+        results.append([(chunks[i], float(row[i])) for i in top_k_indices(row, k)])
+    return results
+
+
+def hybrid_top_k(query, query_embedding, chunk_embeddings, chunks, bm25=None, k=3, alpha=HYBRID_ALPHA):
+    return hybrid_top_k_batch([query], [query_embedding], chunk_embeddings, chunks, bm25=bm25, k=k, alpha=alpha)[0]
@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+import threading
+
+from .doc_store import StoredDocument, write_bundle, evict_bundles, touch, META_FILE
+
+# Dedup cache for parse_document -> split_text_to_chunks -> embed_chunks.
+# Entries are keyed by the SHA-256 of the raw upload plus every parameter that
+# changes the output, and use the same on-disk layout as the document store.
+CACHE_DIR = os.environ.get("CONTENT_CACHE_DIR", os.path.join(os.path.dirname(__file__), "content_cache"))
+MAX_CACHE_BYTES = int(os.environ.get("CONTENT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Bump whenever parsing, chunking or embedding output changes for the same input
+PIPELINE_VERSION = 4
+
+TEXT_FILE = "text.txt"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_content_hash(file, block_size=1024 * 1024):
+    """content_hash of a binary file object, read in blocks; rewinds it afterwards."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(block_size), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class CachedDocument(StoredDocument):
+    def __init__(self, path):
+        super().__init__(path)
+        self.content_hash = self.meta.get("content_hash")
+        self._text = None
+
+    @property
+    def text(self):
+        """The parsed document text, read from text.txt on first access."""
+        if self._text is None:
+            with open(os.path.join(self.path, TEXT_FILE), "rb") as f:
+                self._text = f.read().decode("utf-8")
+        return self._text
+
+
+class ContentCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, digest, filename, **params):
+        """
+        Cache key for a document whose raw bytes hash to `digest`. The file
+        extension is included because it selects the parser.
+        """
+        params = dict(
+            params,
+            ext=os.path.splitext(filename or "")[1],
+            version=PIPELINE_VERSION,
+        )
+        payload = digest + json.dumps(params, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        entry = None
+        if os.path.isfile(os.path.join(path, META_FILE)):
+            try:
+                entry = CachedDocument(path)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Unreadable content cache entry {key}: {e}")
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is not None:
+            touch(path)
+        return entry
+
+    def put(self, key, text, chunks, embeddings, content_hash=None, spans=None, bm25=None):
+        path = os.path.join(self.root, key)
+        extra_files = {TEXT_FILE: text.encode("utf-8")}
+        if bm25 is not None:
+            extra_files.update(bm25.to_files())
+        try:
+            write_bundle(
+                path, chunks, embeddings,
+                meta={"content_hash": content_hash, "num_chunks": len(chunks)},
+                extra_files=extra_files,
+                spans=spans,
+            )
+        except OSError as e:
+            # Another worker may have published the same entry concurrently
+            print(f"[WARN] Failed to write content cache entry {key}: {e}")
+            return
+        evict_bundles(self.root, self.max_bytes, keep={key})
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+content_cache = ContentCache()
@@ -0,0 +1,342 @@
+import os
+import json
+import mmap
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# Disk-backed replacement for the old per-process DOC_STORAGE dict.
+# Every document lives in its own directory:
+#   embeddings.npy  float32 (n_chunks, dim), rows normalized (see build_embedding_matrix)
+#   chunks.txt      UTF-8 chunk texts, concatenated
+#   offsets.npy     int64 (n_chunks + 1) byte offsets into chunks.txt
+#   spans.npy       optional int64 (n_chunks, 4): page_start, page_end,
+#                   char_start, char_end of each chunk (-1 = unknown page)
+#   bm25_*          optional per-document inverted index (see api.bm25)
+#   meta.json       filename and anything else small
+# The bundle path itself is a symlink to a hidden versioned directory
+# (".<name>-<hex>") so a rewrite can swap it in with a single rename.
+# Files are opened with mmap, so all workers on a node share one copy through
+# the page cache instead of holding their own.
+STORE_DIR = os.environ.get("DOC_STORE_DIR", os.path.join(os.path.dirname(__file__), "doc_store"))
+MAX_STORE_BYTES = int(os.environ.get("DOC_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+MAX_OPEN_DOCUMENTS = int(os.environ.get("DOC_STORE_MAX_OPEN", 64))
+# Versioned directories no link points at (left by racing writers) are swept
+# by evict_bundles once they are this old
+ORPHAN_GRACE_SECONDS = 60
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.txt"
+OFFSETS_FILE = "offsets.npy"
+SPANS_FILE = "spans.npy"
+META_FILE = "meta.json"
+
+
+class ChunkList:
+    """Read-only sequence of chunk texts decoded on access from a mapped blob."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class StoredDocument:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            st = os.fstat(f.fileno())
+            # identifies this version of the bundle; a rewrite creates a new meta file
+            self.version = (st.st_dev, st.st_ino)
+            self.meta = json.load(f)
+        self.filename = self.meta.get("filename")
+        self.embeddings = load_array(os.path.join(path, EMBEDDINGS_FILE))
+        offsets = load_array(os.path.join(path, OFFSETS_FILE))
+        spans_path = os.path.join(path, SPANS_FILE)
+        self.spans = load_array(spans_path) if os.path.exists(spans_path) else None
+        with open(os.path.join(path, CHUNKS_FILE), "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                blob = b""
+        # Mappings are released when the last reference goes away, so a handle
+        # evicted from the LRU stays valid for requests still using it.
+        self.chunks = ChunkList(blob, offsets)
+        self._bm25 = None
+
+    @property
+    def bm25(self):
+        """The document's BM25Index, or None for bundles written without one."""
+        if self._bm25 is None:
+            from .bm25 import BM25Index
+            self._bm25 = BM25Index.load(self.path) or False
+        return self._bm25 or None
+
+
+def load_array(path):
+    # np.load refuses to memory-map zero-length arrays
+    arr = np.load(path, mmap_mode="r")
+    return arr if arr.size else np.array(arr)
+
+
+def write_bundle(path, chunks, embeddings, meta=None, extra_files=None, spans=None):
+    """
+    Atomically write chunks + embedding matrix in the store layout to `path`.
+    Readers either see the previous bundle or the complete new one.
+    `extra_files` maps additional file names to bytes stored alongside.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_path)
+    try:
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+        with open(os.path.join(tmp_path, CHUNKS_FILE), "wb") as f:
+            for b in encoded:
+                f.write(b)
+        np.save(os.path.join(tmp_path, OFFSETS_FILE), offsets)
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), np.asarray(embeddings, dtype=np.float32))
+        if spans is not None:
+            np.save(os.path.join(tmp_path, SPANS_FILE), np.asarray(spans, dtype=np.int64).reshape(-1, 4))
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta or {}, f)
+        for name, data in (extra_files or {}).items():
+            with open(os.path.join(tmp_path, name), "wb") as f:
+                f.write(data)
+        publish_bundle(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def publish_bundle(tmp_path, path):
+    """
+    Make the complete directory `tmp_path` the bundle at `path`. The directory
+    becomes a hidden version and `path` a symlink to it; replacing the link is
+    a single rename, so readers see either the previous bundle or the new one.
+    """
+    parent = os.path.dirname(path)
+    version = os.path.join(parent, f".{os.path.basename(path)}-{uuid.uuid4().hex}")
+    link = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.rename(tmp_path, version)
+    try:
+        os.symlink(os.path.basename(version), link)
+        previous = bundle_target(path)
+        if previous == path:
+            # Bundle written before versioned directories: a directory can't be
+            # renamed over, so this one upgrade is not atomic
+            shutil.rmtree(path, ignore_errors=True)
+        os.replace(link, path)
+    except OSError:
+        if os.path.lexists(link):
+            os.unlink(link)
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+    if previous is not None and previous != path:
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def bundle_target(path):
+    """The directory holding the files of the bundle at `path`, or None."""
+    if os.path.islink(path):
+        try:
+            return os.path.join(os.path.dirname(path), os.readlink(path))
+        except OSError:
+            return None
+    return path if os.path.isdir(path) else None
+
+
+def remove_bundle(path):
+    target = bundle_target(path)
+    if os.path.islink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    if target is not None:
+        shutil.rmtree(target, ignore_errors=True)
+
+
+def bundle_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def touch(path):
+    try:
+        os.utime(os.path.join(path, META_FILE))
+    except OSError:
+        pass
+
+
+def last_used(path):
+    try:
+        return os.path.getmtime(os.path.join(path, META_FILE))
+    except OSError:
+        return 0.0
+
+
+def evict_bundles(root, max_bytes, keep=()):
+    """
+    Delete least recently used bundles under `root` until the total size is
+    within `max_bytes`. Returns the names of the removed bundles.
+    """
+    if not os.path.isdir(root):
+        return []
+    entries = []
+    total = 0
+    names = os.listdir(root)
+    _sweep_orphans(root, names)
+    for name in names:
+        path = os.path.join(root, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        size = bundle_size(path)
+        total += size
+        entries.append((last_used(path), name, path, size))
+
+    removed = []
+    for _, name, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name in keep:
+            continue
+        remove_bundle(path)
+        total -= size
+        removed.append(name)
+    return removed
+
+
+def _sweep_orphans(root, names):
+    """Remove versioned directories that lost a publish race to another writer."""
+    now = time.time()
+    for name in names:
+        if not name.startswith(".") or name.startswith(".tmp-") or "-" not in name:
+            continue
+        link = os.path.join(root, name[1:].rsplit("-", 1)[0])
+        try:
+            if os.path.islink(link) and os.readlink(link) == name:
+                continue
+            if now - os.path.getmtime(os.path.join(root, name)) < ORPHAN_GRACE_SECONDS:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class DocumentStore:
+    def __init__(self, root=STORE_DIR, max_bytes=MAX_STORE_BYTES, max_open=MAX_OPEN_DOCUMENTS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, document_id):
+        # document ids are UUIDs; normalizing also rejects path tricks
+        return os.path.join(self.root, str(uuid.UUID(str(document_id))))
+
+    def save(self, document_id, chunks, embeddings, filename=None, spans=None, bm25=None, **meta):
+        """
+        Store the document, evicting least recently used ones to stay within
+        max_bytes. Returns the ids of the evicted documents.
+        """
+        path = self._path(document_id)
+        meta = dict(meta, filename=filename, num_chunks=len(chunks))
+        extra_files = bm25.to_files() if bm25 is not None else None
+        write_bundle(path, chunks, embeddings, meta, extra_files=extra_files, spans=spans)
+        self._forget(os.path.basename(path))
+        evicted = evict_bundles(self.root, self.max_bytes, keep={os.path.basename(path)})
+        for name in evicted:
+            self._forget(name)
+        return evicted
+
+    def get(self, document_id):
+        """Return the StoredDocument for `document_id`, or None if it is not stored."""
+        try:
+            path = self._path(document_id)
+        except ValueError:
+            return None
+        key = os.path.basename(path)
+        with self._lock:
+            doc = self._open.get(key)
+            if doc is not None:
+                self._open.move_to_end(key)
+        try:
+            st = os.stat(os.path.join(path, META_FILE))
+        except OSError:
+            # deleted or evicted, possibly by another worker
+            self._forget(key)
+            return None
+        if doc is not None:
+            if doc.version == (st.st_dev, st.st_ino):
+                touch(path)
+                return doc
+            self._forget(key)
+        for attempt in range(2):
+            try:
+                doc = StoredDocument(path)
+                break
+            except FileNotFoundError:
+                # the bundle was swapped while we were opening it
+                if attempt:
+                    return None
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Failed to open stored document {key}: {e}")
+                return None
+        touch(path)
+        with self._lock:
+            self._open[key] = doc
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return doc
+
+    def __contains__(self, document_id):
+        try:
+            return os.path.isfile(os.path.join(self._path(document_id), META_FILE))
+        except ValueError:
+            return False
+
+    def delete(self, document_id):
+        try:
+            path = self._path(document_id)
+        except ValueError:
+            return
+        self._forget(os.path.basename(path))
+        remove_bundle(path)
+
+    def _forget(self, key):
+        with self._lock:
+            self._open.pop(key, None)
+
+
+document_store = DocumentStore()
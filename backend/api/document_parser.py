@@ -1,26 +1,198 @@
 import os
-import nltk
-# Dynamically add the local nltk_data path
+import re
+import shutil
+import zipfile
+import tempfile
+import multiprocessing
+from xml.etree.ElementTree import iterparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .metrics import timed_iter
+
+# NLTK and pdfplumber are imported inside the functions that use them so
+# importing this module stays cheap; see api.warmup for preloading.
 LOCAL_NLTK_DATA = os.path.join(os.path.dirname(__file__), "nltk_data")
-nltk.data.path.append(LOCAL_NLTK_DATA)
 
-from nltk.tokenize import sent_tokenize
-import pdfplumber
-from docx import Document
+# "punkt" (NLTK, default) or "regex" (faster, slightly less accurate)
+SENTENCE_SPLITTER = os.environ.get("SENTENCE_SPLITTER", "punkt")
+
+DEFAULT_MAX_PAGES = 300
+DEFAULT_MAX_PARAGRAPHS = 500
+DEFAULT_MAX_WORDS = 300
+
+# pdfplumber is CPU-bound and holds the GIL, so larger PDFs are split into
+# page ranges and extracted in a process pool.
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+
+_pdf_pool = None
+
+def _get_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: forking a threaded server process is not safe
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    _pdf_pool = None
+
+def _extract_page_range(path, start, stop):
+    import pdfplumber
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for i in range(start, min(stop, len(pdf.pages))):
+            page = pdf.pages[i]
+            pages.append((i, page.extract_text() or ""))
+            page.close()
+    return pages
+
+def iter_pdf_pages(file, max_pages=DEFAULT_MAX_PAGES, workers=None):
+    """
+    Yield (page_index, text) for the first `max_pages` pages, in page order,
+    as soon as each page range is extracted.
+    """
+    import pdfplumber
+    workers = PDF_WORKERS if workers is None else workers
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        # Workers open the PDF by path instead of receiving the bytes per task
+        shutil.copyfileobj(file, tmp)
+        tmp.flush()
+
+        with pdfplumber.open(tmp.name) as pdf:
+            num_pages = min(len(pdf.pages), max_pages)
+            if workers <= 1 or num_pages <= PDF_PAGES_PER_TASK:
+                for i in range(num_pages):
+                    page = pdf.pages[i]
+                    yield i, page.extract_text() or ""
+                    page.close()
+                return
 
-def extract_text_from_pdf(file, max_pages=50):
-    text = ""
+        pool = _get_pdf_pool()
+        futures = [
+            pool.submit(_extract_page_range, tmp.name, start, min(start + PDF_PAGES_PER_TASK, num_pages))
+            for start in range(0, num_pages, PDF_PAGES_PER_TASK)
+        ]
+        try:
+            for future in futures:
+                yield from future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM); start a fresh pool next time
+            _reset_pdf_pool()
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+def count_pdf_pages(file, max_pages=DEFAULT_MAX_PAGES):
+    """Page count (capped at max_pages) without extracting any text."""
+    import pdfplumber
     with pdfplumber.open(file) as pdf:
-        for i, page in enumerate(pdf.pages):
-            if i >= max_pages:
-                break
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text.strip()
+        return min(len(pdf.pages), max_pages)
+
+def extract_text_from_pdf(file, max_pages=DEFAULT_MAX_PAGES):
+    return "\n".join(text for _, text in iter_pdf_pages(file, max_pages=max_pages) if text).strip()
+
+
+# DOCX is read straight from word/document.xml with iterparse: body
+# paragraphs and table rows come out in document order and each one is
+# dropped from the tree once yielded, so memory stays flat however long the
+# document is. python-docx would build the whole object tree first and only
+# exposes body paragraphs, leaving benefit schedules in tables behind.
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+# Cells of a table row are joined with this
+DOCX_CELL_SEPARATOR = " | "
 
+def iter_docx_paragraphs(file, max_paragraphs=DEFAULT_MAX_PARAGRAPHS):
+    """
+    Yield the text of each non-empty body paragraph and table row, in
+    document order. Paragraphs and rows both count towards `max_paragraphs`
+    (empty ones included, as python-docx counts them); nothing past the limit
+    is parsed. Nested tables are flattened into their cell, and text boxes
+    into their paragraph.
+    """
+    with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as xml:
+        seen = 0
+        body = None
+        table_depth = paragraph_depth = fallback_depth = 0
+        text = []       # pieces of the outermost paragraph being read
+        cell = []       # paragraph texts of the current top-level table cell
+        row = []        # cell texts of the current top-level table row
+        for event, elem in iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == _MC_FALLBACK:
+                    # Alternate rendering of content already read from mc:Choice
+                    fallback_depth += 1
+                elif fallback_depth:
+                    pass
+                elif tag == _W + "p":
+                    paragraph_depth += 1
+                elif tag == _W + "tbl":
+                    table_depth += 1
+                elif tag == _W + "body":
+                    body = elem
+                continue
 
-def extract_text_from_docx(file, max_paragraphs=500):
+            if fallback_depth:
+                if tag == _MC_FALLBACK:
+                    fallback_depth -= 1
+            elif tag == _W + "t":
+                text.append(elem.text or "")
+            elif tag == _W + "tab":
+                text.append("\t")
+            elif tag == _W + "br":
+                if elem.get(_W + "type") not in ("page", "column"):
+                    text.append("\n")
+            elif tag == _W + "cr":
+                text.append("\n")
+            elif tag == _W + "p":
+                paragraph_depth -= 1
+                if paragraph_depth:
+                    continue
+                paragraph = "".join(text).strip()
+                text.clear()
+                if table_depth:
+                    if paragraph:
+                        cell.append(paragraph)
+                    continue
+                if seen >= max_paragraphs:
+                    return
+                seen += 1
+                if paragraph:
+                    yield paragraph
+                if body is not None:
+                    body.clear()
+            elif tag == _W + "tc" and table_depth == 1:
+                row.append(" ".join(cell))
+                cell.clear()
+            elif tag == _W + "tr" and table_depth == 1:
+                line = DOCX_CELL_SEPARATOR.join(c for c in row if c)
+                row.clear()
+                if seen >= max_paragraphs:
+                    return
+                seen += 1
+                if line:
+                    yield line
+                elem.clear()
+            elif tag == _W + "tbl":
+                table_depth -= 1
+                if not table_depth and body is not None:
+                    body.clear()
+
+def extract_text_from_docx(file, max_paragraphs=DEFAULT_MAX_PARAGRAPHS):
+    return "\n".join(iter_docx_paragraphs(file, max_paragraphs=max_paragraphs)).strip()
+
+def extract_text_python_docx(file, max_paragraphs=DEFAULT_MAX_PARAGRAPHS):
+    """The python-docx extractor iter_docx_paragraphs replaced (body paragraphs only); kept for benchmarks."""
+    from docx import Document
     doc = Document(file)
     lines = []
     for i, p in enumerate(doc.paragraphs):
@@ -31,41 +203,199 @@ def extract_text_from_docx(file, max_paragraphs=500):
             lines.append(text)
     return "\n".join(lines).strip()
 
-def parse_document(file_obj, filename, max_pages=50, max_paragraphs=500):
+def iter_document_blocks(file_obj, filename, max_pages=DEFAULT_MAX_PAGES, max_paragraphs=DEFAULT_MAX_PARAGRAPHS):
+    """
+    Yield (page, text) blocks as the document is extracted: one per non-empty
+    PDF page, or one per DOCX paragraph or table row with page None.
+    """
+    return timed_iter("parse", _iter_document_blocks(file_obj, filename, max_pages, max_paragraphs))
+
+def _iter_document_blocks(file_obj, filename, max_pages, max_paragraphs):
     if filename.endswith(".pdf"):
-        return extract_text_from_pdf(file_obj, max_pages=max_pages)
+        for page, text in iter_pdf_pages(file_obj, max_pages=max_pages):
+            if text:
+                yield page, text
     elif filename.endswith(".docx"):
-        return extract_text_from_docx(file_obj, max_paragraphs=max_paragraphs)
+        for text in iter_docx_paragraphs(file_obj, max_paragraphs=max_paragraphs):
+            yield None, text
     else:
         raise ValueError("Unsupported file format")
 
-def split_text_to_chunks(text, max_words=300):
-    paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
-    chunks = []
-    current_chunk = ""
-    current_word_count = 0
+def parse_document(file_obj, filename, max_pages=DEFAULT_MAX_PAGES, max_paragraphs=DEFAULT_MAX_PARAGRAPHS):
+    return "\n".join(text for _, text in iter_document_blocks(
+        file_obj, filename, max_pages=max_pages, max_paragraphs=max_paragraphs
+    )).strip()
 
-    for para in paragraphs:
-        try:
-            # Attempt tokenization using Punkt
-            sentences = sent_tokenize(para, language="english")
-        except LookupError as e:
-            raise RuntimeError(
-                f"NLTK resource missing: {e}\n"
-                f"Ensure 'punkt' and 'punkt_tab/english' are available under: {LOCAL_NLTK_DATA}"
-            )
-
-        for sent in sentences:
-            sent_word_count = len(sent.split())
-            if current_word_count + sent_word_count > max_words:
-                chunks.append(current_chunk.strip())
-                current_chunk = sent
-                current_word_count = sent_word_count
-            else:
-                current_chunk += " " + sent if current_chunk else sent
-                current_word_count += sent_word_count
-
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    return chunks
+# page_start/page_end come from the source blocks; char_start/char_end index
+# into the document text as parse_document joins it (blocks joined by "\n").
+Chunk = namedtuple("Chunk", ["id", "text", "page_start", "page_end", "char_start", "char_end"])
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_words(text):
+    return len(text.split())
+
+def estimate_tokens(text):
+    """Rough LLM token count: words plus punctuation marks."""
+    return len(TOKEN_PATTERN.findall(text))
+
+_punkt_tokenize = None
+
+def punkt_sent_tokenize(text):
+    global _punkt_tokenize
+    if _punkt_tokenize is None:
+        import nltk
+        # Dynamically add the local nltk_data path
+        if LOCAL_NLTK_DATA not in nltk.data.path:
+            nltk.data.path.append(LOCAL_NLTK_DATA)
+        from nltk.tokenize import sent_tokenize
+        _punkt_tokenize = sent_tokenize
+    try:
+        # Attempt tokenization using Punkt
+        return _punkt_tokenize(text, language="english")
+    except LookupError as e:
+        raise RuntimeError(
+            f"NLTK resource missing: {e}\n"
+            f"Ensure 'punkt' and 'punkt_tab/english' are available under: {LOCAL_NLTK_DATA}"
+        )
+
+# Titles and policy-document abbreviations that end in "." without ending a sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "vs", "etc", "no", "nos",
+    "sec", "cl", "art", "fig", "approx", "incl", "max", "min", "rs", "e.g", "i.e",
+}
+SENTENCE_BOUNDARY = re.compile(r"[.!?]+[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+
+def regex_sent_tokenize(text):
+    """Lightweight sentence splitter; no model to load and several times faster than Punkt."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        candidate = text[start:match.end()].rstrip()
+        last_word = candidate.rsplit(None, 1)[-1].rstrip(".!?\"')]").lower()
+        if last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()):
+            continue
+        sentences.append(candidate)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+SENTENCE_SPLITTERS = {
+    "punkt": punkt_sent_tokenize,
+    "regex": regex_sent_tokenize,
+}
+
+def get_sentence_splitter(name=None):
+    name = name or SENTENCE_SPLITTER
+    try:
+        return SENTENCE_SPLITTERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown sentence splitter: {name}")
+
+def _iter_sentences(blocks, sent_tokenize):
+    """Yield (page, char_start, char_end, sentence) for every sentence in `blocks`."""
+    offset = 0
+    for ordinal, block in enumerate(blocks):
+        page, text = block if isinstance(block, tuple) else (ordinal, block)
+        line_start = offset
+        for line in text.split("\n"):
+            para = line.strip()
+            if para:
+                para_start = line_start + len(line) - len(line.lstrip())
+                pos = 0
+                for sent in sent_tokenize(para):
+                    found = para.find(sent, pos)
+                    if found >= 0:
+                        pos = found
+                    yield page, para_start + pos, para_start + pos + len(sent), sent
+                    pos += len(sent)
+            line_start += len(line) + 1
+        offset += len(text) + 1
+
+def _split_long_sentence(page, start, sent, max_tokens, count_tokens):
+    # A "sentence" longer than a whole chunk (tables, unpunctuated text) is
+    # cut on word boundaries so no chunk grows without bound.
+    piece_start = piece_end = None
+    tokens = 0
+    for match in re.finditer(r"\S+", sent):
+        n = count_tokens(match.group())
+        if piece_start is not None and tokens + n > max_tokens:
+            yield page, start + piece_start, start + piece_end, sent[piece_start:piece_end]
+            piece_start, tokens = None, 0
+        if piece_start is None:
+            piece_start = match.start()
+        piece_end = match.end()
+        tokens += n
+    if piece_start is not None:
+        yield page, start + piece_start, start + piece_end, sent[piece_start:piece_end]
+
+def _make_chunk(chunk_id, parts):
+    return Chunk(
+        id=chunk_id,
+        text=" ".join(part[3] for part in parts),
+        page_start=parts[0][0],
+        page_end=parts[-1][0],
+        char_start=parts[0][1],
+        char_end=parts[-1][2],
+    )
+
+def _overlap_tail(parts, overlap):
+    tail = []
+    tokens = 0
+    for part in reversed(parts[1:]):
+        if tokens + part[4] > overlap:
+            break
+        tail.append(part)
+        tokens += part[4]
+    tail.reverse()
+    return tail
+
+def iter_chunk_records(blocks, max_words=DEFAULT_MAX_WORDS, overlap=0, count_tokens=count_words, splitter=None):
+    """
+    Chunk an iterable of text blocks -- strings or (page, text) pairs as
+    produced by iter_document_blocks -- yielding Chunk records as soon as
+    each one is full. Only the sentences of the chunk being built are held.
+
+    Parameters:
+        - max_words (int): chunk budget, measured with `count_tokens`
+        - overlap (int): up to this many tokens of trailing sentences are
+          repeated at the start of the next chunk
+        - count_tokens (callable): count_words (default) or estimate_tokens
+        - splitter (str): "punkt" or "regex"; defaults to SENTENCE_SPLITTER
+    """
+    return timed_iter("chunk", _iter_chunk_records(blocks, max_words, overlap, count_tokens, splitter))
+
+def _iter_chunk_records(blocks, max_words, overlap, count_tokens, splitter):
+    sent_tokenize = get_sentence_splitter(splitter)
+    parts = []
+    tokens = 0
+    chunk_id = 0
+
+    for page, start, end, sent in _iter_sentences(blocks, sent_tokenize):
+        n = count_tokens(sent)
+        if n <= max_words:
+            pieces = [(page, start, end, sent, n)]
+        else:
+            pieces = [
+                (p, s, e, t, count_tokens(t))
+                for p, s, e, t in _split_long_sentence(page, start, sent, max_words, count_tokens)
+            ]
+
+        for piece in pieces:
+            if parts and tokens + piece[4] > max_words:
+                yield _make_chunk(chunk_id, parts)
+                chunk_id += 1
+                parts = _overlap_tail(parts, overlap) if overlap else []
+                tokens = sum(part[4] for part in parts)
+                if parts and tokens + piece[4] > max_words:
+                    parts, tokens = [], 0
+            parts.append(piece)
+            tokens += piece[4]
+
+    if parts:
+        yield _make_chunk(chunk_id, parts)
+
+def split_text_to_chunks(text, max_words=DEFAULT_MAX_WORDS, splitter=None):
+    return [chunk.text for chunk in iter_chunk_records([text], max_words=max_words, splitter=splitter)]
@@ -0,0 +1,289 @@
+import os
+import json
+import uuid
+import shutil
+import asyncio
+import hashlib
+import time
+import tempfile
+import weakref
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .doc_store import META_FILE, bundle_target, evict_bundles, publish_bundle, touch
+
+# Document downloads for hackrx_run. One pooled keep-alive session is shared
+# by all requests; bodies are streamed against the size cap and kept in RAM
+# only up to DOWNLOAD_SPOOL_BYTES. Responses carrying an ETag or Last-Modified
+# are kept on disk and revalidated with a conditional GET next time.
+# fetch_async does the same on an httpx.AsyncClient for the async views.
+DOWNLOAD_POOL_SIZE = int(os.environ.get("DOWNLOAD_POOL_SIZE", 16))
+DOWNLOAD_SPOOL_BYTES = int(os.environ.get("DOWNLOAD_SPOOL_BYTES", 256 * 1024))
+DOWNLOAD_CACHE_DIR = os.environ.get("DOWNLOAD_CACHE_DIR", os.path.join(os.path.dirname(__file__), "download_cache"))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get("DOWNLOAD_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+BODY_FILE = "body"
+
+
+class DownloadError(Exception):
+    """The document could not be fetched."""
+
+
+class DownloadTooLarge(DownloadError):
+    """The document is bigger than the allowed size."""
+
+
+def make_session(pool_size=DOWNLOAD_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_async_client(pool_size=DOWNLOAD_POOL_SIZE):
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return httpx.AsyncClient(limits=limits, follow_redirects=True)
+
+
+def _check_length(headers, max_bytes):
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise DownloadTooLarge(f"Content-Length {length} is over {max_bytes} bytes")
+
+
+def _timeout(timeout, deadline):
+    """Socket timeout for the next request: `timeout`, cut to what is left before `deadline`."""
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DownloadError("no time left before the deadline")
+    return min(timeout, remaining)
+
+
+class _BodyWriter:
+    """Writes response blocks to `out`, enforcing the size cap and the deadline."""
+
+    def __init__(self, out, max_bytes, deadline=None):
+        self.out = out
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.total = 0
+
+    def write(self, block):
+        self.total += len(block)
+        if self.total > self.max_bytes:
+            raise DownloadTooLarge(f"more than {self.max_bytes} bytes")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DownloadError("download did not finish before the deadline")
+        self.out.write(block)
+
+    def finish(self):
+        self.out.flush()
+        self.out.seek(0)
+
+
+class Downloader:
+    def __init__(self, session=None, cache_dir=DOWNLOAD_CACHE_DIR, max_cache_bytes=DOWNLOAD_CACHE_MAX_BYTES):
+        self.session = session or make_session()
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _entry_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def _cached(self, url):
+        # Meta and body are read from the same version of the entry
+        path = bundle_target(self._entry_path(url))
+        if path is None:
+            return None, None
+        try:
+            with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        return path, meta
+
+    def _revalidation(self, url):
+        """(cache entry path, its meta, conditional request headers) for `url`."""
+        path, meta = self._cached(url)
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return path, meta, headers
+
+    def _cache_hit(self, path, meta, max_bytes):
+        """
+        The cached body after a 304, or None if the entry has been evicted
+        meanwhile or its body is not the size it was stored with. The cap
+        applies as it does to a fresh download.
+        """
+        try:
+            body = open(os.path.join(path, BODY_FILE), "rb")
+        except OSError:
+            return None
+        size = os.fstat(body.fileno()).st_size
+        if size != meta.get("size", size):
+            print(f"[WARN] Cached download of {meta.get('url')} is damaged ({size} bytes), fetching it again")
+            body.close()
+            return None
+        if size > max_bytes:
+            body.close()
+            raise DownloadTooLarge(f"cached body of {size} bytes is over {max_bytes} bytes")
+        touch(path)
+        with self._lock:
+            self.hits += 1
+        return body
+
+    def fetch(self, url, max_bytes, timeout=10, deadline=None):
+        """
+        Binary file object (positioned at 0) with the body of `url`. The
+        caller closes it. `timeout` is the socket timeout; `deadline`, a
+        time.monotonic() value, bounds the whole download.
+
+        Raises:
+            DownloadTooLarge: the body is over `max_bytes`
+            DownloadError: the request failed or returned an error status
+        """
+        path, meta, headers = self._revalidation(url)
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=_timeout(timeout, deadline)) as response:
+                if response.status_code == 304 and meta is not None:
+                    body = self._cache_hit(path, meta, max_bytes)
+                    if body is not None:
+                        return body
+                    # Entry evicted or damaged under us; fetch it unconditionally
+                    return self._fetch_fresh(url, max_bytes, timeout, deadline)
+                return self._read_response(url, response, max_bytes, deadline)
+        except requests.RequestException as e:
+            raise DownloadError(str(e)) from e
+
+    def _fetch_fresh(self, url, max_bytes, timeout, deadline):
+        with self.session.get(url, stream=True, timeout=_timeout(timeout, deadline)) as response:
+            return self._read_response(url, response, max_bytes, deadline)
+
+    def _read_response(self, url, response, max_bytes, deadline):
+        out, tmp_path = self._open_body(response, max_bytes)
+        try:
+            writer = _BodyWriter(out, max_bytes, deadline)
+            for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                writer.write(block)
+            writer.finish()
+            return self._publish(url, out, tmp_path, response.headers)
+        except Exception:
+            self._discard(out, tmp_path)
+            raise
+
+    def _async_client(self):
+        # An AsyncClient's connection pool belongs to the event loop that first used it
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = make_async_client()
+        return client
+
+    async def fetch_async(self, url, max_bytes, timeout=10, deadline=None):
+        """fetch() without blocking the event loop; same cache, return value and errors."""
+        path, meta, headers = self._revalidation(url)
+        try:
+            client = self._async_client()
+            async with client.stream("GET", url, headers=headers, timeout=_timeout(timeout, deadline)) as response:
+                if response.status_code == 304 and meta is not None:
+                    body = self._cache_hit(path, meta, max_bytes)
+                    if body is not None:
+                        return body
+                    return await self._fetch_fresh_async(url, max_bytes, timeout, deadline)
+                return await self._read_response_async(url, response, max_bytes, deadline)
+        except httpx.HTTPError as e:
+            raise DownloadError(str(e)) from e
+
+    async def _fetch_fresh_async(self, url, max_bytes, timeout, deadline):
+        async with self._async_client().stream("GET", url, timeout=_timeout(timeout, deadline)) as response:
+            return await self._read_response_async(url, response, max_bytes, deadline)
+
+    async def _read_response_async(self, url, response, max_bytes, deadline):
+        out, tmp_path = self._open_body(response, max_bytes)
+        try:
+            writer = _BodyWriter(out, max_bytes, deadline)
+            async for block in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                writer.write(block)
+            writer.finish()
+            # Publishing may evict old entries, which walks the cache directory
+            return await asyncio.to_thread(self._publish, url, out, tmp_path, response.headers)
+        except Exception:
+            self._discard(out, tmp_path)
+            raise
+
+    def _open_body(self, response, max_bytes):
+        """
+        (file to stream the body into, temporary cache entry or None). The body
+        goes straight into a new cache entry when the response is cacheable.
+        """
+        with self._lock:
+            self.misses += 1
+        if response.status_code == 304:
+            # Only conditional requests may be answered with an empty 304
+            raise DownloadError(f"unexpected 304 Not Modified for {response.url}")
+        response.raise_for_status()
+        headers = response.headers
+        _check_length(headers, max_bytes)
+        if not (headers.get("ETag") or headers.get("Last-Modified")) or self.max_cache_bytes <= 0:
+            return tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_BYTES), None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        try:
+            return open(os.path.join(tmp_path, BODY_FILE), "w+b"), tmp_path
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def _discard(self, out, tmp_path):
+        out.close()
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _publish(self, url, out, tmp_path, headers):
+        """Publish the cache entry atomically, if there is one; return the body to hand back."""
+        if tmp_path is None:
+            return out
+        meta = {
+            "url": url, "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+            "size": os.fstat(out.fileno()).st_size,
+        }
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        path = self._entry_path(url)
+        try:
+            publish_bundle(tmp_path, path)
+        except OSError as e:
+            # our open handle stays valid even if the entry could not be published
+            print(f"[WARN] Failed to cache download of {url}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        evict_bundles(self.cache_dir, self.max_cache_bytes, keep={os.path.basename(path)})
+        return out
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+downloader = Downloader()
@@ -1,7 +1,10 @@
 import os
+import threading
+
 import numpy as np
-import gdown
-from gensim.models import KeyedVectors
+
+from .metrics import timed
+from .word_vectors import CompactVectors, VOCAB_FILE, convert_keyed_vectors
 
 _model = None
 GLOVE_DIR = os.path.join(os.path.dirname(__file__), "glove")
@@ -17,6 +20,7 @@ def download_file_from_google_drive(file_id, destination):
         print(f"{destination} already exists, skipping download.")
         return
 
+    import gdown
     print(f"Downloading {destination} ...")
     url = f"https://drive.google.com/uc?id={file_id}"
     gdown.download(url, destination, quiet=False)
@@ -27,39 +31,152 @@ def ensure_glove_files():
         local_path = os.path.join(GLOVE_DIR, filename)
         download_file_from_google_drive(file_id, local_path)
 
+# Converted, memory-mappable copy of the model (see api.word_vectors); built
+# on first load, or ahead of time with `manage.py warmup`
+GLOVE_COMPACT_DIR = os.environ.get("GLOVE_COMPACT_DIR", os.path.join(GLOVE_DIR, "compact"))
+_model_lock = threading.Lock()
+
+def load_compact_model():
+    if not os.path.exists(os.path.join(GLOVE_COMPACT_DIR, VOCAB_FILE)):
+        ensure_glove_files()
+        print(f"Converting GloVe model to {GLOVE_COMPACT_DIR} ...")
+        convert_keyed_vectors(os.path.join(GLOVE_DIR, "glove_model.kv"), GLOVE_COMPACT_DIR)
+    return CompactVectors.load(GLOVE_COMPACT_DIR)
+
 def get_model():
     global _model
     if _model is None:
-        ensure_glove_files()
-        model_path = os.path.join(GLOVE_DIR, "glove_model.kv")
+        with _model_lock:
+            if _model is None:
+                _model = load_compact_model()
+    return _model
 
-        orig_np_load = np.load
-        np.load = lambda *a, **k: orig_np_load(*a, allow_pickle=True, **k)
+# Chunks are embedded in batches: each batch gathers at most this many word
+# vectors at once, which bounds the temporary (tokens x dim) matrix.
+EMBED_BATCH_TOKENS = int(os.environ.get("EMBED_BATCH_TOKENS", 32768))
 
-        _model = KeyedVectors.load(model_path, mmap='r')
-        np.load = orig_np_load
-    return _model
+def _embed_batch(texts, model):
+    """Average word vectors for each text with one gather and one segment-sum."""
+    vectors = model.vectors
+    out = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+    words = []
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        split = text.split()
+        words.extend(split)
+        lengths[i] = len(split)
+    if not words:
+        return out
 
-def average_embedding(text):
+    ids = model.lookup(words)
+    known = ids >= 0
+    text_of_word = np.repeat(np.arange(len(texts)), lengths)[known]
+    ids = ids[known]
+    if not ids.size:
+        return out
+
+    counts = np.bincount(text_of_word, minlength=len(texts))
+    nonempty = counts > 0
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    sums = np.add.reduceat(vectors[ids], starts, axis=0)
+    out[nonempty] = sums / counts[nonempty, None]
+    return out
+
+@timed("embed")
+def embed_texts(texts):
+    """
+    Embed an iterable of texts (consumed lazily, so it can be a chunk
+    stream) into an (n, dim) float32 matrix of averaged word vectors.
+    Texts with no in-vocabulary words get a zero row.
+    """
     model = get_model()
-    words = text.split()
-    embeddings = [model[word] for word in words if word in model]
-    if not embeddings:
-        return np.zeros(model.vector_size)
-    return np.mean(embeddings, axis=0)
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for text in texts:
+        batch.append(text)
+        batch_tokens += text.count(" ") + 1
+        if batch_tokens >= EMBED_BATCH_TOKENS:
+            batches.append(_embed_batch(batch, model))
+            batch, batch_tokens = [], 0
+    if batch or not batches:
+        batches.append(_embed_batch(batch, model))
+    return np.concatenate(batches) if len(batches) > 1 else batches[0]
+
+def average_embedding(text):
+    return embed_texts([text])[0]
 
 def embed_chunks(chunks):
-    return [average_embedding(chunk) for chunk in chunks]
+    return embed_texts(chunks)
 
 def embed_query(query):
     return average_embedding(query)
 
+def embed_queries(queries):
+    return embed_texts(queries)
+
+def build_embedding_matrix(embeddings):
+    """
+    Stack embeddings into a float32 matrix whose rows have unit length, so that
+    cosine similarity against it is a plain dot product. Zero vectors stay zero.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.size == 0:
+        return np.zeros((0, matrix.shape[-1] if matrix.ndim == 2 else 0), dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
 def cosine_similarity(vec1, vec2):
     if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
         return 0.0
     return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, best first; equal scores keep index
+    order (a partition for the k-th score, then a small sort).
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        kth = np.partition(scores, n - k)[n - k]
+        above = np.flatnonzero(scores > kth)
+        # argpartition would pick arbitrary members of a tie at the cut
+        candidates = np.union1d(above, np.flatnonzero(scores == kth)[:k - len(above)])
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def cosine_scores(query_embeddings, chunk_embeddings):
+    """
+    (n_queries, n_chunks) cosine similarities from one matrix-matrix product.
+    chunk_embeddings may be raw vectors or a build_embedding_matrix result.
+    """
+    if not isinstance(chunk_embeddings, np.ndarray):
+        chunk_embeddings = build_embedding_matrix(chunk_embeddings)
+    if len(query_embeddings) == 0 or chunk_embeddings.shape[0] == 0:
+        return np.zeros((len(query_embeddings), chunk_embeddings.shape[0]), dtype=np.float32)
+    return build_embedding_matrix(query_embeddings) @ chunk_embeddings.T
+
 def get_top_k_chunks(query_embedding, chunk_embeddings, chunks, k=3):
-    similarities = [cosine_similarity(query_embedding, emb) for emb in chunk_embeddings]
-    top_k_indices = np.argsort(similarities)[-k:][::-1]
-    return [(chunks[i], float(similarities[i])) for i in top_k_indices]
+    """
+    chunk_embeddings may be a list of raw vectors or a matrix returned by
+    build_embedding_matrix (preferred: it is normalized once per document).
+    """
+    return get_top_k_chunks_batch([query_embedding], chunk_embeddings, chunks, k=k)[0]
+
+def get_top_k_chunks_batch(query_embeddings, chunk_embeddings, chunks, k=3):
+    """
+    Score every query against the document in one matrix-matrix product.
+    Returns one [(chunk_text, similarity), ...] list per query, in query order.
+    """
+    scores = cosine_scores(query_embeddings, chunk_embeddings)
+    return [
+        [(chunks[i], float(row[i])) for i in top_k_indices(row, k)]
+        for row in scores
+    ]
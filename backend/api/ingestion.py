@@ -0,0 +1,224 @@
+import os
+import time
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import IngestionJob, PolicyDocument, organization_key
+from .pipeline import process_document, DocumentParseError
+from .document_parser import count_pdf_pages, DEFAULT_MAX_PAGES
+from .doc_store import document_store
+from .ann_index import index_registry
+
+# Uploads are written here and processed by a local worker pool; the job
+# rows in the database are the queue. INGEST_WORKERS=0 leaves queued jobs for
+# `manage.py run_ingestion` instead of processing them in the web process.
+INGEST_DIR = os.environ.get("INGEST_DIR", os.path.join(os.path.dirname(__file__), "ingest"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+# Backpressure: new uploads are refused while queued + running jobs exceed these
+INGEST_MAX_QUEUED_BYTES = int(os.environ.get("INGEST_MAX_QUEUED_BYTES", 100 * 1024 * 1024))
+INGEST_MAX_QUEUED_PAGES = int(os.environ.get("INGEST_MAX_QUEUED_PAGES", 2000))
+# Minimum seconds between progress writes for one job
+PROGRESS_INTERVAL = 0.5
+
+STAGES = ("parse", "chunk", "embed", "index")
+PENDING = (IngestionJob.QUEUED, IngestionJob.RUNNING)
+
+
+class IngestionBusy(Exception):
+    """The ingestion queue is over its byte or page budget."""
+
+
+def estimate_pages(data, filename):
+    if filename.endswith(".pdf"):
+        try:
+            return count_pdf_pages(BytesIO(data), max_pages=DEFAULT_MAX_PAGES)
+        except Exception:
+            # Unreadable PDFs still get a job so the parse error shows up in its status
+            return 1
+    return 1
+
+
+def upload_path(job_id, filename):
+    return os.path.join(INGEST_DIR, f"{job_id}{os.path.splitext(filename)[1]}")
+
+
+def queued_load():
+    totals = IngestionJob.objects.filter(status__in=PENDING).aggregate(
+        bytes=Sum("size_bytes"), pages=Sum("pages"),
+    )
+    return totals["bytes"] or 0, totals["pages"] or 0
+
+
+_submit_lock = threading.Lock()
+
+
+def enqueue(user, data, filename):
+    """
+    Store an upload and queue it for ingestion.
+
+    Raises:
+        IngestionBusy: accepting it would exceed the queue limits
+    """
+    pages = estimate_pages(data, filename)
+    with _submit_lock:
+        queued_bytes, queued_pages = queued_load()
+        # An empty queue always accepts one job, however large
+        if queued_bytes or queued_pages:
+            if queued_bytes + len(data) > INGEST_MAX_QUEUED_BYTES:
+                raise IngestionBusy(f"{queued_bytes} bytes already queued")
+            if queued_pages + pages > INGEST_MAX_QUEUED_PAGES:
+                raise IngestionBusy(f"{queued_pages} pages already queued")
+
+        job = IngestionJob(user=user, filename=filename, size_bytes=len(data), pages=pages)
+        os.makedirs(INGEST_DIR, exist_ok=True)
+        with open(upload_path(job.id, filename), "wb") as f:
+            f.write(data)
+        job.save()
+    submit(job.id)
+    return job
+
+
+class ProgressReporter:
+    """Collects per-stage progress and writes it to the job row at most every PROGRESS_INTERVAL."""
+
+    def __init__(self, job):
+        self.job = job
+        self.progress = {stage: {"done": 0, "total": None} for stage in STAGES}
+        self.progress["parse"]["total"] = job.pages if job.filename.endswith(".pdf") else None
+        self.stage = ""
+        self._last_write = 0.0
+
+    def __call__(self, stage, done, total=None):
+        entry = self.progress[stage]
+        entry["done"] = done
+        if total is not None:
+            entry["total"] = total
+        # Stages overlap (chunks are cut while pages are still parsed), so the
+        # reported stage is the furthest one reached
+        if not self.stage or STAGES.index(stage) > STAGES.index(self.stage):
+            self.stage = stage
+            self.flush()
+        elif time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self, **fields):
+        self._last_write = time.monotonic()
+        IngestionJob.objects.filter(id=self.job.id).update(
+            stage=self.stage, progress=self.progress, updated_at=timezone.now(), **fields
+        )
+
+
+def claim(job_id):
+    """Atomically move a queued job to running; False if another worker got it first."""
+    return IngestionJob.objects.filter(id=job_id, status=IngestionJob.QUEUED).update(
+        status=IngestionJob.RUNNING, updated_at=timezone.now()
+    ) == 1
+
+
+def expire_documents(document_ids):
+    """Mark documents whose bundles were evicted from the store, and drop them from their ANN index."""
+    documents = list(PolicyDocument.objects.filter(id__in=document_ids, expired_at=None).select_related("user"))
+    if not documents:
+        return
+    PolicyDocument.objects.filter(id__in=[d.id for d in documents]).update(expired_at=timezone.now())
+    for document in documents:
+        try:
+            index_registry.remove_document(organization_key(document.user), document.id)
+        except Exception as e:
+            print(f"[WARN] Failed to remove expired document {document.id} from ANN index: {e}")
+
+
+def run_job(job_id):
+    if not claim(job_id):
+        return
+    try:
+        _run_claimed(IngestionJob.objects.select_related("user").get(id=job_id))
+    finally:
+        close_old_connections()
+
+
+def _run_claimed(job):
+    reporter = ProgressReporter(job)
+    path = upload_path(job.id, job.filename)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        processed = process_document(data, job.filename, progress=reporter)
+
+        reporter("index", 0, 1)
+        document = PolicyDocument.objects.create(user=job.user, filename=job.filename)
+        try:
+            evicted = document_store.save(
+                document.id, processed.chunks, processed.embeddings,
+                filename=job.filename, spans=processed.spans, bm25=processed.bm25,
+                content_hash=processed.content_hash,
+            )
+        except Exception:
+            document.delete()
+            raise
+        expire_documents(evicted)
+        try:
+            index_registry.add_document(organization_key(job.user), document.id, processed.embeddings)
+        except Exception as e:
+            print(f"[WARN] Failed to add document {document.id} to ANN index: {e}")
+        reporter.progress["index"]["done"] = 1
+        reporter.flush(status=IngestionJob.SUCCEEDED, document=document)
+    except DocumentParseError as e:
+        reporter.flush(status=IngestionJob.FAILED, error=f"Failed to parse document: {e}")
+    except Exception as e:
+        print(f"[WARN] Ingestion job {job.id} failed: {e}")
+        reporter.flush(status=IngestionJob.FAILED, error=f"Failed to process document: {e}")
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+            # Pick up jobs left queued by a previous process
+            for job_id in IngestionJob.objects.filter(status=IngestionJob.QUEUED).values_list("id", flat=True):
+                _pool.submit(run_job, job_id)
+        return _pool
+
+
+def submit(job_id):
+    if INGEST_WORKERS > 0:
+        _get_pool().submit(run_job, job_id)
+
+
+def requeue_running():
+    """Return jobs stuck in running (their worker died) to the queue."""
+    return IngestionJob.objects.filter(status=IngestionJob.RUNNING).update(status=IngestionJob.QUEUED)
+
+
+def drain(poll=None):
+    """
+    Run queued jobs in this process, oldest first. With `poll` set, keep
+    waiting for new jobs, sleeping that many seconds when the queue is empty.
+    """
+    processed = 0
+    while True:
+        job_id = IngestionJob.objects.filter(status=IngestionJob.QUEUED).order_by("created_at") \
+            .values_list("id", flat=True).first()
+        if job_id is None:
+            if poll is None:
+                return processed
+            close_old_connections()
+            time.sleep(poll)
+            continue
+        run_job(job_id)
+        processed += 1
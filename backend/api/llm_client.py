@@ -0,0 +1,466 @@
+import os
+import time
+import random
+import asyncio
+import weakref
+import threading
+import contextvars
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError, APITimeoutError
+from .utils.env_loader import GROQ_API_KEY
+from .metrics import timed, timed_iter, timed_await, record_llm_call, llm_seconds, llm_attempts, register_collector
+
+# One place where the app talks to Groq. Every chat completion:
+#   - gets a budget: its `timeout` argument, else LLM_CALL_BUDGET seconds.
+#     Retries and hedges all fit inside it, and each request to Groq is
+#     sent with the time that is left as its timeout;
+#   - is retried on connection errors, timeouts, 408/409/429 and 5xx, after
+#     a jittered exponential backoff, but only while at least
+#     LLM_MIN_ATTEMPT_SECONDS would be left for the next try;
+#   - with LLM_HEDGE=True, is sent a second time when the first has not
+#     answered within the model's LLM_HEDGE_PERCENTILE latency, and the
+#     first reply wins;
+#   - fails fast with LLMUnavailable while the model's circuit breaker is
+#     open: after LLM_BREAKER_FAILURES retryable failures in a row, calls
+#     are refused for LLM_BREAKER_RESET seconds, then one probe call decides
+#     whether to close it again. Retries and hedges ask the breaker too, so
+#     a call stops retrying once it opens.
+# The SDK's own retries are off, so they do not multiply with these.
+LLM_MODEL = "llama3-70b-8192"
+LLM_CALL_BUDGET = float(os.environ.get("LLM_CALL_BUDGET", 30))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.25))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 4.0))
+LLM_MIN_ATTEMPT_SECONDS = float(os.environ.get("LLM_MIN_ATTEMPT_SECONDS", 1.0))
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "False") == "True"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30))
+
+RETRYABLE_STATUS = (408, 409, 429)
+LATENCY_WINDOW = 200  # recent successful calls kept per model for the hedge delay
+
+groq_client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+# AsyncGroq's connection pool belongs to the event loop that first used it
+_async_groq_clients = weakref.WeakKeyDictionary()
+# Runs hedged calls: the first request and its hedge race here
+_hedge_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("LLM_HEDGE_WORKERS", 32)))
+
+
+def async_groq_client():
+    """The AsyncGroq client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_groq_clients.get(loop)
+    if client is None:
+        client = _async_groq_clients[loop] = AsyncGroq(api_key=GROQ_API_KEY, max_retries=0)
+    return client
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling Groq while the model's circuit breaker is open."""
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call's budget ran out before Groq answered."""
+
+
+class CircuitBreaker:
+    PROBE = "probe"
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset=LLM_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """
+        Whether a request may go out now: False, True, or PROBE for the
+        single request let through while half-open.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset:
+                return False
+            # Holds the breaker open for another `reset` while the probe runs,
+            # so a probe that never reports back (cancelled) just expires
+            self._opened_at = now
+            self._probing = True
+            return self.PROBE
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def abandon(self):
+        """The probe ended without telling whether the upstream is back; let the next call probe."""
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._opened_at = time.monotonic() - self.reset
+
+
+class LatencyWindow:
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+class _Model:
+    """Breaker and latency history of one model."""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyWindow()
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _model_state(model):
+    with _models_lock:
+        state = _models.get(model)
+        if state is None:
+            state = _models[model] = _Model()
+        return state
+
+
+def is_retryable(error):
+    if isinstance(error, (APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def _upstream_replied(error):
+    """Whether Groq answered, if only with a non-retryable error (a 400 and the like)."""
+    return isinstance(error, APIStatusError) and not is_retryable(error)
+
+
+def _outcome(error):
+    if isinstance(error, LLMUnavailable):
+        return "circuit_open"
+    if isinstance(error, (APITimeoutError, TimeoutError)):
+        return "timeout"
+    return "error"
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt, error, deadline):
+    """Seconds to sleep before retry number `attempt`, or None when there is no time for it."""
+    if attempt > LLM_MAX_RETRIES or not is_retryable(error):
+        return None
+    delay = _retry_after(error)
+    if delay is None:
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    if deadline - time.monotonic() - delay < LLM_MIN_ATTEMPT_SECONDS:
+        return None
+    return delay
+
+
+def _hedge_delay(state, deadline):
+    if not LLM_HEDGE:
+        return None
+    delay = state.latency.percentile(LLM_HEDGE_PERCENTILE)
+    if delay is None or deadline - time.monotonic() - delay < LLM_MIN_ATTEMPT_SECONDS:
+        return None
+    return delay
+
+
+class _Call:
+    """Budget, breaker and per-attempt accounting shared by the sync and async paths."""
+
+    def __init__(self, kwargs):
+        timeout = kwargs.pop("timeout", None)
+        self.kwargs = kwargs
+        self.model = kwargs.setdefault("model", LLM_MODEL)
+        self.state = _model_state(self.model)
+        self.deadline = time.monotonic() + (timeout if timeout is not None else LLM_CALL_BUDGET)
+        self.probe = False
+        if not self.admit():
+            raise LLMUnavailable(f"circuit open for {self.model}")
+
+    def admit(self):
+        """Ask the breaker whether another request of this call may go out."""
+        allowed = self.state.breaker.allow()
+        if allowed == CircuitBreaker.PROBE:
+            self.probe = True
+        return bool(allowed)
+
+    def readmit(self):
+        """admit() before a retry; LLMUnavailable when the breaker opened meanwhile."""
+        if not self.admit():
+            raise LLMUnavailable(f"circuit opened for {self.model} while retrying")
+
+    def remaining(self):
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"no time left for {self.model}")
+        return remaining
+
+    def attempted(self, kind, start, error=None):
+        elapsed = time.perf_counter() - start
+        llm_attempts.inc(self.model, kind)
+        llm_seconds.observe(elapsed, self.model, "ok" if error is None else _outcome(error))
+        if error is None:
+            self.state.latency.add(elapsed)
+
+    def finished(self, response=None, error=None):
+        breaker = self.state.breaker
+        if error is None or _upstream_replied(error):
+            breaker.success()
+        elif is_retryable(error) and not isinstance(error, LLMDeadlineExceeded):
+            # Running out of our own budget says nothing about the upstream
+            breaker.failure()
+        elif self.probe:
+            breaker.abandon()
+        record_llm_call(self.model, response, error=error, outcome=None if error is None else _outcome(error))
+
+
+def _attempt(client, call, kind):
+    timeout = call.remaining()
+    start = time.perf_counter()
+    try:
+        response = client.chat.completions.create(timeout=timeout, **call.kwargs)
+    except Exception as e:
+        call.attempted(kind, start, e)
+        raise
+    call.attempted(kind, start)
+    return response
+
+
+def _hedged(client, call, delay):
+    """The first successful reply of the request and, after `delay`, its hedge."""
+    run = contextvars.copy_context().run
+    pending = {_hedge_pool.submit(run, _attempt, client, call, "first")}
+    done, pending = wait(pending, timeout=delay)
+    if not done and call.admit():
+        pending.add(_hedge_pool.submit(contextvars.copy_context().run, _attempt, client, call, "hedge"))
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                # The slower request runs out on its own timeout
+                return future.result()
+            error = future.exception()
+        if not pending:
+            raise error
+        done, pending = wait(pending, timeout=call.remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            raise LLMDeadlineExceeded(f"no reply from {call.model} within the budget")
+
+
+def chat_completion(client=None, **kwargs):
+    """
+    client.chat.completions.create with the retry, hedging and circuit
+    breaker policy above, timed as the "llm" stage. `timeout` is the budget
+    for the whole call.
+    """
+    client = client or groq_client
+    with timed("llm"):
+        call = None
+        try:
+            call = _Call(kwargs)
+            attempt = 0
+            while True:
+                try:
+                    delay = _hedge_delay(call.state, call.deadline)
+                    if delay is None:
+                        response = _attempt(client, call, "first" if attempt == 0 else "retry")
+                    else:
+                        response = _hedged(client, call, delay)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    backoff = _backoff(attempt, e, call.deadline)
+                    if backoff is None:
+                        raise
+                    print(f"[WARN] LLM call to {call.model} failed ({e}), retrying in {backoff:.2f}s")
+                    time.sleep(backoff)
+                    call.readmit()
+        except Exception as e:
+            if call is not None:
+                call.finished(error=e)
+            else:
+                record_llm_call(kwargs.get("model", LLM_MODEL), error=e, outcome=_outcome(e))
+            raise
+    call.finished(response)
+    return response
+
+
+async def _attempt_async(client, call, kind):
+    timeout = call.remaining()
+    start = time.perf_counter()
+    try:
+        response = await client.chat.completions.create(timeout=timeout, **call.kwargs)
+    except Exception as e:
+        call.attempted(kind, start, e)
+        raise
+    call.attempted(kind, start)
+    return response
+
+
+async def _hedged_async(client, call, delay):
+    pending = {asyncio.ensure_future(_attempt_async(client, call, "first"))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done and call.admit():
+            pending.add(asyncio.ensure_future(_attempt_async(client, call, "hedge")))
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, timeout=call.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise LLMDeadlineExceeded(f"no reply from {call.model} within the budget")
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def chat_completion_async(client=None, **kwargs):
+    """chat_completion on the async client (async_groq_client() by default)."""
+    client = client or async_groq_client()
+    with timed_await("llm"):
+        call = None
+        try:
+            call = _Call(kwargs)
+            attempt = 0
+            while True:
+                try:
+                    delay = _hedge_delay(call.state, call.deadline)
+                    if delay is None:
+                        response = await _attempt_async(client, call, "first" if attempt == 0 else "retry")
+                    else:
+                        response = await _hedged_async(client, call, delay)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    backoff = _backoff(attempt, e, call.deadline)
+                    if backoff is None:
+                        raise
+                    print(f"[WARN] LLM call to {call.model} failed ({e}), retrying in {backoff:.2f}s")
+                    await asyncio.sleep(backoff)
+                    call.readmit()
+        except Exception as e:
+            if call is not None:
+                call.finished(error=e)
+            else:
+                record_llm_call(kwargs.get("model", LLM_MODEL), error=e, outcome=_outcome(e))
+            raise
+    call.finished(response)
+    return response
+
+
+def _stream_chunks(client, call):
+    """Chunks of a streamed reply. Opening the stream is retried; once text flows it is not."""
+    attempt = 0
+    while True:
+        kind = "first" if attempt == 0 else "retry"
+        timeout = call.remaining()
+        start = time.perf_counter()
+        try:
+            stream = client.chat.completions.create(stream=True, timeout=timeout, **call.kwargs)
+            break
+        except Exception as e:
+            call.attempted(kind, start, e)
+            attempt += 1
+            backoff = _backoff(attempt, e, call.deadline)
+            if backoff is None:
+                raise
+            print(f"[WARN] LLM stream to {call.model} failed ({e}), retrying in {backoff:.2f}s")
+            time.sleep(backoff)
+            call.readmit()
+    try:
+        yield from stream
+    except Exception as e:
+        call.attempted(kind, start, e)
+        raise
+    else:
+        call.attempted(kind, start)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+def chat_completion_stream(client=None, **kwargs):
+    """
+    chat_completion with stream=True, yielding the reply's text deltas as they
+    arrive. Time spent waiting on the model counts as the "llm" stage. Not
+    hedged.
+    """
+    client = client or groq_client
+    call = None
+    usage = None
+    try:
+        call = _Call(kwargs)
+        for chunk in timed_iter("llm", _stream_chunks(client, call)):
+            # Groq reports token usage on the last chunk
+            usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        if call is not None:
+            call.finished(error=e)
+        else:
+            record_llm_call(kwargs.get("model", LLM_MODEL), error=e, outcome=_outcome(e))
+        raise
+    call.finished(SimpleNamespace(usage=usage))
+
+
+@register_collector
+def breaker_stats():
+    with _models_lock:
+        states = list(_models.items())
+    return [(
+        "policyintel_llm_circuit_open",
+        "1 while the model's circuit breaker is refusing calls.",
+        {(("model", model),): int(state.breaker.open) for model, state in states},
+    )]
@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+import weakref
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+# Concurrency limits for LLM calls. The per-request limit bounds how many
+# threads one request may use; the global limit bounds in-flight upstream
+# calls across every request in this process.
+MAX_CONCURRENCY_PER_REQUEST = int(os.environ.get("LLM_MAX_CONCURRENCY_PER_REQUEST", 8))
+MAX_CONCURRENCY_GLOBAL = int(os.environ.get("LLM_MAX_CONCURRENCY_GLOBAL", 32))
+
+# The async views hold no thread per call, so one event loop can keep many
+# more calls in flight
+MAX_CONCURRENCY_ASYNC = int(os.environ.get("LLM_MAX_CONCURRENCY_ASYNC", 256))
+
+_global_slots = threading.BoundedSemaphore(MAX_CONCURRENCY_GLOBAL)
+_async_slots = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+
+
+def _loop_slots():
+    loop = asyncio.get_running_loop()
+    slots = _async_slots.get(loop)
+    if slots is None:
+        slots = _async_slots[loop] = asyncio.Semaphore(MAX_CONCURRENCY_ASYNC)
+    return slots
+
+
+def _with_slot(func, deadline):
+    """Wrap func(item, remaining) so it holds one of the global LLM slots while it runs."""
+    def run(item):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _global_slots.acquire(timeout=remaining):
+            raise TimeoutError("deadline passed while waiting for a free LLM slot")
+        try:
+            return func(item, max(deadline - time.monotonic(), 0.001))
+        finally:
+            _global_slots.release()
+    return run
+
+
+def fan_out(func, items, deadline, fallback=None, max_workers=MAX_CONCURRENCY_PER_REQUEST):
+    """
+    Call func(item, timeout) for every item concurrently and return the
+    results in the original order.
+
+    Parameters:
+        - func (callable): receives the item and the seconds left before `deadline`
+        - items (iterable): one entry per call
+        - deadline (float): absolute time.monotonic() value for the whole batch
+        - fallback: result used for calls that fail or do not finish in time
+        - max_workers (int): per-request concurrency limit
+
+    Returns:
+        list: one result per item
+    """
+    items = list(items)
+    results = [fallback] * len(items)
+    if not items:
+        return results
+
+    run = _with_slot(func, deadline)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    # Each call runs in a copy of the caller's context (per-request timings)
+    futures = {
+        executor.submit(contextvars.copy_context().run, run, item): i for i, item in enumerate(items)
+    }
+    try:
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"[WARN] LLM call {futures[future]} failed: {e}")
+        if not_done:
+            print(f"[WARN] {len(not_done)} LLM call(s) missed the deadline")
+    finally:
+        # Do not block the response on stragglers; their own timeouts end them
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+
+def fan_out_as_completed(func, items, deadline, max_workers=MAX_CONCURRENCY_PER_REQUEST):
+    """
+    Like fan_out, but yields (index, result, error) as each call finishes
+    instead of waiting for all of them. Calls still running at `deadline`
+    are reported with a TimeoutError.
+    """
+    items = list(items)
+    if not items:
+        return
+    run = _with_slot(func, deadline)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    futures = {
+        executor.submit(contextvars.copy_context().run, run, item): i for i, item in enumerate(items)
+    }
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+            pending.discard(future)
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+    except FuturesTimeoutError:
+        print(f"[WARN] {len(pending)} LLM call(s) missed the deadline")
+        for future in sorted(pending, key=futures.get):
+            yield futures[future], None, TimeoutError("deadline passed")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def fan_out_async(func, items, deadline, fallback=None, max_workers=MAX_CONCURRENCY_PER_REQUEST):
+    """
+    fan_out for coroutines: awaits func(item, timeout) for every item on the
+    running event loop. Calls still running at `deadline` are cancelled.
+    """
+    items = list(items)
+    results = [fallback] * len(items)
+    if not items:
+        return results
+
+    request_slots = asyncio.Semaphore(max(1, max_workers))
+    global_slots = _loop_slots()
+
+    async def run(item):
+        async with request_slots, global_slots:
+            return await func(item, max(deadline - time.monotonic(), 0.001))
+
+    tasks = {asyncio.ensure_future(run(item)): i for i, item in enumerate(items)}
+    done, not_done = await asyncio.wait(tasks, timeout=max(deadline - time.monotonic(), 0))
+    for task in not_done:
+        task.cancel()
+    for task in done:
+        if task.exception() is not None:
+            print(f"[WARN] LLM call {tasks[task]} failed: {task.exception()}")
+        else:
+            results[tasks[task]] = task.result()
+    if not_done:
+        print(f"[WARN] {len(not_done)} LLM call(s) missed the deadline")
+    return results
@@ -1,12 +1,21 @@
+import os
 import json
+import asyncio
 import re
 import uuid
 from datetime import datetime
-from geotext import GeoText
-from groq import Groq
-from .utils.env_loader import GROQ_API_KEY
+from .query_cache import parse_cache
+from .llm_client import LLM_MODEL, chat_completion, chat_completion_async, chat_completion_stream
+from .prompt_builder import build_context, fit_query
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Justification prefix of the fallback decision returned when the LLM call fails
+LLM_ERROR_PREFIX = "LLM processing error"
+
+def is_llm_error(decision_response):
+    return str(decision_response.get("justification", "")).startswith(LLM_ERROR_PREFIX)
+
+def reply_text(response):
+    return response.choices[0].message.content.strip()
 
 def extract_json_from_text(text):
     # Try to extract first {...} JSON substring from text robustly
@@ -19,6 +28,8 @@ def extract_json_from_text(text):
     return None
 
 def extract_location(text):
+    # GeoText loads its gazetteer on import; keep it off the module import path
+    from geotext import GeoText
     places = GeoText(text)
     if places.cities:
         return places.cities[0]
@@ -26,54 +37,30 @@ def extract_location(text):
         return places.countries[0]
     return None
 
-def hybrid_parse_input(query):
-    result = {
-        "age": None,
-        "gender": None,
-        "procedure": None,
-        "location": None,
-        "policy_duration": None
-    }
+PARSED_FIELDS = ("age", "gender", "procedure", "location", "policy_duration")
 
-    try:
-        response = groq_client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that extracts structured data from insurance-related questions."},
-                {"role": "user", "content": f"""
-Extract the following fields from this insurance query:
-- age
-- gender
-- procedure
-- location
-- policy_duration
+# One prompt that extracts the structured fields and decides the claim,
+# instead of hybrid_parse_input followed by make_decision. Queries whose
+# fields are already known (parse cache or fast path) get the shorter
+# decision prompt instead; extractions from the combined prompt are cached.
+SINGLE_CALL_MODE = os.environ.get("LLM_SINGLE_CALL", "True") == "True"
 
-Only return valid JSON.
-Query:
-\"\"\"{query}\"\"\""""}
-            ]
-        )
-        raw = response.choices[0].message.content.strip()
-        json_data = extract_json_from_text(raw)
-        if json_data:
-            # Validate and typecast fields if needed
-            if "age" in json_data and json_data["age"] is not None:
-                try:
-                    json_data["age"] = int(json_data["age"])
-                except Exception:
-                    json_data["age"] = None
-            result.update(json_data)
-        else:
-            print("[WARN] Failed to parse JSON from LLM response")
+def empty_parsed_input():
+    return {field: None for field in PARSED_FIELDS}
 
-    except Exception as e:
-        print(f"[WARN] Groq LLM parse failed: {e}")
+def validate_parsed_input(json_data):
+    # Validate and typecast fields if needed
+    if "age" in json_data and json_data["age"] is not None:
+        try:
+            json_data["age"] = int(json_data["age"])
+        except Exception:
+            json_data["age"] = None
+    return json_data
 
-    # Fallbacks
+def apply_fallbacks(result, query):
+    """Fill fields the LLM left empty using regex/GeoText heuristics."""
     if not result["age"]:
-        match = re.search(r"(\d{2})\s*(?:year|yr)?\s*old", query.lower())
-        if match:
-            result["age"] = int(match.group(1))
+        result["age"] = extract_age(query)
 
     if not result["gender"]:
         if "female" in query.lower() or re.search(r"\b\d{2}f\b", query.lower()):
@@ -88,7 +75,144 @@ Query:
 
     return result
 
-def make_decision(parsed_input, top_chunks, source_name="Policy Document A"):
+PROCEDURE_NOUNS = (
+    r"(?:surgery|replacement|transplant|operation|bypass|angioplasty"
+    r"|dialysis|chemotherapy|radiotherapy|therapy|treatment|delivery|fracture|implant)"
+)
+# An optional qualifier ("knee") and one or more procedure nouns ("dialysis treatment")
+PROCEDURE_PATTERN = re.compile(
+    rf"\b(?:([a-z]+)\s+)?({PROCEDURE_NOUNS}(?:\s+{PROCEDURE_NOUNS})*)\b"
+)
+# Words that may precede a procedure without being part of its name
+PROCEDURE_STOP_WORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "and", "or", "with", "after", "before", "from",
+    "my", "his", "her", "their", "our", "had", "has", "have", "need", "needs", "needed", "underwent",
+    "undergo", "undergoing", "undergone", "did", "done", "got", "get", "getting", "claim", "claims",
+    "covered", "cover", "is", "was", "policy", "old", "year", "years", "male", "female", "man", "woman",
+    "m", "f", "mr", "mrs", "ms", "patient", "insured",
+}
+# Ages are only read where the text says it is an age: "46M", "46 yo",
+# "46 years old", "46-year-old", "aged 46", "age: 46", "46 male"
+AGE_PATTERNS = (
+    re.compile(r"\b(\d{1,3})\s*-?\s*(?:m|f|male|female)\b"),
+    re.compile(r"\b(\d{1,3})\s*-?\s*(?:yo|y/o|yrs?\s*-?\s*old|years?\s*-?\s*old|years?\s+of\s+age)\b"),
+    re.compile(r"\bage(?:d|\s*:)?\s*(\d{1,3})\b"),
+)
+POLICY_DURATION_PATTERN = re.compile(
+    r"\b(\d+)\s*-?\s*(day|week|month|year)s?\s*-?\s*(?:old\s+)?(?:insurance\s+)?(?:policy|cover|coverage|plan)\b"
+)
+
+def _single(values):
+    """The one distinct value in `values`, or None when there are none or they disagree."""
+    values = set(values)
+    return values.pop() if len(values) == 1 else None
+
+def extract_age(query):
+    """
+    The claimant's age when the query states it unambiguously, else None.
+    Numbers that belong to a policy duration ("10 year policy") are skipped.
+    """
+    lowered = POLICY_DURATION_PATTERN.sub(lambda m: " " * len(m.group()), query.lower())
+    ages = [int(m.group(1)) for pattern in AGE_PATTERNS for m in pattern.finditer(lowered)]
+    age = _single(ages)
+    return age if age is not None and 0 < age <= 120 else None
+
+def deterministic_parse(query):
+    """
+    Regex/GeoText-only extraction. Used as a fast path by hybrid_parse_input
+    when it fills every field, so a field whose reading is ambiguous is left
+    None and the query goes to the LLM instead.
+    """
+    result = apply_fallbacks(empty_parsed_input(), query)
+    lowered = query.lower()
+
+    if re.search(r"\bfemale\b", lowered) and re.search(r"\bmale\b", lowered):
+        result["gender"] = None
+
+    procedures = []
+    for match in PROCEDURE_PATTERN.finditer(lowered):
+        qualifier, name = match.groups()
+        procedures.append(f"{qualifier} {name}" if qualifier and qualifier not in PROCEDURE_STOP_WORDS else name)
+    result["procedure"] = _single(procedures)
+
+    durations = []
+    for match in POLICY_DURATION_PATTERN.finditer(lowered):
+        count = int(match.group(1))
+        durations.append(f"{count} {match.group(2)}{'s' if count != 1 else ''}")
+    result["policy_duration"] = _single(durations)
+
+    return result
+
+def _parse_shortcut(query):
+    """The cached or deterministic parse of `query`, or None when it needs the LLM."""
+    cached = parse_cache.get(query)
+    if cached is not None:
+        return cached
+
+    fast = deterministic_parse(query)
+    if all(fast[field] is not None for field in PARSED_FIELDS):
+        parse_cache.record_fast_path()
+        parse_cache.set(query, fast)
+        return fast
+    return None
+
+def _parse_messages(query):
+    return [
+        {"role": "system", "content": "You are a helpful assistant that extracts structured data from insurance-related questions."},
+        {"role": "user", "content": f"""
+Extract the following fields from this insurance query:
+- age
+- gender
+- procedure
+- location
+- policy_duration
+
+Only return valid JSON.
+Query:
+\"\"\"{fit_query(query)}\"\"\""""}
+    ]
+
+def _parse_result(query, raw):
+    """Parsed fields from the LLM reply `raw` (None when the call failed), with fallbacks applied."""
+    result = empty_parsed_input()
+    llm_ok = False
+    if raw is not None:
+        json_data = extract_json_from_text(raw)
+        if json_data:
+            result.update(validate_parsed_input(json_data))
+            llm_ok = True
+        else:
+            print("[WARN] Failed to parse JSON from LLM response")
+
+    result = apply_fallbacks(result, query)
+    # Only successful extractions are memoized; failures should be retried
+    if llm_ok:
+        parse_cache.set(query, result)
+    return result
+
+def hybrid_parse_input(query, timeout=None):
+    shortcut = _parse_shortcut(query)
+    if shortcut is not None:
+        return shortcut
+    try:
+        raw = reply_text(chat_completion(messages=_parse_messages(query), timeout=timeout))
+    except Exception as e:
+        print(f"[WARN] Groq LLM parse failed: {e}")
+        raw = None
+    return _parse_result(query, raw)
+
+async def hybrid_parse_input_async(query):
+    shortcut = _parse_shortcut(query)
+    if shortcut is not None:
+        return shortcut
+    try:
+        raw = reply_text(await chat_completion_async(messages=_parse_messages(query)))
+    except Exception as e:
+        print(f"[WARN] Groq LLM parse failed: {e}")
+        raw = None
+    return _parse_result(query, raw)
+
+def format_clauses(top_chunks, source_name):
     formatted_clauses = []
     for chunk_text, score in top_chunks:
         formatted_clauses.append({
@@ -96,23 +220,39 @@ def make_decision(parsed_input, top_chunks, source_name="Policy Document A"):
             "similarity": round(score * 100, 2) if score is not None else None,
             "source": source_name
         })
+    return formatted_clauses
 
-    clause_text_block = "\n\n".join(
+def clause_block(formatted_clauses):
+    return "\n\n".join(
         f"Clause from {c['source']} (Match: {c['similarity']}%):\n{c['text']}"
         for c in formatted_clauses
     )
 
-    try:
-        response = groq_client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert insurance claims decision engine. Read the user input and policy clauses to make an informed decision."
-                },
-                {
-                    "role": "user",
-                    "content": f"""
+def prompt_clauses(query, top_chunks, source_name, call, query_vector=None):
+    """
+    Clause block for a prompt, with top_chunks fitted to the token budget by
+    the prompt builder. Pass the query's embedding when it is already at hand.
+    """
+    context = build_context(query, top_chunks, query_vector=query_vector, call=call)
+    return clause_block(format_clauses(context.chunks, source_name))
+
+async def prompt_clauses_async(query, top_chunks, source_name, call, query_vector=None, offload=None):
+    """
+    prompt_clauses run off the event loop: fitting embeds the chunks. `offload`
+    is a coroutine function running blocking work (asyncio.to_thread by default).
+    """
+    run = offload or asyncio.to_thread
+    return await run(prompt_clauses, query, top_chunks, source_name, call, query_vector=query_vector)
+
+def _decision_messages(parsed_input, clause_text_block):
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert insurance claims decision engine. Read the user input and policy clauses to make an informed decision."
+        },
+        {
+            "role": "user",
+            "content": f"""
 User Information:
 {json.dumps(parsed_input, indent=2)}
 
@@ -136,23 +276,240 @@ Return only valid JSON in the format:
   ]
 }}
 """}
-            ]
+    ]
+
+def _decision_result(raw, formatted_clauses):
+    result_json = extract_json_from_text(raw)
+    if not result_json:
+        raise ValueError("Failed to parse JSON from decision LLM response")
+    result_json["matched_clauses"] = formatted_clauses
+    return result_json
+
+def _decision_error(e, formatted_clauses):
+    print(f"[ERROR] Decision LLM failed: {e}")
+    return {
+        "decision": "Rejected",
+        "justification": f"{LLM_ERROR_PREFIX}: {str(e)}",
+        "matched_clauses": formatted_clauses
+    }
+
+def _decision_query(parsed_input, query):
+    # Clauses are ranked against the claim text, or the extracted fields without it
+    return query or " ".join(str(value) for value in parsed_input.values() if value)
+
+def make_decision(
+    parsed_input, top_chunks, source_name="Policy Document A", query=None, query_vector=None, timeout=None,
+):
+    formatted_clauses = format_clauses(top_chunks, source_name)
+    try:
+        clauses = prompt_clauses(
+            _decision_query(parsed_input, query), top_chunks, source_name, "decision",
+            query_vector=query_vector if query else None,
         )
-        raw = response.choices[0].message.content.strip()
-        result_json = extract_json_from_text(raw)
-        if not result_json:
-            raise ValueError("Failed to parse JSON from decision LLM response")
+        response = chat_completion(messages=_decision_messages(parsed_input, clauses), timeout=timeout)
+        return _decision_result(reply_text(response), formatted_clauses)
+    except Exception as e:
+        return _decision_error(e, formatted_clauses)
+
+async def make_decision_async(
+    parsed_input, top_chunks, source_name="Policy Document A", query=None, query_vector=None, offload=None,
+):
+    formatted_clauses = format_clauses(top_chunks, source_name)
+    try:
+        clauses = await prompt_clauses_async(
+            _decision_query(parsed_input, query), top_chunks, source_name, "decision",
+            query_vector=query_vector if query else None, offload=offload,
+        )
+        response = await chat_completion_async(messages=_decision_messages(parsed_input, clauses))
+        return _decision_result(reply_text(response), formatted_clauses)
+    except Exception as e:
+        return _decision_error(e, formatted_clauses)
+
+def _analyze_messages(query, clause_text_block):
+    return [
+        {
+            "role": "system",
+            "content": "You are an expert insurance claims decision engine. Extract the claimant details from the query, then read the policy clauses to make an informed decision."
+        },
+        {
+            "role": "user",
+            "content": f"""
+Query:
+\"\"\"{query}\"\"\"
+
+Policy Clauses (with match % and sources):
+{clause_text_block}
+
+Instructions:
+1. Extract age, gender, procedure, location and policy_duration from the query (null when not stated).
+2. Using those details, determine whether the claim should be approved or rejected.
+Explain your decision.
+Return only valid JSON in the format:
+{{
+  "input": {{
+    "age": integer or null,
+    "gender": "...",
+    "procedure": "...",
+    "location": "...",
+    "policy_duration": "..."
+  }},
+  "decision": "Approved" or "Rejected",
+  "justification": "...",
+  "matched_clauses": [
+    {{
+      "text": "...",
+      "similarity": float,
+      "source": "..."
+    }},
+    ...
+  ]
+}}
+"""}
+    ]
 
-        result_json["matched_clauses"] = formatted_clauses
-        return result_json
+def _analyze_result(raw, parsed_input, formatted_clauses):
+    """The decision from an analyze_claim reply; the extracted fields go into `parsed_input`."""
+    result_json = extract_json_from_text(raw)
+    if not result_json or "decision" not in result_json:
+        raise ValueError("Failed to parse JSON from decision LLM response")
 
+    extracted = result_json.pop("input", None)
+    if isinstance(extracted, dict):
+        parsed_input.update(validate_parsed_input(extracted))
+    result_json["matched_clauses"] = formatted_clauses
+    return result_json
+
+def _analyzed_input(query, parsed_input, decision_response):
+    """
+    Fields from an analyze_claim reply with fallbacks applied. Memoized like
+    a parse call when the reply succeeded and extracted any of them.
+    """
+    extracted = any(value is not None for value in parsed_input.values())
+    parsed_input = apply_fallbacks(parsed_input, query)
+    if extracted and not is_llm_error(decision_response):
+        parse_cache.set(query, parsed_input)
+    return parsed_input
+
+def analyze_claim(query, top_chunks, source_name="Policy Document A", query_vector=None, timeout=None):
+    """
+    Single-call variant of hybrid_parse_input + make_decision. When the
+    fields are already known, only the decision is asked for.
+
+    Returns:
+        tuple: (parsed_input, decision_response) in the same shapes the
+        two-call path produces. Fields the LLM leaves empty go through the
+        regex/GeoText fallbacks.
+    """
+    parsed_input = _parse_shortcut(query)
+    if parsed_input is not None:
+        return parsed_input, make_decision(
+            parsed_input, top_chunks, source_name=source_name, query=query, query_vector=query_vector, timeout=timeout,
+        )
+    formatted_clauses = format_clauses(top_chunks, source_name)
+    parsed_input = empty_parsed_input()
+    try:
+        clauses = prompt_clauses(query, top_chunks, source_name, "claim", query_vector=query_vector)
+        response = chat_completion(messages=_analyze_messages(query, clauses), timeout=timeout)
+        decision_response = _analyze_result(reply_text(response), parsed_input, formatted_clauses)
+    except Exception as e:
+        decision_response = _decision_error(e, formatted_clauses)
+    return _analyzed_input(query, parsed_input, decision_response), decision_response
+
+async def analyze_claim_async(query, top_chunks, source_name="Policy Document A", query_vector=None, offload=None):
+    parsed_input = _parse_shortcut(query)
+    if parsed_input is not None:
+        return parsed_input, await make_decision_async(
+            parsed_input, top_chunks, source_name=source_name, query=query, query_vector=query_vector, offload=offload,
+        )
+    formatted_clauses = format_clauses(top_chunks, source_name)
+    parsed_input = empty_parsed_input()
+    try:
+        clauses = await prompt_clauses_async(
+            query, top_chunks, source_name, "claim", query_vector=query_vector, offload=offload,
+        )
+        response = await chat_completion_async(messages=_analyze_messages(query, clauses))
+        decision_response = _analyze_result(reply_text(response), parsed_input, formatted_clauses)
+    except Exception as e:
+        decision_response = _decision_error(e, formatted_clauses)
+    return _analyzed_input(query, parsed_input, decision_response), decision_response
+
+def _answer_context(question, top_chunks, query_vector=None):
+    return build_context(question, top_chunks, query_vector=query_vector, call="answer").chunks
+
+def _answer_messages(question, context_chunks):
+    top_text = "\n\n".join([chunk for chunk, _ in context_chunks if chunk]) or "(No relevant content found)"
+    return [
+        {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided policy document content."},
+        {"role": "user", "content": f"Document Content:\n{top_text}\n\nQuestion: {question}\n\nAnswer the question based only on the content above. Be clear, concise, and factual."}
+    ]
+
+def answer_question(question, top_chunks, timeout=None, client=None, query_vector=None):
+    """
+    Answer a free-form question from the retrieved chunks only.
+    `client` defaults to the shared Groq client; pass a stub in tests.
+    """
+    messages = _answer_messages(question, _answer_context(question, top_chunks, query_vector))
+    return reply_text(chat_completion(client, messages=messages, timeout=timeout))
+
+async def answer_question_async(question, top_chunks, timeout=None, client=None, query_vector=None, offload=None):
+    """answer_question with the context fitted off the event loop (see prompt_clauses_async)."""
+    run = offload or asyncio.to_thread
+    context_chunks = await run(_answer_context, question, top_chunks, query_vector)
+    messages = _answer_messages(question, context_chunks)
+    return reply_text(await chat_completion_async(client, messages=messages, timeout=timeout))
+
+def decide_claim(query, top_chunks, source_name="Policy Document A", query_vector=None, timeout=None):
+    """
+    (parsed_input, decision_response) via analyze_claim or the two-call path,
+    per SINGLE_CALL_MODE. `timeout` bounds each LLM call.
+    """
+    if SINGLE_CALL_MODE:
+        return analyze_claim(query, top_chunks, source_name=source_name, query_vector=query_vector, timeout=timeout)
+    parsed_input = hybrid_parse_input(query, timeout=timeout)
+    return parsed_input, make_decision(
+        parsed_input, top_chunks, source_name=source_name, query=query, query_vector=query_vector, timeout=timeout,
+    )
+
+def decide_claim_stream(query, top_chunks, source_name="Policy Document A", parsed_input=None, query_vector=None):
+    """
+    decide_claim with the decision call streamed. Yields ("token", text) for
+    each delta of the LLM reply, then ("result", (parsed_input, decision_response))
+    once the reply has been parsed and validated. In two-call mode a
+    `parsed_input` already at hand skips the parse call.
+    """
+    formatted_clauses = format_clauses(top_chunks, source_name)
+    single_call = False
+    if SINGLE_CALL_MODE:
+        parsed_input = _parse_shortcut(query)
+        single_call = parsed_input is None
+        if single_call:
+            parsed_input = empty_parsed_input()
+    elif parsed_input is None:
+        parsed_input = hybrid_parse_input(query)
+
+    parts = []
+    try:
+        if single_call:
+            clauses = prompt_clauses(query, top_chunks, source_name, "claim", query_vector=query_vector)
+            messages = _analyze_messages(query, clauses)
+        else:
+            clauses = prompt_clauses(
+                _decision_query(parsed_input, query), top_chunks, source_name, "decision", query_vector=query_vector,
+            )
+            messages = _decision_messages(parsed_input, clauses)
+        for delta in chat_completion_stream(messages=messages):
+            parts.append(delta)
+            yield "token", delta
+        raw = "".join(parts).strip()
+        if single_call:
+            decision_response = _analyze_result(raw, parsed_input, formatted_clauses)
+        else:
+            decision_response = _decision_result(raw, formatted_clauses)
     except Exception as e:
-        print(f"[ERROR] Decision LLM failed: {e}")
-        return {
-            "decision": "Rejected",
-            "justification": f"LLM processing error: {str(e)}",
-            "matched_clauses": formatted_clauses
-        }
+        decision_response = _decision_error(e, formatted_clauses)
+    if single_call:
+        parsed_input = _analyzed_input(query, parsed_input, decision_response)
+    yield "result", (parsed_input, decision_response)
 
 def process_claim(query, top_chunks, summary="", document_id=None, filename=None):
     """
@@ -168,8 +525,7 @@ def process_claim(query, top_chunks, summary="", document_id=None, filename=None
     Returns:
         dict: structured response matching your original format
     """
-    parsed_input = hybrid_parse_input(query)
-    decision_response = make_decision(parsed_input, top_chunks)
+    parsed_input, decision_response = decide_claim(query, top_chunks)
 
     return {
         "id": str(uuid.uuid4()),
@@ -0,0 +1,62 @@
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ann_index import benchmark, build_benchmark
+from api.doc_store import document_store
+from api.models import organization_documents
+
+
+class Command(BaseCommand):
+    help = "Measure IVF index recall@k and latency against brute-force search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="Benchmark on the stored chunks of this user's organization.")
+        parser.add_argument("--synthetic", type=int, default=100000,
+                            help="Number of synthetic clustered vectors when --username is not given.")
+        parser.add_argument("--dim", type=int, default=300)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--n-lists", type=int, default=None)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--build-docs", default="",
+                            help="Comma-separated document counts: time a full index build for each instead.")
+        parser.add_argument("--rows-per-doc", type=int, default=50)
+
+    def handle(self, *args, **options):
+        if options["build_docs"]:
+            self.stdout.write(f"{'docs':>8} {'rows':>10} {'build s':>10}")
+            for n_docs in (int(v) for v in options["build_docs"].split(",") if v):
+                seconds = build_benchmark(n_docs, options["rows_per_doc"], options["dim"], options["seed"])
+                self.stdout.write(f"{n_docs:>8} {n_docs * options['rows_per_doc']:>10} {seconds:>10.3f}")
+            return
+        rng = np.random.default_rng(options["seed"])
+        if options["username"]:
+            try:
+                user = User.objects.get(username=options["username"])
+            except User.DoesNotExist:
+                raise CommandError(f"No such user: {options['username']}")
+            matrices = []
+            for document in organization_documents(user):
+                stored = document_store.get(document.id)
+                if stored is not None and len(stored.embeddings):
+                    matrices.append(np.asarray(stored.embeddings))
+            if not matrices:
+                raise CommandError("No stored chunk embeddings for this organization.")
+            vectors = np.concatenate(matrices)
+            # Held-in queries perturbed so they are not exact duplicates
+            picks = vectors[rng.choice(len(vectors), min(options["queries"], len(vectors)), replace=False)]
+            queries = picks + 0.1 * rng.standard_normal(picks.shape).astype(np.float32)
+        else:
+            n, dim = options["synthetic"], options["dim"]
+            centers = rng.standard_normal((max(1, n // 250), dim)).astype(np.float32)
+            vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+            queries = centers[rng.integers(0, len(centers), options["queries"])] + 0.5 * rng.standard_normal((options["queries"], dim)).astype(np.float32)
+
+        self.stdout.write(f"{len(vectors)} vectors, {len(queries)} queries, k={options['k']}")
+        self.stdout.write(f"{'n_lists':>8} {'n_probe':>8} {'recall':>8} {'ms/query':>10} {'brute ms':>10}")
+        for row in benchmark(vectors, queries, k=options["k"], n_lists=options["n_lists"]):
+            self.stdout.write(
+                f"{row['n_lists']:>8} {row['n_probe']:>8} {row['recall']:>8.3f} "
+                f"{row['ms_per_query']:>10.3f} {row['brute_force_ms_per_query']:>10.3f}"
+            )
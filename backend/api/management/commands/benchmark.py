@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import suite
+
+
+def _ints(value):
+    return tuple(int(v) for v in value.split(",") if v)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark parsing, chunking, embedding, retrieval and the upload/analyze/hackrx views "
+        "on synthetic documents, offline (synthetic word vectors, stub Groq client)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=_ints, default=suite.DEFAULT_SIZES,
+                            help="Comma-separated document sizes in pages (default: 10,100,1000).")
+        parser.add_argument("--formats", default=",".join(suite.DEFAULT_FORMATS),
+                            help="Comma-separated document formats for parse benchmarks (pdf,docx).")
+        parser.add_argument("--repeat", type=int, default=suite.DEFAULT_REPEAT)
+        parser.add_argument("--skip-views", action="store_true",
+                            help="Only run the component benchmarks (no test database needed).")
+        parser.add_argument("--output", help="Write the JSON report to this file.")
+        parser.add_argument("--baseline", help="Compare against a JSON report from an earlier run.")
+        parser.add_argument("--threshold", type=float, default=suite.DEFAULT_THRESHOLD,
+                            help="Relative slowdown of the median that counts as a regression (default: 0.10).")
+
+    def handle(self, *args, **options):
+        formats = tuple(f for f in options["formats"].split(",") if f)
+        report = suite.run_suite(
+            sizes=options["sizes"], formats=formats, repeat=options["repeat"],
+            views=not options["skip_views"], log=self._log,
+        )
+        if options["output"]:
+            suite.save(report, options["output"])
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if not options["baseline"]:
+            return
+        rows = suite.compare(report, suite.load(options["baseline"]), threshold=options["threshold"])
+        self.stdout.write(f"\n{'benchmark':<32} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            self.stdout.write(
+                f"{row['name']:<32} {row['baseline_s'] * 1000:>12.1f} {row['current_s'] * 1000:>12.1f} "
+                f"{row['change'] * 100:>7.1f}%{flag}"
+            )
+        regressions = [row["name"] for row in rows if row["regression"]]
+        if regressions:
+            raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def _log(self, result):
+        if "median_s" not in result:
+            self.stdout.write(f"{result['name']:<32} skipped ({result.get('skipped')})")
+            return
+        rate = result.get("throughput_per_s")
+        rate = f"{rate:>12.1f} {result['unit']}/s" if rate else ""
+        self.stdout.write(f"{result['name']:<32} {result['median_s'] * 1000:>10.1f} ms {rate}")
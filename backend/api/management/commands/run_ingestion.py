@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from api.ingestion import drain, requeue_running
+
+
+class Command(BaseCommand):
+    help = "Process queued document ingestion jobs in this process."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll", type=float, default=None,
+            help="Keep running, checking for new jobs every POLL seconds when idle.",
+        )
+        parser.add_argument(
+            "--requeue-running", action="store_true",
+            help="First return jobs left in 'running' by a crashed worker to the queue.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_running"]:
+            self.stdout.write(f"Requeued {requeue_running()} job(s)")
+        processed = drain(poll=options["poll"])
+        self.stdout.write(f"Processed {processed} job(s)")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Preload the tokenizer, parsers and GloVe model and print how long each took."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--skip-model", action="store_true",
+            help="Do not load (or download) the GloVe model.",
+        )
+
+    def handle(self, *args, **options):
+        timings = warm_up(load_model=not options["skip_model"])
+        for stage, seconds in timings.items():
+            self.stdout.write(f"{stage:<20} {seconds * 1000:9.1f} ms")
+        self.stdout.write(f"{'total':<20} {sum(timings.values()) * 1000:9.1f} ms")
@@ -0,0 +1,353 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import ContextDecorator, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# In-process metrics in the Prometheus text format, without a client library.
+# Stage timings are exclusive: when one timed stage pulls from another (embed
+# consuming the chunk stream, chunking consuming parsed pages) the inner
+# stage's time is not counted again in the outer one.
+# SERVER_TIMING=True also returns each request's stage totals in a
+# Server-Timing response header.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "False") == "True"
+# When set, GET /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_value(value):
+    # Escapes required by the text exposition format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_label_value(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels + ("le",), values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, values)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {series[-1]:.6f}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "policyintel_stage_seconds", "Time spent in each pipeline stage (exclusive of nested stages).", ("stage",),
+)
+request_seconds = Histogram(
+    "policyintel_request_seconds", "HTTP request latency by route.", ("route", "method"),
+)
+llm_calls = Counter("policyintel_llm_calls_total", "LLM API calls by model and outcome.", ("model", "outcome"))
+llm_attempts = Counter(
+    "policyintel_llm_attempts_total", "Requests sent to the LLM API by model and kind (first, retry, hedge).", ("model", "kind"),
+)
+llm_seconds = Histogram(
+    "policyintel_llm_seconds", "Latency of each request sent to the LLM API by model and outcome.", ("model", "outcome"),
+)
+llm_tokens = Counter("policyintel_llm_tokens_total", "LLM tokens by model and kind.", ("model", "kind"))
+prompt_tokens = Counter(
+    "policyintel_prompt_tokens_total",
+    "Estimated tokens of retrieved context sent to, or saved from, LLM prompts by the prompt builder.",
+    ("call", "kind"),
+)
+
+_metrics = [stage_seconds, request_seconds, llm_calls, llm_attempts, llm_seconds, llm_tokens, prompt_tokens]
+_collectors = []
+
+
+def register_collector(func):
+    """
+    `func()` returns [(name, help, {((label, value), ...): number})] gauges,
+    read at scrape time (cache hit rates and the like). An optional fourth
+    item "counter" marks a series that only grows (name it *_total).
+    """
+    _collectors.append(func)
+    return func
+
+
+class RequestTimings:
+    """Per-request stage totals for the Server-Timing header."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + 1)
+
+    def header(self):
+        with self._lock:
+            items = list(self.stages.items())
+        return ", ".join(
+            f'{stage};dur={total * 1000:.1f};desc="{count}x"' for stage, (total, count) in items
+        )
+
+
+# Travels with the request; fan_out and the overlap pool copy the context into
+# their worker threads so stages run there are attributed to the request too
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+_spans = threading.local()
+
+
+def _stack():
+    stack = getattr(_spans, "stack", None)
+    if stack is None:
+        stack = _spans.stack = []
+    return stack
+
+
+def _enter():
+    frame = [time.perf_counter(), 0.0]  # start, time spent in nested stages
+    _stack().append(frame)
+    return frame
+
+
+def _exit(frame):
+    """Pop `frame` and return its exclusive seconds."""
+    elapsed = time.perf_counter() - frame[0]
+    stack = _stack()
+    stack.pop()
+    if stack:
+        stack[-1][1] += elapsed
+    return elapsed - frame[1]
+
+
+def record(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+class timed(ContextDecorator):
+    """
+    Time a block or function as `stage`:
+
+        with timed("retrieval"):
+            ...
+
+        @timed("embed")
+        def embed_texts(...):
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._frames = threading.local()
+
+    def __enter__(self):
+        frames = getattr(self._frames, "frames", None)
+        if frames is None:
+            frames = self._frames.frames = []
+        frames.append(_enter())
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, _exit(self._frames.frames.pop()))
+        return False
+
+
+def timed_iter(stage, iterable):
+    """
+    Yield from `iterable`, recording the time spent producing items as one
+    `stage` observation once it is exhausted or closed.
+    """
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            frame = _enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += _exit(frame)
+            yield item
+    finally:
+        record(stage, total)
+
+
+@contextmanager
+def timed_await(stage):
+    """
+    Time a block that awaits as `stage`, by wall clock. Other requests'
+    stages run on the event loop thread meanwhile, so it stays off the span
+    stack and is not exclusive of nested stages.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def record_llm_call(model, response=None, error=None, outcome=None):
+    llm_calls.inc(model, outcome or ("error" if error is not None else "ok"))
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        llm_tokens.inc(model, "prompt", amount=getattr(usage, "prompt_tokens", 0) or 0)
+        llm_tokens.inc(model, "completion", amount=getattr(usage, "completion_tokens", 0) or 0)
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            print(f"[WARN] Metrics collector {collector.__name__} failed: {e}")
+            continue
+        for name, help, samples, *kind in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind[0] if kind else 'gauge'}")
+            for labels, value in samples.items():
+                names = tuple(k for k, _ in labels)
+                values = tuple(v for _, v in labels)
+                lines.append(f"{name}{_label_text(names, values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class ServerTimingMiddleware:
+    """Times every request by route and, with SERVER_TIMING on, reports its stages."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    def _finish(self, request, response, timings, elapsed):
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        request_seconds.observe(elapsed, route, request.method)
+        if SERVER_TIMING:
+            timings.add("total", elapsed)
+            response["Server-Timing"] = timings.header()
+        return response
+
+
+@register_collector
+def cache_stats():
+    from .content_cache import content_cache
+    from .query_cache import parse_cache
+    from .downloader import downloader
+    from .answer_cache import answer_cache
+
+    caches = {
+        "content": content_cache.stats(),
+        "parse": parse_cache.stats(),
+        "download": downloader.stats(),
+        "answer": answer_cache.stats(),
+    }
+    gauges = []
+    for key, name, help, kind in (
+        ("hits", "policyintel_cache_hits_total", "Cache hits since process start.", "counter"),
+        ("misses", "policyintel_cache_misses_total", "Cache misses since process start.", "counter"),
+        ("hit_rate", "policyintel_cache_hit_rate", "Cache hit rate since process start.", "gauge"),
+    ):
+        gauges.append((
+            name,
+            help,
+            {(("cache", cache),): stats[key] for cache, stats in caches.items()},
+            kind,
+        ))
+    gauges.append((
+        "policyintel_answer_cache_semantic_hits_total",
+        "Answer cache hits served by a near-duplicate question.",
+        {(): caches["answer"]["semantic_hits"]},
+        "counter",
+    ))
+    gauges.append((
+        "policyintel_parse_fast_path_rate",
+        "Share of parse-cache misses answered by the deterministic parser.",
+        {(): caches["parse"]["fast_path_rate"]},
+    ))
+    return gauges
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_ingestionjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='claimquery',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='claimquery_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='claimquery',
+            index=models.Index(fields=['user', 'document', '-created_at', '-id'], name='claimquery_user_doc_idx'),
+        ),
+    ]
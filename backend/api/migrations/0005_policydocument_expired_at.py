@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_claimquery_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='policydocument',
+            name='expired_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -15,6 +15,8 @@ class PolicyDocument(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     filename = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Set when the document store evicted the bundle; the file must be uploaded again
+    expired_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Doc: {self.filename} by {self.user.username}"
@@ -29,5 +31,58 @@ class ClaimQuery(models.Model):
     decision_response = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # my_queries pages through (created_at, id) newest first, per user
+            models.Index(fields=["user", "-created_at", "-id"], name="claimquery_user_created_idx"),
+            models.Index(fields=["user", "document", "-created_at", "-id"], name="claimquery_user_doc_idx"),
+        ]
+
     def __str__(self):
         return f"Query by {self.user.username} on {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+
+
+class IngestionJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=16, blank=True, default="")
+    progress = models.JSONField(default=dict)
+    size_bytes = models.BigIntegerField(default=0)
+    pages = models.IntegerField(default=0)
+    document = models.ForeignKey(PolicyDocument, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ingestion of {self.filename} ({self.status})"
+
+
+def organization_key(user):
+    """Scope for cross-document search: the user's organization, or just the user."""
+    profile = UserProfile.objects.filter(user=user).first()
+    if profile and profile.organization and profile.organization.strip():
+        return f"org:{profile.organization.strip().lower()}"
+    return f"user:{user.id}"
+
+
+def organization_documents(user):
+    profile = UserProfile.objects.filter(user=user).first()
+    if profile and profile.organization and profile.organization.strip():
+        return PolicyDocument.objects.filter(
+            user__userprofile__organization__iexact=profile.organization.strip()
+        )
+    return PolicyDocument.objects.filter(user=user)
@@ -0,0 +1,141 @@
+from io import BytesIO
+
+import numpy as np
+
+from .document_parser import (
+    iter_document_blocks, iter_chunk_records, SENTENCE_SPLITTER,
+    DEFAULT_MAX_PAGES, DEFAULT_MAX_PARAGRAPHS, DEFAULT_MAX_WORDS,
+)
+from .embeddings import embed_chunks, build_embedding_matrix
+from .content_cache import content_cache, content_hash, file_content_hash
+from .bm25 import BM25Builder
+
+
+class DocumentParseError(Exception):
+    """The document could not be read (unsupported or corrupt file)."""
+
+
+class DocumentProcessingError(Exception):
+    """Chunking or embedding failed after the document was read."""
+
+
+class ProcessedDocument:
+    def __init__(self, text, chunks, embeddings, content_hash, spans=None, bm25=None, cached=False):
+        # `text` may be a callable, for cache hits whose text is read only when needed
+        self._text = text
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.spans = spans
+        self.bm25 = bm25
+        self.content_hash = content_hash
+        self.cached = cached
+
+    @property
+    def text(self):
+        if callable(self._text):
+            self._text = self._text()
+        return self._text
+
+
+def _parse_guard(blocks):
+    try:
+        yield from blocks
+    except Exception as e:
+        raise DocumentParseError(str(e)) from e
+
+
+def _collect(items, into, progress=None, stage=None):
+    for item in items:
+        into.append(item)
+        if progress is not None:
+            progress(stage, len(into))
+        yield item
+
+
+def _indexed_texts(records, bm25_builder):
+    for record in records:
+        bm25_builder.add(record.text)
+        yield record.text
+
+
+def _report(progress, stage, done, total=None):
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def chunk_spans(records):
+    """(n, 4) int64 array of page_start, page_end, char_start, char_end; -1 for unknown pages."""
+    def page(value):
+        return -1 if value is None else value
+
+    return np.array(
+        [(page(r.page_start), page(r.page_end), r.char_start, r.char_end) for r in records],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+
+
+def process_document(data, filename, max_pages=DEFAULT_MAX_PAGES,
+                     max_paragraphs=DEFAULT_MAX_PARAGRAPHS, max_words=DEFAULT_MAX_WORDS, splitter=None, progress=None):
+    """
+    parse -> chunk -> embed for raw document bytes (or a binary file object
+    such as a spooled download), served from the content
+    cache when the same bytes were processed with the same limits before.
+
+    Stages are chained as generators: chunks are embedded while later pages
+    are still being extracted. `progress(stage, done, total=None)` is called
+    as blocks and chunks come through and once per finished stage.
+
+    Raises:
+        DocumentParseError: the file could not be parsed
+        DocumentProcessingError: chunking or embedding failed
+    """
+    splitter = splitter or SENTENCE_SPLITTER
+    if isinstance(data, (bytes, bytearray)):
+        digest = content_hash(data)
+        source = BytesIO(data)
+    else:
+        digest = file_content_hash(data)
+        source = data
+    cache_key = content_cache.key(
+        digest, filename,
+        max_pages=max_pages,
+        max_paragraphs=max_paragraphs,
+        max_words=max_words,
+        splitter=splitter,
+    )
+    cached = content_cache.get(cache_key)
+    if cached is not None:
+        for stage in ("parse", "chunk", "embed"):
+            _report(progress, stage, len(cached.chunks), len(cached.chunks))
+        return ProcessedDocument(
+            lambda: cached.text, cached.chunks, cached.embeddings, digest,
+            spans=cached.spans, bm25=cached.bm25, cached=True,
+        )
+
+    blocks = []
+    records = []
+    bm25_builder = BM25Builder()
+    try:
+        stream = _collect(_parse_guard(
+            iter_document_blocks(source, filename, max_pages=max_pages, max_paragraphs=max_paragraphs)
+        ), blocks, progress, "parse")
+        record_stream = _collect(
+            iter_chunk_records(stream, max_words=max_words, splitter=splitter), records, progress, "chunk"
+        )
+        embeddings = build_embedding_matrix(embed_chunks(_indexed_texts(record_stream, bm25_builder)))
+    except DocumentParseError:
+        raise
+    except Exception as e:
+        raise DocumentProcessingError(str(e)) from e
+
+    _report(progress, "parse", len(blocks), len(blocks))
+    _report(progress, "chunk", len(records), len(records))
+    _report(progress, "embed", len(records), len(records))
+
+    text = "\n".join(block_text for _, block_text in blocks).strip()
+    chunks = [record.text for record in records]
+    spans = chunk_spans(records)
+    bm25 = bm25_builder.build()
+    if text:
+        content_cache.put(cache_key, text, chunks, embeddings, content_hash=digest, spans=spans, bm25=bm25)
+    return ProcessedDocument(text, chunks, embeddings, digest, spans=spans, bm25=bm25)
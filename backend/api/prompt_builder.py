@@ -0,0 +1,157 @@
+import os
+
+import numpy as np
+
+from .document_parser import estimate_tokens, get_sentence_splitter
+from .embeddings import embed_texts, embed_query
+from .metrics import prompt_tokens
+
+# Fits retrieved context into a per-call token budget before it is pasted
+# into a prompt:
+#   1. chunks are picked in MMR order (relevance to the query minus
+#      similarity to chunks already picked); near-duplicates are dropped;
+#   2. the budget is shared out so that short chunks keep their full text
+#      and the rest split what is left equally; a chunk over its share is
+#      cut down to its sentences most similar to the query, kept in their
+#      original order. When the budget cannot give every chunk
+#      MIN_CLAUSE_TOKENS, the last ones in MMR order are left out.
+# Token counts are estimates (document_parser.estimate_tokens), not the
+# model's tokenizer.
+PROMPT_BUILDER_ENABLED = os.environ.get("PROMPT_BUILDER_ENABLED", "True") == "True"
+PROMPT_CONTEXT_TOKENS = int(os.environ.get("PROMPT_CONTEXT_TOKENS", 800))
+PROMPT_QUERY_TOKENS = int(os.environ.get("PROMPT_QUERY_TOKENS", 256))
+PROMPT_MMR_LAMBDA = float(os.environ.get("PROMPT_MMR_LAMBDA", 0.7))
+# Chunks at least this similar (cosine) to one already picked are dropped
+PROMPT_DUPLICATE_SIMILARITY = float(os.environ.get("PROMPT_DUPLICATE_SIMILARITY", 0.97))
+# Splitter for trimming clauses; regex is several times faster than Punkt on
+# the request path and boundaries matter less here than when chunking
+PROMPT_SENTENCE_SPLITTER = os.environ.get("PROMPT_SENTENCE_SPLITTER", "regex")
+MIN_CLAUSE_TOKENS = 24
+
+
+class PromptContext:
+    def __init__(self, chunks, tokens_in, tokens_out, dropped):
+        self.chunks = chunks            # [(text, score)], trimmed, in prompt order
+        self.tokens_in = tokens_in
+        self.tokens_out = tokens_out
+        self.dropped = dropped          # chunks left out entirely
+
+    @property
+    def tokens_saved(self):
+        return self.tokens_in - self.tokens_out
+
+
+def _unit_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_order(query_vector, chunk_vectors, lambda_=PROMPT_MMR_LAMBDA, duplicate=PROMPT_DUPLICATE_SIMILARITY):
+    """Indices of `chunk_vectors` in MMR order, leaving out near-duplicates."""
+    n = len(chunk_vectors)
+    if n == 0:
+        return []
+    chunks = _unit_rows(np.asarray(chunk_vectors, dtype=np.float32))
+    relevance = chunks @ _unit_rows(np.asarray(query_vector, dtype=np.float32))
+    pairwise = chunks @ chunks.T
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    remaining = np.ones(n, dtype=bool)
+    order = []
+    while remaining.any():
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = np.where(remaining, lambda_ * relevance - (1 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        remaining[best] = False
+        if redundancy[best] >= duplicate:
+            continue
+        order.append(best)
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return order
+
+
+def _trim(text, tokens, budget, query_vector, splitter):
+    """(trimmed text, its estimated tokens); `tokens` is the estimate for `text`."""
+    if tokens <= budget:
+        return text, tokens
+    sentences = (splitter or get_sentence_splitter(PROMPT_SENTENCE_SPLITTER))(text)
+    if not sentences:
+        return "", 0
+    if query_vector is not None and len(sentences) > 1:
+        ranking = np.argsort(-(_unit_rows(embed_texts(sentences)) @ _unit_rows(np.asarray(query_vector))), kind="stable")
+    else:
+        ranking = range(len(sentences))
+    keep = []
+    used = 0
+    for i in ranking:
+        n = estimate_tokens(sentences[i])
+        if used + n <= budget:
+            keep.append(i)
+            used += n
+    if not keep:
+        words = []
+        for word in sentences[ranking[0]].split():
+            n = estimate_tokens(word)
+            if used + n >= budget:
+                break
+            words.append(word)
+            used += n
+        return " ".join(words) + " …", used + 1
+    return " ".join(sentences[i] for i in sorted(keep)), used
+
+
+def trim_to_budget(text, budget, query_vector=None, splitter=None):
+    """
+    `text` cut to at most `budget` estimated tokens: whole when it fits,
+    else its sentences most similar to `query_vector` (the leading ones
+    without a query), in their original order. A single sentence over the
+    budget is cut on a word boundary.
+    """
+    return _trim(text, estimate_tokens(text), budget, query_vector, splitter)[0]
+
+
+def build_context(query, top_chunks, budget=PROMPT_CONTEXT_TOKENS, query_vector=None, call="prompt"):
+    """
+    Fit retrieved `top_chunks` ([(text, score)]) into `budget` tokens for
+    `query`. Saved tokens are counted in the prompt-token metrics under `call`.
+
+    Returns:
+        PromptContext
+    """
+    texts = [text for text, _ in top_chunks]
+    sizes = [estimate_tokens(text) for text in texts]
+    tokens_in = sum(sizes)
+    if not PROMPT_BUILDER_ENABLED or not texts:
+        return PromptContext(list(top_chunks), tokens_in, tokens_in, 0)
+
+    if query_vector is None:
+        query_vector = embed_query(query)
+    order = mmr_order(query_vector, embed_texts(texts))[:max(1, budget // MIN_CLAUSE_TOKENS)]
+
+    allowances = {}
+    remaining = budget
+    for position, i in enumerate(sorted(order, key=sizes.__getitem__)):
+        allowances[i] = remaining // (len(order) - position)
+        remaining -= min(sizes[i], allowances[i])
+
+    chunks = []
+    tokens_out = 0
+    for i in order:
+        text, tokens = _trim(texts[i], sizes[i], allowances[i], query_vector, None)
+        chunks.append((text, top_chunks[i][1]))
+        tokens_out += tokens
+    prompt_tokens.inc(call, "sent", amount=tokens_out)
+    prompt_tokens.inc(call, "saved", amount=tokens_in - tokens_out)
+    return PromptContext(chunks, tokens_in, tokens_out, len(texts) - len(chunks))
+
+
+def fit_query(query, budget=PROMPT_QUERY_TOKENS, call="parse"):
+    """`query` cut to `budget` tokens for prompts that carry no retrieved context."""
+    if not PROMPT_BUILDER_ENABLED:
+        return query
+    tokens = estimate_tokens(query)
+    fitted, fitted_tokens = _trim(query, tokens, budget, None, None)
+    saved = tokens - fitted_tokens
+    if saved:
+        prompt_tokens.inc(call, "saved", amount=saved)
+    return fitted
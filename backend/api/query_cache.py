@@ -0,0 +1,152 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Memoizes query parses (hybrid_parse_input, and the fields analyze_claim
+# extracts in single-call mode) by normalized query text.
+# "local" keeps entries in this process; "django" goes through Django's cache
+# framework (configure CACHES with a shared backend to share across workers).
+PARSE_CACHE_BACKEND = os.environ.get("PARSE_CACHE_BACKEND", "local")
+PARSE_CACHE_ALIAS = os.environ.get("PARSE_CACHE_ALIAS", "default")
+PARSE_CACHE_TTL = int(os.environ.get("PARSE_CACHE_TTL", 24 * 60 * 60))
+PARSE_CACHE_MAX_ENTRIES = int(os.environ.get("PARSE_CACHE_MAX_ENTRIES", 10000))
+# Bump whenever the fast-path parser changes what it extracts, so entries it
+# filled before are not served from a shared cache
+PARSE_CACHE_VERSION = 2
+
+
+def normalize_query(query):
+    query = re.sub(r"\s+", " ", query.lower()).strip()
+    return query.strip(" .,;:!?")
+
+
+class LocalTTLCache:
+    """
+    In-process LRU cache whose entries also expire after `ttl` seconds.
+    With `max_bytes`, str/bytes values also count against a size budget.
+    """
+
+    def __init__(self, ttl=PARSE_CACHE_TTL, max_entries=PARSE_CACHE_MAX_ENTRIES, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        return len(value) if isinstance(value, (str, bytes)) else 0
+
+    def _pop(self, key):
+        _, value = self._data.pop(key)
+        self._bytes -= self._size(value)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += self._size(value)
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1
+            ):
+                self._pop(next(iter(self._data)))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class DjangoCache:
+    """Adapter over a Django cache alias; eviction is left to that backend."""
+
+    def __init__(self, alias=PARSE_CACHE_ALIAS, ttl=PARSE_CACHE_TTL, prefix="policyintel:"):
+        self.alias = alias
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _key(self, key):
+        # Django cache keys must be short and memcached-safe
+        return self.prefix + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        return self._cache().get(self._key(key))
+
+    def set(self, key, value):
+        self._cache().set(self._key(key), value, timeout=self.ttl)
+
+    def clear(self):
+        self._cache().clear()
+
+
+def make_backend(name=PARSE_CACHE_BACKEND, **kwargs):
+    if name == "django":
+        return DjangoCache(**kwargs)
+    if name == "local":
+        return LocalTTLCache(**kwargs)
+    raise ValueError(f"Unknown cache backend: {name}")
+
+
+class ParseCache:
+    def __init__(self, backend=None):
+        self.backend = backend or make_backend()
+        self.hits = 0
+        self.misses = 0
+        self.fast_path = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(query):
+        return f"v{PARSE_CACHE_VERSION}:{normalize_query(query)}"
+
+    def get(self, query):
+        value = self.backend.get(self._key(query))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return dict(value) if value is not None else None
+
+    def set(self, query, parsed):
+        self.backend.set(self._key(query), dict(parsed))
+
+    def record_fast_path(self):
+        with self._lock:
+            self.fast_path += 1
+
+    def stats(self):
+        with self._lock:
+            hits, misses, fast_path = self.hits, self.misses, self.fast_path
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "fast_path": fast_path,
+            "fast_path_rate": fast_path / misses if misses else 0.0,
+        }
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import PolicyDocument, organization_key
+from .doc_store import document_store
+from .ann_index import index_registry
+
+
+@receiver(post_delete, sender=PolicyDocument)
+def drop_stored_document(sender, instance, **kwargs):
+    document_store.delete(instance.id)
+    try:
+        index_registry.remove_document(organization_key(instance.user), instance.id)
+    except Exception as e:
+        print(f"[WARN] Failed to remove document {instance.id} from ANN index: {e}")
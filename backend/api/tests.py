@@ -1,3 +1,1200 @@
-from django.test import TestCase
+import io
+import os
+import json
+import time
+import uuid
+import base64
+import shutil
+import asyncio
+import zipfile
+import tempfile
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+from groq import APIStatusError
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import include, path
+from rest_framework.test import APIClient
+
+from .document_parser import (
+    iter_pdf_pages, iter_docx_paragraphs, extract_text_python_docx, iter_chunk_records, count_words, PDF_PAGES_PER_TASK,
+)
+from .llm_processor import (
+    deterministic_parse, extract_age, make_decision_async, is_llm_error, analyze_claim, analyze_claim_async,
+)
+from .query_cache import LocalTTLCache, ParseCache
+from .downloader import Downloader, DownloadError, DownloadTooLarge
+from .benchmarks import synthetic
+from .benchmarks.suite import file_server, isolated_environment
+from .ann_index import IndexRegistry, build_benchmark
+from .bm25 import BM25Index, BM25_B, BM25_K1, fuse_scores, hybrid_top_k, tokenize
+from .doc_store import DocumentStore, document_store
+from .embeddings import embed_texts, build_embedding_matrix, top_k_indices, get_top_k_chunks, _embed_batch
+from .word_vectors import CompactVectors, VECTORS_FILE, VOCAB_FILE
+from .models import ClaimQuery, PolicyDocument
+from .metrics import Counter, render
+from .answer_cache import AnswerCache
+from .content_cache import ContentCache, TEXT_FILE
+from .llm_client import CircuitBreaker, LLMUnavailable, chat_completion, _model_state
+from . import async_views, document_parser, ingestion, llm_client, llm_processor, views
+
+
+class DeterministicParseTests(SimpleTestCase):
+    def test_policy_term_is_not_an_age(self):
+        parsed = deterministic_parse("male, knee surgery in Pune, 10 year policy")
+        self.assertIsNone(parsed["age"])
+        self.assertEqual(parsed["policy_duration"], "10 years")
+
+    def test_old_policy_is_not_an_age(self):
+        self.assertIsNone(extract_age("knee surgery, 3 year old policy"))
+
+    def test_age_contexts(self):
+        for query in ("46M, knee surgery", "46 yo male", "46 years old, knee surgery",
+                      "a 46-year-old man", "aged 46", "age: 46", "46 female, Pune"):
+            with self.subTest(query=query):
+                self.assertEqual(extract_age(query), 46)
+
+    def test_age_next_to_policy_term(self):
+        parsed = deterministic_parse("46M, knee surgery in Pune, 3-month policy")
+        self.assertEqual(parsed["age"], 46)
+        self.assertEqual(parsed["gender"], "male")
+        self.assertEqual(parsed["procedure"], "knee surgery")
+        self.assertEqual(parsed["policy_duration"], "3 months")
+
+    def test_conflicting_ages_are_left_to_the_llm(self):
+        self.assertIsNone(extract_age("46M, spouse aged 44"))
+
+    def test_gender_is_not_a_procedure_qualifier(self):
+        parsed = deterministic_parse("female dialysis treatment in Mumbai, 2 year policy")
+        self.assertEqual(parsed["procedure"], "dialysis treatment")
+        self.assertEqual(parsed["gender"], "female")
+
+    def test_stop_word_is_not_a_procedure_qualifier(self):
+        self.assertEqual(deterministic_parse("claim for surgery in Pune")["procedure"], "surgery")
+
+    def test_several_procedures_are_left_to_the_llm(self):
+        self.assertIsNone(deterministic_parse("46M knee surgery and hip replacement")["procedure"])
+
+    def test_both_genders_are_left_to_the_llm(self):
+        self.assertIsNone(deterministic_parse("46 male and his 44 female spouse")["gender"])
+
+
+class PromptRecordingStubGroq(synthetic.StubGroq):
+    """StubGroq that keeps the system prompt of every call."""
+
+    def __init__(self, content=synthetic.StubGroq.CONTENT):
+        super().__init__()
+        self.content = content
+        self.prompts = []
+
+    def create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][0]["content"])
+        response = super().create(**kwargs)
+        response.choices[0].message.content = self.content
+        return response
+
+
+class SingleCallParseTests(SimpleTestCase):
+    chunks = [("Knee surgery is covered after a waiting period of 3 months.", 0.9)]
+
+    def setUp(self):
+        self.enterContext(isolated_environment())
+        self.enterContext(mock.patch.object(llm_processor, "parse_cache", ParseCache(LocalTTLCache())))
+
+    def stub(self, **kwargs):
+        stub = llm_client.groq_client = PromptRecordingStubGroq(**kwargs)
+
+        async def create(**kwargs):
+            return stub.create(**kwargs)
+
+        async_stub = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        llm_client.async_groq_client = lambda: async_stub
+        return stub
+
+    def asks_for_fields(self, prompt):
+        return "Extract the claimant details" in prompt
+
+    def test_known_fields_skip_extraction(self):
+        stub = self.stub()
+        query = "46M, knee surgery in Pune, 3-month policy"
+        parsed_input, result = analyze_claim(query, self.chunks)
+        self.assertEqual(parsed_input, deterministic_parse(query))
+        self.assertEqual(result["decision"], "Approved")
+        self.assertEqual(len(stub.prompts), 1)
+        self.assertFalse(self.asks_for_fields(stub.prompts[0]))
+
+    def test_extraction_is_cached(self):
+        stub = self.stub()
+        query = "claim for my knee surgery"
+        first = analyze_claim(query, self.chunks)
+        self.assertEqual(first[0]["location"], "Pune")
+        second = asyncio.run(analyze_claim_async(query, self.chunks))
+        self.assertEqual(second[0], first[0])
+        self.assertEqual(second[1]["decision"], first[1]["decision"])
+        self.assertEqual([self.asks_for_fields(prompt) for prompt in stub.prompts], [True, False])
+
+    def test_reply_without_fields_is_not_cached(self):
+        stub = self.stub(content=json.dumps({"decision": "Approved", "justification": "Covered."}))
+        for _ in range(2):
+            parsed_input, _ = analyze_claim("claim for my knee surgery", self.chunks)
+        self.assertIsNone(parsed_input["location"])
+        self.assertEqual([self.asks_for_fields(prompt) for prompt in stub.prompts], [True, True])
+
+
+class SingleCallDecisionTests(SimpleTestCase):
+    chunks = [("Knee surgery is covered after a waiting period of 3 months.", 0.9)]
+    # leaves location and policy_duration to the LLM, so the combined prompt is used
+    query = "46 year old male, knee surgery"
+
+    def setUp(self):
+        self.enterContext(isolated_environment())
+        self.enterContext(mock.patch.object(llm_processor, "parse_cache", ParseCache(LocalTTLCache())))
+
+    def analyze(self, reply):
+        llm_client.groq_client = PromptRecordingStubGroq(content=reply)
+        return analyze_claim(self.query, self.chunks, source_name="policy.pdf")
+
+    def test_reply_in_prose(self):
+        reply = 'Here is the result:\n```json\n' + json.dumps({
+            "input": {"age": "46", "gender": "male", "procedure": "knee surgery", "location": None, "policy_duration": None},
+            "decision": "Rejected", "justification": "Waiting period not served.",
+            "matched_clauses": [{"text": "made up", "similarity": 99, "source": "elsewhere"}],
+        }) + "\n```"
+        parsed_input, result = self.analyze(reply)
+        self.assertEqual(parsed_input["age"], 46)
+        self.assertEqual(parsed_input["procedure"], "knee surgery")
+        self.assertEqual(result, {
+            "decision": "Rejected", "justification": "Waiting period not served.",
+            "matched_clauses": [{"text": self.chunks[0][0], "similarity": 90.0, "source": "policy.pdf"}],
+        })
+
+    def test_unusable_reply_falls_back_to_the_heuristics(self):
+        for reply in ("I cannot decide this claim.", '{"decision": "Approved"', '{"justification": "no decision"}'):
+            with self.subTest(reply=reply):
+                parsed_input, result = self.analyze(reply)
+                self.assertTrue(is_llm_error(result))
+                self.assertEqual(result["decision"], "Rejected")
+                self.assertEqual(result["matched_clauses"][0]["source"], "policy.pdf")
+                self.assertEqual((parsed_input["age"], parsed_input["gender"]), (46, "male"))
+
+    def test_input_that_is_not_an_object_is_ignored(self):
+        parsed_input, result = self.analyze(json.dumps({"input": "46M", "decision": "Approved", "justification": "ok"}))
+        self.assertEqual(result["decision"], "Approved")
+        self.assertFalse(is_llm_error(result))
+        self.assertEqual(parsed_input["age"], 46)
+        self.assertIsNone(parsed_input["location"])
+
+
+class TopKTests(SimpleTestCase):
+    scores = np.array([0.5, 0.9, 0.5, 0.1, 0.9, 0.5], dtype=np.float32)
+
+    def test_ties_keep_index_order(self):
+        self.assertEqual(top_k_indices(self.scores, 1).tolist(), [1])
+        self.assertEqual(top_k_indices(self.scores, 3).tolist(), [1, 4, 0])
+        self.assertEqual(top_k_indices(self.scores, 4).tolist(), [1, 4, 0, 2])
+        self.assertEqual(top_k_indices(np.zeros(100, dtype=np.float32), 5).tolist(), [0, 1, 2, 3, 4])
+
+    def test_k_out_of_range(self):
+        self.assertEqual(top_k_indices(self.scores, 10).tolist(), [1, 4, 0, 2, 5, 3])
+        self.assertEqual(top_k_indices(self.scores, 0).tolist(), [])
+        self.assertEqual(top_k_indices(np.zeros(0, dtype=np.float32), 3).tolist(), [])
+
+    def test_matches_a_full_sort(self):
+        rng = np.random.default_rng(0)
+        scores = rng.integers(0, 20, 500).astype(np.float32)
+        expected = sorted(range(len(scores)), key=lambda i: (-scores[i], i))
+        for k in (1, 7, 50, 499, 500):
+            with self.subTest(k=k):
+                self.assertEqual(top_k_indices(scores, k).tolist(), expected[:k])
+
+    def test_top_k_chunks(self):
+        # raw vectors, normalized by get_top_k_chunks
+        vectors = [np.array(v, dtype=np.float32) for v in ([2, 0], [0, 1], [1, 1], [-1, 0])]
+        top = get_top_k_chunks(np.array([1, 0.2], dtype=np.float32), vectors, ["a", "b", "c", "d"], k=5)
+        self.assertEqual([chunk for chunk, _ in top], ["a", "c", "b", "d"])
+        self.assertAlmostEqual(top[0][1], 1 / np.sqrt(1.04), places=5)
+
+
+class EmbedBatchTests(SimpleTestCase):
+    words = ["alpha", "beta", "gamma", "knee", "surgery", "\u00e9t\u00e9"]
+    texts = [
+        "alpha beta", "knee surgery knee", "", "unknown words only", "gamma", "Alpha alpha \u00e9t\u00e9 missing",
+        "  beta\tgamma\nsurgery  ",
+    ]
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = dict(zip(self.words, rng.standard_normal((len(self.words), 8)).astype(np.float32)))
+        self.model = CompactVectors.from_words(list(self.vectors), list(self.vectors.values()))
+
+    def mean_embedding(self, text):
+        known = [self.vectors[word] for word in text.split() if word in self.vectors]
+        return np.mean(known, axis=0) if known else np.zeros(8)
+
+    def test_matches_per_text_means(self):
+        expected = np.array([self.mean_embedding(text) for text in self.texts])
+        embedded = _embed_batch(self.texts, self.model)
+        self.assertEqual(embedded.dtype, np.float32)
+        np.testing.assert_allclose(embedded, expected, rtol=1e-5, atol=1e-6)
+
+    def test_batches_are_joined_in_order(self):
+        expected = _embed_batch(self.texts, self.model)
+        with mock.patch("api.embeddings._model", self.model), mock.patch("api.embeddings.EMBED_BATCH_TOKENS", 3):
+            np.testing.assert_array_equal(embed_texts(iter(self.texts)), expected)
+            self.assertEqual(embed_texts([]).shape, (0, 8))
+
+
+class CompactVectorsTests(SimpleTestCase):
+    words = ["knee", "surgery", "pre-existing", "\u00e9t\u00e9", "cover", "b"]
+
+    def setUp(self):
+        self.vectors = np.arange(len(self.words) * 3, dtype=np.float32).reshape(-1, 3)
+        self.model = CompactVectors.from_words(self.words, self.vectors)
+
+    def assert_lookups(self, model):
+        ids = model.lookup(self.words)
+        np.testing.assert_array_equal(np.asarray(model.vectors)[ids], self.vectors)
+        missing = [
+            "a",                    # before the first word
+            "zzz",                  # after the last one
+            "c",                    # between two words
+            "kne", "knees",         # prefix and extension of a word
+            "pre-existing-disease",  # longer than any word, starting with the longest one
+            "Knee", "ete", "\u00e9t", "",
+        ]
+        self.assertEqual(model.lookup(missing).tolist(), [-1] * len(missing))
+        mixed = model.lookup(["cover", "covers", "b"]).tolist()
+        self.assertEqual(mixed, [ids[self.words.index("cover")], -1, ids[self.words.index("b")]])
+
+    def test_lookup(self):
+        self.assert_lookups(self.model)
+        self.assertEqual(self.model.lookup([]).tolist(), [])
+        empty = CompactVectors.from_words([], np.zeros((0, 3), dtype=np.float32))
+        self.assertEqual(empty.lookup(["knee"]).tolist(), [-1])
+
+    def test_lookup_on_mapped_files(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        np.save(os.path.join(root, VOCAB_FILE), self.model.vocab)
+        np.save(os.path.join(root, VECTORS_FILE), self.model.vectors)
+        model = CompactVectors.load(root)
+        self.assertIsInstance(model.vocab, np.memmap)
+        self.assert_lookups(model)
+
+
+class DownloaderTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.www = os.path.join(self.root, "www")
+        os.makedirs(self.www)
+        with open(os.path.join(self.www, "policy.pdf"), "wb") as f:
+            f.write(b"x" * 5000)
+        self.downloader = Downloader(cache_dir=os.path.join(self.root, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def fetch(self, url, max_bytes):
+        with self.downloader.fetch(url, max_bytes) as body:
+            return body.read()
+
+    def test_revalidated_download_is_served_from_cache(self):
+        with file_server(self.www) as base:
+            self.assertEqual(len(self.fetch(f"{base}/policy.pdf", 10000)), 5000)
+            self.assertEqual(len(self.fetch(f"{base}/policy.pdf", 10000)), 5000)
+        self.assertEqual(self.downloader.stats()["hits"], 1)
+
+    def test_304_without_a_usable_entry_downloads_again(self):
+        def truncate(body):
+            # e.g. cut short by a crash while it was written
+            with open(body, "r+b") as f:
+                f.truncate(100)
+
+        def fetch_async(url, max_bytes):
+            with asyncio.run(self.downloader.fetch_async(url, max_bytes)) as body:
+                return body.read()
+
+        with file_server(self.www) as base:
+            url = f"{base}/policy.pdf"
+            self.fetch(url, 10000)
+            for damage in (truncate, os.remove):
+                for fetch in (self.fetch, fetch_async):
+                    with self.subTest(damage=damage.__name__, fetch=fetch.__name__):
+                        damage(os.path.join(self.downloader._cached(url)[0], "body"))
+                        self.assertEqual(fetch(url, 10000), b"x" * 5000)
+        self.assertEqual(self.downloader.stats()["hits"], 0)
+
+    def test_cap(self):
+        with file_server(self.www) as base:
+            with self.assertRaises(DownloadTooLarge):
+                self.fetch(f"{base}/policy.pdf", 100)
+
+    def test_cap_applies_to_cache_hits(self):
+        with file_server(self.www) as base:
+            self.fetch(f"{base}/policy.pdf", 10000)
+            with self.assertRaises(DownloadTooLarge):
+                self.fetch(f"{base}/policy.pdf", 100)
+            with self.assertRaises(DownloadTooLarge):
+                asyncio.run(self.downloader.fetch_async(f"{base}/policy.pdf", 100))
+
+    def test_deadline_bounds_the_download(self):
+        with file_server(self.www) as base:
+            with self.assertRaises(DownloadError):
+                self.downloader.fetch(f"{base}/policy.pdf", 10000, deadline=time.monotonic() - 1)
+            with self.assertRaises(DownloadError):
+                asyncio.run(self.downloader.fetch_async(f"{base}/policy.pdf", 10000, deadline=time.monotonic() - 1))
+
+    def test_missing_document(self):
+        with file_server(self.www) as base:
+            with self.assertRaises(DownloadError):
+                self.fetch(f"{base}/missing.pdf", 10000)
+            with self.assertRaises(DownloadError):
+                asyncio.run(self.downloader.fetch_async(f"{base}/missing.pdf", 10000))
+
+
+def _docx(body):
+    """A minimal DOCX around `body`, the WordprocessingML inside <w:body>."""
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w") as archive:
+        archive.writestr("word/document.xml", (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+            ' xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006">'
+            f"<w:body>{body}</w:body></w:document>"
+        ))
+    out.seek(0)
+    return out
+
+
+def _p(*runs):
+    return "<w:p>" + "".join(runs) + "</w:p>"
+
+
+def _r(text):
+    return f'<w:r><w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def _row(*cells):
+    return "<w:tr>" + "".join(f"<w:tc>{''.join(cell)}</w:tc>" for cell in cells) + "</w:tr>"
+
+
+class DocxParagraphTests(SimpleTestCase):
+    PAGE_BREAK = '<w:r><w:br w:type="page"/></w:r>'
+    nested = "<w:tbl>" + _row([_p(_r("1%"))], [_p(_r("of sum insured"))]) + "</w:tbl>"
+    text_box = (
+        "<w:r><mc:AlternateContent>"
+        "<mc:Choice><w:txbxContent>" + _p(_r("Annexure A")) + "</w:txbxContent></mc:Choice>"
+        "<mc:Fallback><w:txbxContent>" + _p(_r("Annexure A")) + "</w:txbxContent></mc:Fallback>"
+        "</mc:AlternateContent></w:r>"
+    )
+    body = "".join([
+        _p(_r("Schedule of benefits"), PAGE_BREAK),
+        _p(PAGE_BREAK),
+        _p(_r("Before"), PAGE_BREAK, _r(" after")),
+        _p(_r("Line one"), "<w:r><w:br/></w:r>", _r("line two"), "<w:r><w:tab/></w:r>", _r("tabbed")),
+        "<w:tbl>",
+        _row([_p(_r("Benefit"))], [_p(_r("Limit"))]),
+        _row([_p(_r("Cataract")), _p(_r("per eye"))], [_p(_r("Rs 40,000"))]),
+        _row([_p()], [_p()]),
+        _row([_p(_r("Room rent"))], [nested]),
+        "</w:tbl>",
+        _p(_r("See "), text_box, _r(" below.")),
+    ])
+    expected = [
+        "Schedule of benefits", "Before after", "Line one\nline two\ttabbed",
+        "Benefit | Limit", "Cataract per eye | Rs 40,000", "Room rent | 1% of sum insured",
+        "See Annexure A below.",
+    ]
+
+    def test_paragraphs_rows_and_breaks(self):
+        self.assertEqual(list(iter_docx_paragraphs(_docx(self.body))), self.expected)
+
+    def test_empty_paragraphs_and_rows_count_towards_the_limit(self):
+        # the empty paragraph and the empty row are the 2nd and 7th items
+        for limit, count in ((1, 1), (2, 1), (6, 5), (7, 5), (8, 6), (100, 7)):
+            with self.subTest(limit=limit):
+                self.assertEqual(list(iter_docx_paragraphs(_docx(self.body), max_paragraphs=limit)),
+                                 self.expected[:count])
+
+    def test_matches_python_docx_on_body_paragraphs(self):
+        data = synthetic.make_docx(5)
+        for limit in (3, 10_000):
+            with self.subTest(limit=limit):
+                expected = extract_text_python_docx(io.BytesIO(data), max_paragraphs=limit).split("\n")
+                self.assertEqual(list(iter_docx_paragraphs(io.BytesIO(data), max_paragraphs=limit)), expected)
+
+
+class ChunkRecordTests(SimpleTestCase):
+    # three pages of five 6-word sentences, two of them on a second line
+    pages = [
+        (page, " ".join(f"Page {page} sentence {i} is here." for i in range(3)) + "\n"
+               + " ".join(f"Page {page} sentence {i} is here." for i in range(3, 5)))
+        for page in (3, 4, 5)
+    ]
+    text = "\n".join(text for _, text in pages)
+
+    def chunks(self, **kwargs):
+        return list(iter_chunk_records(self.pages, splitter="regex", **kwargs))
+
+    def source(self, chunk):
+        return " ".join(self.text[chunk.char_start:chunk.char_end].split())
+
+    def test_ids_spans_and_pages(self):
+        chunks = self.chunks(max_words=20)
+        self.assertEqual([c.id for c in chunks], list(range(len(chunks))))
+        self.assertEqual(" ".join(c.text for c in chunks), " ".join(self.text.split()))
+        for chunk in chunks:
+            self.assertLessEqual(count_words(chunk.text), 20)
+            self.assertEqual(self.source(chunk), chunk.text)
+            self.assertEqual(chunk.page_start, int(chunk.text.split()[1]))
+            self.assertEqual(chunk.page_end, int(chunk.text.rsplit("Page ", 1)[1].split()[0]))
+        self.assertEqual((chunks[0].page_start, chunks[-1].page_end), (3, 5))
+        self.assertTrue(any(c.page_start != c.page_end for c in chunks))
+
+    def test_overlap_repeats_trailing_sentences(self):
+        plain, overlapping = self.chunks(max_words=20), self.chunks(max_words=20, overlap=6)
+        self.assertGreater(len(overlapping), len(plain))
+        for previous, chunk in zip(overlapping, overlapping[1:]):
+            self.assertLessEqual(count_words(chunk.text), 20)
+            self.assertEqual(self.source(chunk), chunk.text)
+            last_sentence = previous.text.rsplit("Page ", 1)[1]
+            self.assertTrue(chunk.text.startswith("Page " + last_sentence))
+            # the next chunk always moves forward
+            self.assertGreater(chunk.char_end, previous.char_end)
+        self.assertEqual(overlapping[-1].char_end, plain[-1].char_end)
+
+    def test_long_sentence_is_split_on_words(self):
+        words = [f"w{i}" for i in range(25)]
+        text = " ".join(words)
+        chunks = list(iter_chunk_records([text], max_words=10, splitter="regex"))
+        self.assertEqual([c.text.split() for c in chunks], [words[:10], words[10:20], words[20:]])
+        self.assertEqual([text[c.char_start:c.char_end] for c in chunks], [c.text for c in chunks])
+
+
+class PdfPagesTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pdf = synthetic.make_pdf(20, seed=3)
+        cls.sequential = cls.pages(workers=1)
+
+    @classmethod
+    def pages(cls, **kwargs):
+        return list(iter_pdf_pages(io.BytesIO(cls.pdf), **kwargs))
+
+    def test_process_pool_keeps_page_order(self):
+        self.assertGreater(20, PDF_PAGES_PER_TASK)
+        self.assertEqual([i for i, _ in self.sequential], list(range(20)))
+        self.assertTrue(all(text for _, text in self.sequential))
+
+        document_parser._reset_pdf_pool()
+        self.assertEqual(self.pages(workers=2), self.sequential)
+        self.assertIsNotNone(document_parser._pdf_pool)
+
+    def test_process_pool_truncates_at_max_pages(self):
+        # the last page range is cut short
+        max_pages = PDF_PAGES_PER_TASK + 5
+        self.assertEqual(self.pages(workers=2, max_pages=max_pages), self.sequential[:max_pages])
+
+
+class IndexRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.registry = IndexRegistry(self.root)
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_adding_a_document_appends_a_segment(self):
+        self.registry.add_document("acme", "a", self.rng.standard_normal((20, 8)))
+        base = os.path.join(self.registry._path("acme"), "vectors.npy")
+        written = os.stat(base).st_mtime_ns
+        index = self.registry.add_document("acme", "b", self.rng.standard_normal((20, 8)))
+        self.assertEqual(os.stat(base).st_mtime_ns, written)
+        self.assertEqual(len(index.segments), 1)
+        self.assertEqual(len(IndexRegistry(self.root).get("acme")), 40)
+
+    def test_removed_document_is_not_returned(self):
+        vectors = self.rng.standard_normal((20, 8))
+        self.registry.add_document("acme", "a", vectors)
+        self.registry.add_document("acme", "b", self.rng.standard_normal((20, 8)))
+        self.registry.remove_document("acme", "a")
+        hits = IndexRegistry(self.root).get("acme").search(vectors[0], k=40)
+        self.assertEqual({key for key, _, _ in hits}, {"b"})
+
+    def test_merge_purges_removed_rows_from_the_counts(self):
+        for key, rows in (("a", 100), ("b", 10), ("c", 10)):
+            self.registry.add_document("acme", key, self.rng.standard_normal((rows, 8)))
+        self.registry.remove_document("acme", "b")
+        index = self.registry.add_document("acme", "d", self.rng.standard_normal((40, 8)))
+        for index in (index, IndexRegistry(self.root).get("acme")):
+            self.assertEqual(len(index), 150)
+            self.assertEqual(index.tombstoned, 0)
+            self.assertEqual(sum(rows for _, rows in index.segments), 50)
+            self.assertNotIn("b", {key for key, _, _ in index.search(self.rng.standard_normal(8), k=150)})
+
+    def test_build_scales_linearly(self):
+        build_benchmark(100, dim=16)
+        small = min(build_benchmark(500, dim=16) for _ in range(2))
+        large = min(build_benchmark(2000, dim=16) for _ in range(2))
+        # four times the documents; a per-document row scan made this ~16x
+        self.assertLess(large, small * 8)
+
+
+class BM25Tests(SimpleTestCase):
+    chunks = [
+        "Pre-existing diseases are covered after 36 months of continuous coverage.",
+        "Cataract surgery is covered after a waiting period of 24 months.",
+        "The policy does not cover cosmetic surgery.",
+        "",
+        "Of the and",
+    ]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def reference_scores(self, query):
+        docs = [tokenize(chunk) for chunk in self.chunks]
+        avgdl = sum(map(len, docs)) / len(docs)
+        scores = np.zeros(len(docs))
+        for term in set(tokenize(query)):
+            df = sum(term in doc for doc in docs)
+            if not df:
+                continue
+            idf = np.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            for i, doc in enumerate(docs):
+                tf = doc.count(term)
+                scores[i] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avgdl))
+        return scores
+
+    def test_scores(self):
+        index = BM25Index.build(self.chunks)
+        for query in ("cataract surgery waiting period", "pre-existing diseases", "the of", "dental"):
+            with self.subTest(query=query):
+                np.testing.assert_allclose(index.scores(query), self.reference_scores(query), rtol=1e-5)
+
+    def test_round_trip_through_the_document_store(self):
+        store = DocumentStore(self.root)
+        for chunks in (self.chunks, []):
+            with self.subTest(chunks=len(chunks)):
+                document_id = str(uuid.uuid4())
+                index = BM25Index.build(chunks)
+                store.save(document_id, chunks, np.zeros((len(chunks), 4)), bm25=index)
+                loaded = store.get(document_id).bm25
+                self.assertEqual(loaded.terms, index.terms)
+                self.assertEqual(loaded.num_chunks, len(chunks))
+                for query in ("covered surgery", "pre-existing"):
+                    np.testing.assert_array_equal(loaded.scores(query), index.scores(query))
+        document_id = str(uuid.uuid4())
+        store.save(document_id, self.chunks, np.zeros((len(self.chunks), 4)))
+        self.assertIsNone(store.get(document_id).bm25)
+
+    def test_fuse_scores(self):
+        cosine = np.array([0.2, 0.4, 0.6], dtype=np.float32)
+        np.testing.assert_allclose(fuse_scores(cosine, np.array([0.0, 2.0, 1.0]), alpha=0.5), [0.1, 0.7, 0.55])
+        np.testing.assert_allclose(fuse_scores(cosine, np.array([0.0, 2.0, 1.0]), alpha=1.0), cosine)
+        # No lexical match at all leaves the cosine ranking alone
+        self.assertIs(fuse_scores(cosine, np.zeros(3)), cosine)
+        self.assertEqual(fuse_scores(np.zeros(0), np.zeros(0)).size, 0)
+
+    def test_exact_term_outranks_a_closer_embedding(self):
+        embeddings = build_embedding_matrix(np.eye(5, dtype=np.float32))
+        query_vector = np.array([0, 0, 1, 0, 0], dtype=np.float32)
+        index = BM25Index.build(self.chunks)
+        top = hybrid_top_k("cataract", query_vector, embeddings, self.chunks, bm25=index, k=2, alpha=0.4)
+        self.assertEqual([chunk for chunk, _ in top], [self.chunks[1], self.chunks[2]])
+        # An index built for other chunks is not used
+        stale = BM25Index.build(self.chunks[:2])
+        top = hybrid_top_k("cataract", query_vector, embeddings, self.chunks, bm25=stale, k=1)
+        self.assertEqual(top, [(self.chunks[2], 1.0)])
+
+
+class DocumentStoreTests(SimpleTestCase):
+    document_id = "6f1c1c1e-8d1a-4c8e-9b6a-0d3f6a0e2b11"
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def save(self, store, text):
+        store.save(self.document_id, [text], np.ones((1, 4), dtype=np.float32), filename="policy.pdf")
+
+    def test_rewrite_replaces_the_bundle_in_one_step(self):
+        store = DocumentStore(self.root)
+        self.save(store, "old")
+        self.save(store, "new")
+        path = store._path(self.document_id)
+        self.assertTrue(os.path.islink(path))
+        self.assertEqual(len(os.listdir(self.root)), 2)
+        self.assertEqual(store.get(self.document_id).chunks[0], "new")
+
+    def test_cached_handle_follows_other_workers(self):
+        reader, writer = DocumentStore(self.root), DocumentStore(self.root)
+        self.save(writer, "old")
+        self.assertEqual(reader.get(self.document_id).chunks[0], "old")
+        self.save(writer, "new")
+        self.assertEqual(reader.get(self.document_id).chunks[0], "new")
+        writer.delete(self.document_id)
+        self.assertIsNone(reader.get(self.document_id))
+        self.assertEqual(os.listdir(self.root), [])
+
+
+class DecisionContextTests(SimpleTestCase):
+    def test_context_failure_falls_back_to_decision_error(self):
+        offloaded = []
+
+        async def offload(func, *args, **kwargs):
+            offloaded.append(func)
+            return func(*args, **kwargs)
+
+        with mock.patch("api.llm_processor.build_context", side_effect=RuntimeError("embedding failed")):
+            result = asyncio.run(make_decision_async(
+                {"age": 46}, [("Knee surgery is covered.", 0.9)], query="46M knee surgery",
+                query_vector=np.ones(4, dtype=np.float32), offload=offload,
+            ))
+        self.assertEqual(len(offloaded), 1)
+        self.assertEqual(result["decision"], "Rejected")
+        self.assertTrue(is_llm_error(result))
+        self.assertEqual(result["matched_clauses"][0]["text"], "Knee surgery is covered.")
+
+
+class StreamingStubGroq(synthetic.StubGroq):
+    """StubGroq that answers stream=True calls with the decision split into deltas."""
+
+    DELTAS = ['{"decision": "Approved", ', '"justification": "Covered after ', 'the waiting period."}']
+
+    def create(self, **kwargs):
+        if not kwargs.get("stream"):
+            return super().create(**kwargs)
+        self.calls += 1
+        return iter([
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+            for delta in self.DELTAS
+        ])
+
+
+class SlowStubGroq(synthetic.StubGroq):
+    """StubGroq that holds calls mentioning "slow" until `release` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def create(self, **kwargs):
+        if "slow" in kwargs["messages"][-1]["content"].lower():
+            self.release.wait(10)
+        return super().create(**kwargs)
+
+
+class TimeoutRecordingStubGroq(synthetic.StubGroq):
+    """StubGroq that records the timeout each call was sent with."""
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def create(self, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        return super().create(**kwargs)
+
+
+class ViewTests(TestCase):
+    def setUp(self):
+        self.root = self.enterContext(isolated_environment())
+        self.client = APIClient()
+        token = self.client.post("/api/signup/", {"username": "claims", "password": "claims"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.json()['token']}")
+
+    def _document(self):
+        document = PolicyDocument.objects.create(user=User.objects.get(username="claims"), filename="policy.pdf")
+        chunks = synthetic.page_lines(np.random.default_rng(0))
+        document_store.save(document.id, chunks, build_embedding_matrix(embed_texts(chunks)), filename="policy.pdf")
+        return document
+
+    def test_evicted_document_expires(self):
+        old = self._document()
+        new = PolicyDocument.objects.create(user=old.user, filename="rider.pdf")
+        chunks = synthetic.page_lines(np.random.default_rng(1))
+        with mock.patch.object(document_store, "max_bytes", 1):
+            evicted = document_store.save(new.id, chunks, build_embedding_matrix(embed_texts(chunks)), filename="rider.pdf")
+        self.assertEqual(evicted, [str(old.id)])
+        ingestion.expire_documents(evicted)
+        old.refresh_from_db()
+        self.assertIsNotNone(old.expired_at)
+
+        def analyze(document_id):
+            return self.client.post("/api/analyze/", {"query": "knee surgery", "document_id": document_id}, format="json")
+
+        response = analyze(str(old.id))
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.json()["expired"])
+        self.assertEqual(analyze(str(new.id)).status_code, 200)
+        self.assertEqual(analyze("not-a-uuid").status_code, 400)
+
+    def test_analyze_stream_events(self):
+        llm_client.groq_client = StreamingStubGroq()
+        document = self._document()
+        user = document.user
+
+        response = self.client.post("/api/analyze-stream/", {
+            "query": "46M knee surgery in Pune, 3 month policy", "document_id": str(document.id),
+        }, format="json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = []
+        for message in b"".join(response.streaming_content).decode().strip().split("\n\n"):
+            event, data = message.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+
+        names = [name for name, _ in events]
+        self.assertEqual(names, ["clauses"] + ["token"] * len(StreamingStubGroq.DELTAS) + ["decision"])
+        self.assertEqual("".join(data["text"] for name, data in events if name == "token"),
+                         "".join(StreamingStubGroq.DELTAS))
+        decision = events[-1][1]
+        self.assertEqual(decision["decision"], "Approved")
+        self.assertEqual(decision["matched_clauses"], events[0][1])
+
+        row = ClaimQuery.objects.get(user=user)
+        self.assertEqual(row.document_id, document.id)
+        self.assertEqual(row.decision_response, decision)
+        self.assertEqual(row.parsed_input["age"], 46)
+
+    def test_batch_bounds_llm_calls_by_the_time_left(self):
+        stub = llm_client.groq_client = TimeoutRecordingStubGroq()
+        document = self._document()
+        with mock.patch.object(views, "BATCH_DEADLINE", 5):
+            response = self.client.post("/api/analyze-batch/", {
+                "queries": ["46M knee surgery in Pune", "knee surgery claim"], "document_id": str(document.id),
+            }, format="json")
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[-1], {"done": True, "total": 2, "failed": 0})
+        self.assertTrue(stub.timeouts)
+        self.assertTrue(all(0 < timeout <= 5 for timeout in stub.timeouts))
+
+
+class IngestionTests(TestCase):
+    def setUp(self):
+        self.root = self.enterContext(isolated_environment())
+        # Jobs stay queued until the test drains them in this thread
+        self.enterContext(mock.patch.object(ingestion, "INGEST_WORKERS", 0))
+        # drain() would otherwise end the test's transaction
+        self.enterContext(mock.patch.object(ingestion, "close_old_connections", lambda: None))
+        self.client = APIClient()
+        token = self.client.post("/api/signup/", {"username": "claims", "password": "claims"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.json()['token']}")
+
+    def upload(self, data, name="policy.pdf"):
+        upload = SimpleUploadedFile(name, data)
+        return self.client.post("/api/upload/", {"file": upload}, format="multipart")
+
+    def job(self, response):
+        return self.client.get(f"/api/jobs/{response.json()['job_id']}/").json()
+
+    def test_lifecycle(self):
+        response = self.upload(synthetic.make_pdf(3))
+        self.assertEqual(response.status_code, 202)
+        job = self.job(response)
+        self.assertEqual((job["status"], job["stage"], job["document_id"]), ("queued", "", None))
+
+        self.assertEqual(ingestion.drain(), 1)
+        job = self.job(response)
+        self.assertEqual((job["status"], job["stage"], job["error"]), ("succeeded", "index", None))
+        self.assertEqual(job["progress"]["parse"], {"done": 3, "total": 3})
+        self.assertEqual(job["progress"]["index"], {"done": 1, "total": 1})
+        self.assertEqual(job["progress"]["chunk"]["done"], job["progress"]["embed"]["done"])
+        stored = document_store.get(job["document_id"])
+        self.assertEqual(len(stored.chunks), job["progress"]["chunk"]["done"])
+        self.assertEqual(os.listdir(ingestion.INGEST_DIR), [])
+
+    def test_unparseable_upload_fails(self):
+        response = self.upload(b"%PDF-1.4 not really")
+        ingestion.drain()
+        job = self.job(response)
+        self.assertEqual(job["status"], "failed")
+        self.assertTrue(job["error"].startswith("Failed to parse document"))
+        self.assertIsNone(job["document_id"])
+        self.assertEqual(self.upload(b"text", name="notes.txt").status_code, 400)
+
+    def test_backpressure(self):
+        pdf = synthetic.make_pdf(2)
+        with mock.patch.object(ingestion, "INGEST_MAX_QUEUED_BYTES", len(pdf) // 2):
+            # An empty queue takes one job, however large
+            self.assertEqual(self.upload(pdf).status_code, 202)
+            response = self.upload(pdf)
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "10")
+            ingestion.drain()
+            self.assertEqual(self.upload(pdf).status_code, 202)
+        with mock.patch.object(ingestion, "INGEST_MAX_QUEUED_PAGES", 3):
+            self.assertEqual(self.upload(pdf).status_code, 429)
+        self.assertEqual(ingestion.drain(), 1)
+
+    def test_jobs_of_other_users_are_hidden(self):
+        response = self.upload(synthetic.make_pdf(1))
+        other = APIClient()
+        token = other.post("/api/signup/", {"username": "other", "password": "other"}, format="json")
+        other.credentials(HTTP_AUTHORIZATION=f"Token {token.json()['token']}")
+        self.assertEqual(other.get(f"/api/jobs/{response.json()['job_id']}/").status_code, 404)
+
+
+class MyQueriesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        token = self.client.post("/api/signup/", {"username": "claims", "password": "claims"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.json()['token']}")
+        user = User.objects.get(username="claims")
+        self.policy = PolicyDocument.objects.create(user=user, filename="policy.pdf")
+        self.rider = PolicyDocument.objects.create(user=user, filename="rider.pdf")
+        # Five queries share one timestamp, so pages of two split them
+        self.times = [datetime(2024, 1, day, 12, tzinfo=timezone.utc) for day in (1, 2, 3, 3, 3, 3, 3, 4)]
+        self.ids = []
+        for i, created_at in enumerate(self.times):
+            query = ClaimQuery.objects.create(
+                user=user, document=self.rider if i % 3 == 0 else self.policy, query_text=f"query {i}",
+                parsed_input={"age": 40 + i}, decision_response={"decision": "Approved", "justification": "x" * 100},
+            )
+            ClaimQuery.objects.filter(id=query.id).update(created_at=created_at)
+            self.ids.append(query.id)
+        ClaimQuery.objects.create(
+            user=User.objects.create_user("other", password="other"), query_text="other",
+            parsed_input={}, decision_response={},
+        )
+
+    def get(self, **params):
+        return self.client.get("/api/my-queries/", params)
+
+    def newest_first(self, indices):
+        return [str(self.ids[i]) for i in sorted(indices, key=lambda i: (self.times[i], self.ids[i]), reverse=True)]
+
+    def test_pages_cross_equal_timestamps(self):
+        seen, cursor = [], None
+        while True:
+            page = self.get(limit=2, fields="id", **({"cursor": cursor} if cursor else {})).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            seen += [row["id"] for row in page["results"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.newest_first(range(len(self.ids))))
+
+    def test_bad_cursor(self):
+        payloads = [b'"x"', b"{}", b'["2024-01-03T12:00:00+00:00", 5]', b'["yesterday", "x"]']
+        cursors = ["not a cursor!", "é"] + [base64.urlsafe_b64encode(p).decode() for p in payloads]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.get(cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {"error": "Invalid cursor"})
+
+    def test_fields(self):
+        row = self.get(fields="decision,filename", limit=1).json()["results"][0]
+        self.assertEqual(row, {"decision": "Approved", "filename": "policy.pdf"})
+
+        response = self.get(fields="id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Unknown fields: password"})
+
+    def test_filters(self):
+        def ids(**params):
+            return [row["id"] for row in self.get(fields="id", **params).json()["results"]]
+
+        self.assertEqual(ids(since="2024-01-03"), self.newest_first(range(2, 8)))
+        self.assertEqual(ids(until="2024-01-03T12:00:00Z"), self.newest_first([0, 1]))
+        self.assertEqual(ids(since="2024-01-02", until="2024-01-03"), self.newest_first([1]))
+        self.assertEqual(ids(document_id=str(self.rider.id)), self.newest_first([0, 3, 6]))
+        self.assertEqual(ids(document_id=str(self.rider.id), since="2024-01-04"), [])
+
+        for params in ({"since": "soon"}, {"until": "2024-13-01"}, {"document_id": "nope"}, {"limit": "all"}):
+            with self.subTest(**params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+# The async views are only routed with ASYNC_VIEWS=True; AsyncViewTests mounts
+# them next to the sync ones
+urlpatterns = [
+    path("api/", include("api.urls")),
+    path("async/analyze/", async_views.analyze_query),
+    path("async/v1/hackrx/run", async_views.hackrx_run),
+]
+
+
+@override_settings(ROOT_URLCONF="api.tests")
+class AsyncViewTests(TestCase):
+    query = "46M knee surgery in Pune, 3 month policy"
+
+    def setUp(self):
+        self.root = self.enterContext(isolated_environment())
+        response = self.client.post("/api/signup/", {"username": "claims", "password": "claims"})
+        self.auth = {"Authorization": f"Token {response.json()['token']}"}
+        self.document = PolicyDocument.objects.create(user=User.objects.get(username="claims"), filename="policy.pdf")
+        chunks = synthetic.page_lines(np.random.default_rng(0))
+        document_store.save(self.document.id, chunks, build_embedding_matrix(embed_texts(chunks)), filename="policy.pdf")
+
+    async def post_both(self, path, body, headers=None, content_type="application/json"):
+        """Status codes of the sync and the async view for the same request."""
+        statuses = []
+        for prefix in ("/api/", "/async/"):
+            response = await self.async_client.post(prefix + path, body, content_type=content_type, headers=headers)
+            statuses.append(response.status_code)
+        return statuses
+
+    async def test_missing_or_bad_token_is_401(self):
+        body = {"query": self.query, "document_id": str(self.document.id)}
+        self.assertEqual(await self.post_both("analyze/", body), [401, 401])
+        self.assertEqual(await self.post_both("analyze/", body, headers={"Authorization": "Token nope"}), [401, 401])
+
+    async def test_non_json_body_is_400(self):
+        self.assertEqual(await self.post_both("analyze/", "not json", headers=self.auth), [400, 400])
+        self.assertEqual(await self.post_both("v1/hackrx/run", "not json"), [400, 400])
+        self.assertEqual(await self.post_both("v1/hackrx/run", "[1, 2]"), [400, 400])
+
+    async def test_analyze(self):
+        response = await self.async_client.post("/async/analyze/", {
+            "query": self.query, "document_id": str(self.document.id),
+        }, content_type="application/json", headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["decision"], "Approved")
+        self.assertEqual(llm_client.async_groq_client().calls, 1)
+
+        row = await ClaimQuery.objects.aget(user__username="claims")
+        self.assertEqual(row.document_id, self.document.id)
+        self.assertEqual(row.decision_response, result)
+        self.assertEqual(row.parsed_input["age"], 46)
+
+        response = await self.async_client.post("/api/analyze/", {
+            "query": self.query, "document_id": str(self.document.id),
+        }, content_type="application/json", headers=self.auth)
+        self.assertEqual(response.json(), result)
+
+
+class HackrxRunTests(TestCase):
+    questions = ["Is knee surgery covered?", "Slow: what is the waiting period?"]
+
+    def setUp(self):
+        self.root = self.enterContext(isolated_environment())
+        self.www = os.path.join(self.root, "www")
+        os.makedirs(self.www)
+        with open(os.path.join(self.www, "policy.pdf"), "wb") as f:
+            f.write(synthetic.make_pdf(2, seed=7))
+        self.base = self.enterContext(file_server(self.www))
+
+    def run_hackrx(self, deadline):
+        with mock.patch.object(views, "REQUEST_DEADLINE", deadline):
+            start = time.monotonic()
+            response = self.client.post("/api/v1/hackrx/run", {
+                "documents": f"{self.base}/policy.pdf", "questions": self.questions,
+            }, content_type="application/json")
+            return response, time.monotonic() - start
+
+    def test_falls_back_at_the_deadline(self):
+        stub = llm_client.groq_client = SlowStubGroq()
+        self.addCleanup(stub.release.set)
+        response, elapsed = self.run_hackrx(3)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 8)
+        self.assertEqual(response.json()["answers"], [synthetic.StubGroq.CONTENT, views.ANSWER_UNAVAILABLE])
+
+    def test_deadline_counts_from_request_entry(self):
+        stub = llm_client.groq_client = synthetic.StubGroq()
+        process_document = views.process_document
+
+        def slow_process_document(*args, **kwargs):
+            time.sleep(1.2)
+            return process_document(*args, **kwargs)
+
+        with mock.patch.object(views, "process_document", slow_process_document):
+            response, _ = self.run_hackrx(1)
+        self.assertEqual(response.json()["answers"], [views.ANSWER_UNAVAILABLE] * 2)
+        self.assertEqual(stub.calls, 0)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_label_values_are_escaped(self):
+        counter = Counter("policyintel_test_total", "Test.", ("route",))
+        counter.inc('a"b\\c\nd')
+        self.assertEqual(counter.render()[-1], 'policyintel_test_total{route="a\\"b\\\\c\\nd"} 1')
+
+    def test_cache_counts_are_counters(self):
+        text = render()
+        self.assertIn("# TYPE policyintel_cache_hits_total counter", text)
+        self.assertIn("# TYPE policyintel_cache_misses_total counter", text)
+        self.assertIn("# TYPE policyintel_answer_cache_semantic_hits_total counter", text)
+        self.assertIn("# TYPE policyintel_cache_hit_rate gauge", text)
+
+
+class ClaimCacheTests(SimpleTestCase):
+    query = "46M knee surgery in Pune, 3 month policy"
+
+    def setUp(self):
+        self.enterContext(mock.patch.object(views, "answer_cache", AnswerCache(similarity=0.5)))
+        self.stored = SimpleNamespace(meta={"content_hash": "policy"}, filename="policy.pdf")
+        self.top_chunks = [("Knee surgery is covered after the waiting period.", 0.9)]
+        self.embedding = np.ones(4, dtype=np.float32)
+        result = {"decision": "Approved", "justification": "Covered.", "matched_clauses": []}
+        views._store_claim(
+            "user:1", self.stored, self.query, self.embedding, self.top_chunks, deterministic_parse(self.query), result,
+        )
+
+    def cached(self, query):
+        return views._cached_claim("user:1", self.stored, query, self.embedding, self.top_chunks)
+
+    def test_near_duplicate_gets_its_own_parsed_input(self):
+        parsed_input, result = self.cached("46 male, knee surgery in Pune, 3-month policy")
+        self.assertEqual(parsed_input, deterministic_parse("46 male, knee surgery in Pune, 3-month policy"))
+        self.assertEqual(result["decision"], "Approved")
+
+    def test_near_duplicate_with_other_details_is_a_miss(self):
+        self.assertIsNone(self.cached("66M knee surgery in Pune, 3 month policy"))
+        self.assertIsNotNone(self.cached(self.query))
+
+
+class ContentCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ContentCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_text_is_read_on_first_access(self):
+        self.cache.put("entry", "Knee surgery is covered.", ["Knee surgery is covered."], np.ones((1, 4)))
+        entry = self.cache.get("entry")
+        self.assertIsNone(entry._text)
+        self.assertEqual(entry.chunks[0], "Knee surgery is covered.")
+        self.assertEqual(entry.text, "Knee surgery is covered.")
+        # read once, then kept
+        os.remove(os.path.join(self.root, "entry", TEXT_FILE))
+        self.assertEqual(entry.text, "Knee surgery is covered.")
+
+
+def _status_error(status):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    return APIStatusError(f"status {status}", response=httpx.Response(status, request=request), body=None)
+
+
+class ScriptedClient:
+    """Chat client whose calls raise or return the next entry of `script` (a reply after it runs out)."""
+
+    def __init__(self, *script, delays=()):
+        self.chat = SimpleNamespace(completions=self)
+        self.script = list(script)
+        self.delays = list(delays)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            outcome = self.script.pop(0) if self.script else None
+            delay = self.delays.pop(0) if self.delays else 0
+        time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=outcome or "ok"))],
+            usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0),
+        )
+
+
+class LLMClientTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(llm_client, "LLM_BACKOFF_BASE", 0.001))
+        self.enterContext(mock.patch.object(llm_client, "LLM_MIN_ATTEMPT_SECONDS", 0.01))
+        # every test gets its own model, and so its own breaker and latency history
+        self.model = f"test-{self._testMethodName}"
+        self.state = _model_state(self.model)
+
+    def complete(self, client, **kwargs):
+        return chat_completion(client, model=self.model, messages=[], timeout=5, **kwargs)
+
+    def test_retries_rate_limits_and_server_errors(self):
+        client = ScriptedClient(_status_error(429), _status_error(503), "answer")
+        self.assertEqual(self.complete(client).choices[0].message.content, "answer")
+        self.assertEqual(client.calls, 3)
+
+    def test_gives_up_after_max_retries(self):
+        client = ScriptedClient(*[_status_error(500)] * 5)
+        with self.assertRaises(APIStatusError):
+            self.complete(client)
+        self.assertEqual(client.calls, llm_client.LLM_MAX_RETRIES + 1)
+
+    def test_bad_request_is_not_retried(self):
+        client = ScriptedClient(_status_error(400))
+        with self.assertRaises(APIStatusError):
+            self.complete(client)
+        self.assertEqual(client.calls, 1)
+
+    def test_hedge_fires_after_the_delay(self):
+        for _ in range(llm_client.LLM_HEDGE_MIN_SAMPLES):
+            self.state.latency.add(0.05)
+        client = ScriptedClient("slow", "hedge", delays=(1.0, 0))
+        with mock.patch.object(llm_client, "LLM_HEDGE", True):
+            start = time.monotonic()
+            response = self.complete(client)
+        self.assertEqual(response.choices[0].message.content, "hedge")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(client.calls, 2)
+
+    def test_no_hedge_before_the_delay(self):
+        for _ in range(llm_client.LLM_HEDGE_MIN_SAMPLES):
+            self.state.latency.add(0.5)
+        client = ScriptedClient("first")
+        with mock.patch.object(llm_client, "LLM_HEDGE", True):
+            self.assertEqual(self.complete(client).choices[0].message.content, "first")
+        self.assertEqual(client.calls, 1)
+
+    def test_breaker_opens_goes_half_open_and_closes(self):
+        self.state.breaker = CircuitBreaker(failures=2, reset=0.05)
+        for _ in range(2):
+            with self.assertRaises(APIStatusError):
+                self.complete(ScriptedClient(*[_status_error(503)] * 5))
+        self.assertTrue(self.state.breaker.open)
+        refused = ScriptedClient()
+        with self.assertRaises(LLMUnavailable):
+            self.complete(refused)
+        self.assertEqual(refused.calls, 0)
+
+        time.sleep(0.06)
+        self.assertEqual(self.complete(ScriptedClient("probe")).choices[0].message.content, "probe")
+        self.assertFalse(self.state.breaker.open)
+
+    def test_failed_probe_reopens_the_breaker(self):
+        breaker = self.state.breaker = CircuitBreaker(failures=1, reset=0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        self.assertEqual(breaker.allow(), CircuitBreaker.PROBE)
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertTrue(breaker.open)
+        self.assertFalse(breaker.allow())
+
+    def test_probe_answered_with_a_client_error_closes_the_breaker(self):
+        breaker = self.state.breaker = CircuitBreaker(failures=1, reset=0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        with self.assertRaises(APIStatusError):
+            self.complete(ScriptedClient(_status_error(400)))
+        self.assertFalse(breaker.open)
+
+    def test_retries_stop_once_the_breaker_opens(self):
+        breaker = self.state.breaker = CircuitBreaker(failures=1, reset=60)
+
+        class OpeningClient(ScriptedClient):
+            def create(self, **kwargs):
+                # other calls trip the breaker while this one is in flight
+                breaker.failure()
+                return super().create(**kwargs)
+
+        client = OpeningClient(*[_status_error(503)] * 3)
+        with self.assertRaises(LLMUnavailable):
+            self.complete(client)
+        self.assertEqual(client.calls, 1)
@@ -1,11 +1,20 @@
 from django.urls import path
-from .views import signup, login, upload_document, analyze_query, my_queries, get_user_info, hackrx_run
+from .views import signup, login, upload_document, ingestion_status, analyze_query, analyze_stream, analyze_batch, analyze_organization_query, my_queries, get_user_info, hackrx_run
+from . import async_views
+
+# Served over ASGI, the LLM-bound endpoints hold no thread while they wait
+if async_views.ASYNC_VIEWS:
+    analyze_query, hackrx_run = async_views.analyze_query, async_views.hackrx_run
 
 urlpatterns = [
     path('signup/', signup),
     path('login/', login),
     path('upload/', upload_document),
+    path('jobs/<uuid:job_id>/', ingestion_status),
     path('analyze/', analyze_query),
+    path('analyze-stream/', analyze_stream),
+    path('analyze-batch/', analyze_batch),
+    path('analyze-organization/', analyze_organization_query),
     path('my-queries/', my_queries),
     path('user-info/', get_user_info),
     path('v1/hackrx/run', hackrx_run),
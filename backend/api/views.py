@@ -2,28 +2,45 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db.models import Q
+from django.db.models.fields.json import KeyTextTransform
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
-import requests
-from io import BytesIO
 import traceback
+import json
+import uuid
+import base64
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import re
+import time
 from urllib.parse import urlparse
-
-from .document_parser import parse_document, split_text_to_chunks
-from .embeddings import embed_chunks, embed_query, get_top_k_chunks
-from .llm_processor import hybrid_parse_input, make_decision
-from .models import PolicyDocument, ClaimQuery, UserProfile
-
-from groq import Groq
-from .utils.env_loader import GROQ_API_KEY
-
-groq_client = Groq(api_key=GROQ_API_KEY)
-
-# Temporary in-memory store (only for current session)
-DOC_STORAGE = {}
+from datetime import datetime
+
+from .embeddings import embed_query, embed_queries
+from .bm25 import hybrid_top_k, hybrid_top_k_batch
+from .pipeline import process_document, DocumentParseError, DocumentProcessingError
+from .llm_processor import (
+    hybrid_parse_input, make_decision, decide_claim, decide_claim_stream, answer_question, format_clauses, is_llm_error,
+    _parse_shortcut, SINGLE_CALL_MODE, LLM_MODEL,
+)
+from .llm_fanout import fan_out, fan_out_as_completed
+from .models import PolicyDocument, ClaimQuery, UserProfile, IngestionJob, organization_key, organization_documents
+from .doc_store import document_store
+from .ann_index import index_registry
+from .ingestion import enqueue, IngestionBusy
+from .downloader import downloader, DownloadError, DownloadTooLarge
+from .answer_cache import answer_cache
+from .metrics import timed, render as render_metrics, METRICS_TOKEN
+
+# Runs the structured-query LLM call while analyze_query embeds and retrieves
+_overlap_pool = ThreadPoolExecutor(max_workers=8)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -91,47 +108,89 @@ def upload_document(request):
 
     file = request.FILES['file']
     filename = file.name
+    if not filename.endswith(('.pdf', '.docx')):
+        return Response({'error': 'Failed to parse document: Unsupported file format'}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        text = parse_document(file, filename)
-    except Exception as e:
-        return Response({'error': f'Failed to parse document: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-
-    chunks = split_text_to_chunks(text)
-    embeddings = embed_chunks(chunks)
-
-    document = PolicyDocument.objects.create(user=request.user, filename=filename)
+        job = enqueue(request.user, file.read(), filename)
+    except IngestionBusy as e:
+        response = Response({'error': f'Too many documents are being processed, try again shortly ({e})'},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS)
+        response['Retry-After'] = '10'
+        return response
 
-    DOC_STORAGE[str(document.id)] = {
-        "chunks": chunks,
-        "embeddings": embeddings,
-        "filename": filename
-    }
+    return Response({"job_id": str(job.id), "status": job.status}, status=status.HTTP_202_ACCEPTED)
 
-    return Response({"document_id": str(document.id)})
-
-@api_view(['POST'])
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def analyze_query(request):
-    query = request.data.get('query')
-    document_id = request.data.get('document_id')
+def ingestion_status(request, job_id):
+    job = IngestionJob.objects.filter(id=job_id, user=request.user).first()
+    if job is None:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    if not query:
-        return Response({"error": "Query is required"}, status=status.HTTP_400_BAD_REQUEST)
-
-    if not document_id or document_id not in DOC_STORAGE:
-        return Response({"error": "Invalid or expired document session"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "job_id": str(job.id),
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "document_id": str(job.document_id) if job.document_id else None,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    })
 
-    parsed_input = hybrid_parse_input(query)
-    query_embedding = embed_query(query)
-    top_chunks = get_top_k_chunks(
-        query_embedding,
-        DOC_STORAGE[document_id]['embeddings'],
-        DOC_STORAGE[document_id]['chunks']
+def _near_duplicate_claim(query, cached):
+    """
+    A near-duplicate's claim for `query`: its decision only holds when this
+    query parses (from the parse cache or deterministically) to the same details.
+    """
+    parsed_input = _parse_shortcut(query)
+    if parsed_input is None or _claim_details(parsed_input) != _claim_details(cached["parsed_input"]):
+        return None
+    return dict(cached, parsed_input=parsed_input)
+
+def _claim_details(parsed_input):
+    return {field: str(value).strip().lower() if value is not None else None for field, value in parsed_input.items()}
+
+def _cached_claim(tenant, stored, query, query_embedding, top_chunks):
+    cached = answer_cache.get(
+        tenant, stored.meta.get("content_hash"), top_chunks, query, LLM_MODEL, "claim", embedding=query_embedding,
+        adapt=lambda near: _near_duplicate_claim(query, near),
+    )
+    if cached is None:
+        return None
+    result = cached["decision"]
+    # A near-duplicate hit was retrieved for another question; show this one's clauses
+    result["matched_clauses"] = format_clauses(top_chunks, stored.filename)
+    return cached["parsed_input"], result
+
+def _store_claim(tenant, stored, query, query_embedding, top_chunks, parsed_input, result):
+    if is_llm_error(result):
+        return
+    answer_cache.set(
+        tenant, stored.meta.get("content_hash"), top_chunks, query, LLM_MODEL, "claim",
+        {"parsed_input": parsed_input, "decision": result}, embedding=query_embedding,
     )
 
-    result = make_decision(parsed_input, top_chunks, source_name=DOC_STORAGE[document_id]['filename'])
-
+def _missing_document(document_id):
+    """(body, status) for a document_id the store has nothing for; 410 when its bundle was evicted."""
+    try:
+        expired = PolicyDocument.objects.filter(id=document_id, expired_at__isnull=False).exists()
+    except (ValueError, ValidationError):
+        expired = False
+    if expired:
+        return {"error": "This document has expired, please upload it again", "expired": True}, status.HTTP_410_GONE
+    return {"error": "Invalid or expired document session"}, status.HTTP_400_BAD_REQUEST
+
+def _retrieve(query, stored):
+    """(query embedding, top chunks) for one query against a stored document."""
+    with timed("retrieval"):
+        query_embedding = embed_query(query)
+        top_chunks = hybrid_top_k(query, query_embedding, stored.embeddings, stored.chunks, bm25=stored.bm25)
+    return query_embedding, top_chunks
+
+def _save_claim_query(user, document_id, query, parsed_input, result):
     try:
         document_obj = PolicyDocument.objects.get(id=document_id)
     except PolicyDocument.DoesNotExist:
@@ -139,7 +198,7 @@ def analyze_query(request):
 
     try:
         ClaimQuery.objects.create(
-            user=request.user,
+            user=user,
             document=document_obj,
             query_text=query,
             parsed_input=parsed_input,
@@ -148,36 +207,416 @@ def analyze_query(request):
     except Exception as e:
         print(f"[WARN] Failed to save query: {e}")
 
+def _decide_claim_cached(tenant, stored, query, query_embedding, top_chunks, timeout=None):
+    cached = _cached_claim(tenant, stored, query, query_embedding, top_chunks)
+    if cached is not None:
+        return cached
+    parsed_input, result = decide_claim(
+        query, top_chunks, source_name=stored.filename, query_vector=query_embedding, timeout=timeout,
+    )
+    _store_claim(tenant, stored, query, query_embedding, top_chunks, parsed_input, result)
+    return parsed_input, result
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def analyze_query(request):
+    query = request.data.get('query')
+    document_id = request.data.get('document_id')
+
+    if not query:
+        return Response({"error": "Query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    stored = document_store.get(document_id) if document_id else None
+    if stored is None:
+        return Response(*_missing_document(document_id))
+
+    tenant = organization_key(request.user)
+    if SINGLE_CALL_MODE:
+        query_embedding, top_chunks = _retrieve(query, stored)
+        parsed_input, result = _decide_claim_cached(tenant, stored, query, query_embedding, top_chunks)
+    else:
+        parsed_future = _overlap_pool.submit(contextvars.copy_context().run, hybrid_parse_input, query)
+        query_embedding, top_chunks = _retrieve(query, stored)
+        cached = _cached_claim(tenant, stored, query, query_embedding, top_chunks)
+        if cached is not None:
+            # The parse call finishes in the background and lands in the parse cache
+            parsed_input, result = cached
+        else:
+            parsed_input = parsed_future.result()
+            result = make_decision(
+                parsed_input, top_chunks, source_name=stored.filename, query=query, query_vector=query_embedding,
+            )
+            _store_claim(tenant, stored, query, query_embedding, top_chunks, parsed_input, result)
+
+    _save_claim_query(request.user, document_id, query, parsed_input, result)
     return Response(result)
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_decision(user, document_id, stored, query, query_embedding, top_chunks, parsed_future):
+    """Server-Sent Events for one claim: clauses, LLM tokens, then the decision."""
+    yield _sse("clauses", format_clauses(top_chunks, stored.filename))
+
+    tenant = organization_key(user)
+    parsed_input = result = None
+    try:
+        cached = _cached_claim(tenant, stored, query, query_embedding, top_chunks)
+        if cached is not None:
+            parsed_input, result = cached
+        else:
+            parsed = parsed_future.result() if parsed_future is not None else None
+            stream = decide_claim_stream(
+                query, top_chunks, source_name=stored.filename, parsed_input=parsed, query_vector=query_embedding,
+            )
+            for kind, value in stream:
+                if kind == "token":
+                    yield _sse("token", {"text": value})
+                else:
+                    parsed_input, result = value
+            _store_claim(tenant, stored, query, query_embedding, top_chunks, parsed_input, result)
+        yield _sse("decision", result)
+    except Exception as e:
+        print(f"[ERROR] Streaming decision failed: {e}")
+        yield _sse("error", {"error": str(e)})
+    finally:
+        # Runs once the stream is closed, also when the client disconnects
+        # after the decision was reached
+        if result is not None:
+            _save_claim_query(user, document_id, query, parsed_input, result)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def analyze_stream(request):
+    """
+    analyze_query as Server-Sent Events: a "clauses" event as soon as
+    retrieval is done, a "token" event per LLM delta, then a "decision" event
+    with the validated result (the body analyze_query would return), or an
+    "error" event.
+    """
+    query = request.data.get('query')
+    document_id = request.data.get('document_id')
+
+    if not query:
+        return Response({"error": "Query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    stored = document_store.get(document_id) if document_id else None
+    if stored is None:
+        return Response(*_missing_document(document_id))
+
+    parsed_future = None
+    if not SINGLE_CALL_MODE:
+        parsed_future = _overlap_pool.submit(contextvars.copy_context().run, hybrid_parse_input, query)
+    query_embedding, top_chunks = _retrieve(query, stored)
+
+    response = StreamingHttpResponse(
+        _stream_decision(request.user, document_id, stored, query, query_embedding, top_chunks, parsed_future),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+BATCH_MAX_QUERIES = 500             # claims accepted per batch request
+BATCH_DEADLINE = 30 * 60            # seconds - the whole batch
+BATCH_FLUSH_ROWS = 50               # ClaimQuery rows per bulk_create
+
+def _stream_batch(user, document_obj, stored, queries, query_embeddings, top_chunks_per_query):
+    """NDJSON lines, one per claim in completion order, then a summary line."""
+    pending_rows = []
+    failed = 0
+
+    def flush():
+        try:
+            ClaimQuery.objects.bulk_create(pending_rows)
+        except Exception as e:
+            print(f"[WARN] Failed to save {len(pending_rows)} batch queries: {e}")
+        pending_rows.clear()
+
+    tenant = organization_key(user)
+    results = fan_out_as_completed(
+        lambda item, remaining: _decide_claim_cached(tenant, stored, *item, timeout=min(LLM_TIMEOUT, remaining)),
+        zip(queries, query_embeddings, top_chunks_per_query),
+        time.monotonic() + BATCH_DEADLINE,
+    )
+    try:
+        for index, outcome, error in results:
+            if error is not None:
+                failed += 1
+                yield json.dumps({"index": index, "query": queries[index], "error": str(error)}) + "\n"
+                continue
+            parsed_input, result = outcome
+            pending_rows.append(ClaimQuery(
+                user=user,
+                document=document_obj,
+                query_text=queries[index],
+                parsed_input=parsed_input,
+                decision_response=result,
+            ))
+            if len(pending_rows) >= BATCH_FLUSH_ROWS:
+                flush()
+            yield json.dumps({"index": index, "query": queries[index], "result": result}) + "\n"
+    finally:
+        # Also reached when the client disconnects mid-stream
+        if pending_rows:
+            flush()
+    yield json.dumps({"done": True, "total": len(queries), "failed": failed}) + "\n"
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def analyze_batch(request):
+    """
+    Decide many claims against one document. Retrieval runs once for the
+    whole batch; decisions stream back as NDJSON as they complete, each line
+    carrying the claim's index in `queries`.
+    """
+    queries = request.data.get('queries')
+    document_id = request.data.get('document_id')
+
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return Response({"error": "queries must be a non-empty list of strings"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return Response({"error": f"Too many queries in batch (limit: {BATCH_MAX_QUERIES})"}, status=status.HTTP_400_BAD_REQUEST)
+
+    stored = document_store.get(document_id) if document_id else None
+    if stored is None:
+        return Response(*_missing_document(document_id))
+    document_obj = PolicyDocument.objects.filter(id=document_id).first()
+
+    with timed("retrieval"):
+        query_embeddings = embed_queries(queries)
+        top_chunks_per_query = hybrid_top_k_batch(
+            queries, query_embeddings, stored.embeddings, stored.chunks, bm25=stored.bm25
+        )
+
+    response = StreamingHttpResponse(
+        _stream_batch(request.user, document_obj, stored, queries, query_embeddings, top_chunks_per_query),
+        content_type="application/x-ndjson",
+    )
+    # Ask proxies not to buffer, so lines reach the client as they are written
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+MAX_CHUNKS_ORGANIZATION = 5
+
+def _organization_index(user):
+    org_key = organization_key(user)
+    index = index_registry.get(org_key)
+    if index is None:
+        # First cross-document query for this organization: build from the store
+        documents = []
+        for document in organization_documents(user):
+            stored = document_store.get(document.id)
+            if stored is not None:
+                documents.append((document.id, stored.embeddings))
+        index = index_registry.build(org_key, documents)
+    return index
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def analyze_organization_query(request):
+    query = request.data.get('query')
+    if not query:
+        return Response({"error": "Query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with timed("retrieval"):
+        query_embedding = embed_query(query)
+        hits = _organization_index(request.user).search(query_embedding, k=MAX_CHUNKS_ORGANIZATION)
+
+    top_chunks = []
+    matched_clauses = []
+    for document_id, chunk_index, score in hits:
+        stored = document_store.get(document_id)
+        if stored is None or chunk_index >= len(stored.chunks):
+            continue
+        text = stored.chunks[chunk_index]
+        top_chunks.append((text, score))
+        matched_clauses.append({
+            "text": text.strip(),
+            "similarity": round(score * 100, 2),
+            "source": stored.filename,
+            "document_id": document_id,
+        })
+
+    if not top_chunks:
+        return Response({"answer": "No uploaded policy documents matched this question.", "matched_clauses": []})
+
+    try:
+        answer = answer_question(query, top_chunks, timeout=LLM_TIMEOUT, query_vector=query_embedding)
+    except Exception as e:
+        print(f"[WARN] Organization query LLM failed: {e}")
+        answer = "Answer unavailable due to LLM timeout or service error."
+
+    return Response({"answer": answer, "matched_clauses": matched_clauses})
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+# Response field -> ClaimQuery column (or annotation) it is read from
+HISTORY_FIELDS = {
+    'id': 'id',
+    'query_text': 'query_text',
+    'parsed_input': 'parsed_input',
+    'decision': 'decision',
+    'decision_response': 'decision_response',
+    'document_id': 'document_id',
+    'filename': 'document__filename',
+    'created_at': 'created_at',
+}
+HISTORY_DEFAULT_FIELDS = ['query_text', 'parsed_input', 'decision_response', 'document_id', 'filename', 'created_at']
+
+def _encode_cursor(created_at, query_id):
+    raw = json.dumps([created_at.isoformat(), str(query_id)]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    created_at, query_id = json.loads(raw)
+    created_at = parse_datetime(created_at)
+    if created_at is None:
+        raise ValueError("bad timestamp")
+    return created_at, uuid.UUID(str(query_id))
+
+def _parse_bound(value):
+    """ISO datetime or date (midnight) as an aware datetime."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        moment = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def my_queries(request):
-    queries = ClaimQuery.objects.filter(user=request.user).order_by('-created_at')
+    """
+    The user's claim queries, newest first, one page at a time.
+
+    Query parameters:
+        - limit: page size (default 50, max 200)
+        - cursor: next_cursor from the previous page
+        - fields: comma-separated subset of HISTORY_FIELDS; "decision" is
+          read out of decision_response without loading the whole blob
+        - since / until: ISO date or datetime; since inclusive, until exclusive
+        - document_id: only queries against this document
+    """
+    params = request.query_params
+    try:
+        limit = min(max(int(params.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = [f.strip() for f in params['fields'].split(',') if f.strip()] if params.get('fields') else HISTORY_DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        return Response({"error": f"Unknown fields: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    queries = ClaimQuery.objects.filter(user=request.user)
+    try:
+        if params.get('since'):
+            queries = queries.filter(created_at__gte=_parse_bound(params['since']))
+        if params.get('until'):
+            queries = queries.filter(created_at__lt=_parse_bound(params['until']))
+    except ValueError:
+        return Response({"error": "since/until must be ISO dates or datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+    if params.get('document_id'):
+        try:
+            queries = queries.filter(document_id=uuid.UUID(params['document_id']))
+        except ValueError:
+            return Response({"error": "Invalid document_id"}, status=status.HTTP_400_BAD_REQUEST)
+    if params.get('cursor'):
+        try:
+            created_at, query_id = _decode_cursor(params['cursor'])
+        except (ValueError, TypeError):
+            return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+        queries = queries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=query_id))
+
+    if 'decision' in fields:
+        queries = queries.annotate(decision=KeyTextTransform('decision', 'decision_response'))
+    # id and created_at are always read: they make up the cursor
+    columns = {HISTORY_FIELDS[f] for f in fields} | {'id', 'created_at'}
+    rows = list(queries.order_by('-created_at', '-id').values(*columns)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+
     data = []
-    for q in queries:
-        data.append({
-            'query_text': q.query_text,
-            'parsed_input': q.parsed_input,
-            'decision_response': q.decision_response,
-            'document_id': str(q.document.id) if q.document else None,
-            'filename': q.document.filename if q.document else None,
-            'created_at': q.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        })
-    return Response(data)
+    for row in rows:
+        item = {}
+        for field in fields:
+            value = row[HISTORY_FIELDS[field]]
+            if field == 'created_at':
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            elif field in ('id', 'document_id') and value is not None:
+                value = str(value)
+            item[field] = value
+        data.append(item)
+    return Response({"results": data, "next_cursor": next_cursor})
 
 # 🚀 Updated HackRx Webhook Evaluation Endpoint
 # HARD LIMITS for hackathon stability:
 MAX_FILE_SIZE = 1 * 1024 * 1024     # 1 MB
-MAX_PAGES = 10                      # safest-first! Increase if confident.
+MAX_PAGES = 200                     # pages are extracted in parallel and streamed into chunking
 MAX_PARAGRAPHS = 100                # for docx files
-MAX_QUESTIONS = 5                   # maximum questions accepted per request
+MAX_QUESTIONS = 20                  # maximum questions accepted per request (answered concurrently)
 MAX_CHUNKS_PER_QUESTION = 2         # send only 2 most relevant chunks to LLM
-LLM_TIMEOUT = 10                    # seconds - tune down if too close to total API limit
+LLM_TIMEOUT = 10                    # seconds - per LLM call
+DOWNLOAD_TIMEOUT = 10               # seconds - socket timeout while fetching the document
+REQUEST_DEADLINE = 25               # seconds - whole request from entry (download, parsing, LLM), under the platform SLA
+HACKRX_TENANT = "hackrx"            # answer cache scope for the unauthenticated webhook
+ANSWER_UNAVAILABLE = "Answer unavailable due to LLM timeout or service error."
+
+def _document_url(raw_doc_url):
+    """The document URL from a HackRx markdown link "[...](url)" or a plain URL."""
+    match = re.match(r"\[.*\]\((.*)\)", raw_doc_url)
+    if match:
+        return match.group(1).strip()
+    return raw_doc_url.strip("[](); ")
+
+def _retrieve_questions(processed, questions):
+    """(question embeddings, top chunks per question), retrieved in one pass."""
+    with timed("retrieval"):
+        question_embeddings = embed_queries(questions)
+        top_chunks_per_question = hybrid_top_k_batch(
+            questions, question_embeddings, processed.embeddings, processed.chunks,
+            bm25=processed.bm25, k=MAX_CHUNKS_PER_QUESTION
+        )
+    return question_embeddings, top_chunks_per_question
+
+def _answer_cache_args(processed, question, top_chunks):
+    return (HACKRX_TENANT, processed.content_hash, top_chunks, question, LLM_MODEL, "answer")
+
+def _cached_answers(processed, questions, question_embeddings, top_chunks_per_question):
+    """Cached answer per question, None for misses."""
+    return [
+        answer_cache.get(*_answer_cache_args(processed, q, top), embedding=emb)
+        for q, emb, top in zip(questions, question_embeddings, top_chunks_per_question)
+    ]
+
+def _store_answers(processed, questions, question_embeddings, top_chunks_per_question, answers, misses, fresh):
+    """Fill `answers` at the `misses` indices from `fresh` (None = failed) and cache the new ones."""
+    for i, answer in zip(misses, fresh):
+        if answer is None:
+            answers[i] = ANSWER_UNAVAILABLE
+        else:
+            answers[i] = answer
+            answer_cache.set(
+                *_answer_cache_args(processed, questions[i], top_chunks_per_question[i]), answer,
+                embedding=question_embeddings[i],
+            )
+    return answers
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def hackrx_run(request):
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    # A body that is not JSON is a ParseError, answered with 400 by DRF
+    if not isinstance(request.data, dict):
+        return Response({"error": "Invalid JSON body"}, status=400)
     try:
         raw_doc_url = request.data.get("documents")
         questions = request.data.get("questions", [])
@@ -189,72 +628,58 @@ def hackrx_run(request):
             return Response({"error": f"Too many questions in request (limit: {MAX_QUESTIONS})"}, status=400)
 
         # Extract and sanitize document URL (HackRx format or plain)
-        if raw_doc_url:
-            match = re.match(r"\[.*\]\((.*)\)", raw_doc_url)
-            if match:
-                document_url = match.group(1).strip()
-            else:
-                document_url = raw_doc_url.strip("[](); ")
-        else:
+        if not raw_doc_url:
             return Response({"error": "Missing documents"}, status=400)
+        document_url = _document_url(raw_doc_url)
 
-        # Download document, enforce file size cap
+        # Download document, enforce file size cap while streaming
         try:
-            response = requests.get(document_url, timeout=10)
-            response.raise_for_status()
-        except Exception:
-            return Response({"error": "Failed to fetch document from provided URL."}, status=400)
-        if len(response.content) > MAX_FILE_SIZE:
+            with timed("download"):
+                body = downloader.fetch(document_url, MAX_FILE_SIZE, timeout=DOWNLOAD_TIMEOUT, deadline=deadline)
+        except DownloadTooLarge:
             return Response({"error": f"Document too large for hackathon limits (max {MAX_FILE_SIZE//1024}KB)."}, status=400)
-        file_like = BytesIO(response.content)
+        except DownloadError:
+            return Response({"error": "Failed to fetch document from provided URL."}, status=400)
 
         parsed_url = urlparse(document_url)
         filename = parsed_url.path.split("/")[-1]
 
         # Defensive parse with resource limits
         try:
-            text = parse_document(
-                file_like, filename,
+            processed = process_document(
+                body, filename,
                 max_pages=MAX_PAGES,
                 max_paragraphs=MAX_PARAGRAPHS
             )
-        except Exception:
+        except DocumentParseError:
             return Response({"error": "Unsupported or unparseable document format."}, status=400)
-        if not text or not isinstance(text, str) or not text.strip():
+        except DocumentProcessingError:
+            return Response({"answers": ["Error during document chunking/embedding."] * len(questions)})
+        finally:
+            body.close()
+        if not processed.chunks:
             return Response({"answers": ["Document could not be parsed, or is empty."] * len(questions)})
 
-        # Chunk, embed, and answer
+        # Retrieve for all questions in one pass
         try:
-            chunks = split_text_to_chunks(text)
-            embeddings = embed_chunks(chunks)
+            question_embeddings, top_chunks_per_question = _retrieve_questions(processed, questions)
         except Exception:
-            return Response({"answers": ["Error during document chunking/embedding."] * len(questions)})
-
-        answers = []
-        for idx, question in enumerate(questions):
-            try:
-                query_embedding = embed_query(question)
-                top_chunks = get_top_k_chunks(
-                    query_embedding, embeddings, chunks, k=MAX_CHUNKS_PER_QUESTION
-                )
-                top_text = "\n\n".join([chunk for chunk, _ in top_chunks if chunk]) or "(No relevant content found)"
-                # Defensive call to LLM with timeout
-                try:
-                    llm_response = groq_client.chat.completions.create(
-                        model="llama3-70b-8192",
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided policy document content."},
-                            {"role": "user", "content": f"Document Content:\n{top_text}\n\nQuestion: {question}\n\nAnswer the question based only on the content above. Be clear, concise, and factual."}
-                        ],
-                        timeout=LLM_TIMEOUT
-                    )
-                    answer = llm_response.choices[0].message.content.strip()
-                except Exception:
-                    answer = "Answer unavailable due to LLM timeout or service error."
-            except Exception:
-                answer = "Internal error processing this question."
-            answers.append(answer)
-
+            return Response({"answers": ["Internal error processing this question."] * len(questions)})
+
+        answers = _cached_answers(processed, questions, question_embeddings, top_chunks_per_question)
+        misses = [i for i, answer in enumerate(answers) if answer is None]
+
+        # Answer the remaining questions concurrently, in original order, in
+        # whatever is left of the deadline after downloading and parsing
+        fresh = fan_out(
+            lambda i, remaining: answer_question(
+                questions[i], top_chunks_per_question[i], timeout=min(LLM_TIMEOUT, remaining),
+                query_vector=question_embeddings[i],
+            ),
+            misses,
+            deadline,
+        )
+        _store_answers(processed, questions, question_embeddings, top_chunks_per_question, answers, misses, fresh)
         return Response({"answers": answers})
 
     except Exception as e:
@@ -264,3 +689,9 @@ def hackrx_run(request):
         tb = traceback.format_exc()
         print(tb)
         return Response({"error": "Fatal internal server error."}, status=500)
+
+def metrics(request):
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
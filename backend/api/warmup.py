@@ -0,0 +1,44 @@
+import os
+import time
+from contextlib import contextmanager
+
+# Preload everything the first request would otherwise pay for. With
+# WARMUP_ON_STARTUP=True it runs from ApiConfig.ready(), so under
+# `gunicorn --preload` the work is done once in the master before forking.
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "False") == "True"
+
+
+@contextmanager
+def _timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - start
+
+
+def warm_up(load_model=True):
+    """
+    Import and initialize the lazy dependencies in the order a first upload
+    would hit them.
+
+    Returns:
+        dict: seconds spent per stage (the startup-time profile)
+    """
+    from .document_parser import punkt_sent_tokenize
+    from .embeddings import get_model, embed_query
+    from .llm_processor import extract_location
+
+    timings = {}
+    with _timed(timings, "punkt"):
+        punkt_sent_tokenize("Warm up the tokenizer. It loads lazily.")
+    with _timed(timings, "pdfplumber"):
+        import pdfplumber  # noqa: F401
+    with _timed(timings, "geotext"):
+        extract_location("Pune")
+    if load_model:
+        with _timed(timings, "glove_model"):
+            get_model()
+        with _timed(timings, "first_embedding"):
+            embed_query("warm up")
+    return timings
@@ -0,0 +1,118 @@
+import os
+import json
+import uuid
+import shutil
+
+import numpy as np
+
+# Compact, fully memory-mappable word vectors. The gensim KeyedVectors model
+# is converted once into:
+#   vectors.npy  float32 (n_words, dim), rows in vocabulary order
+#   vocab.npy    fixed-width bytes (S<width>), UTF-8 words sorted bytewise
+#   meta.json    source and shape
+# Lookups binary-search vocab.npy with np.searchsorted, so no process builds
+# a word -> index dict. Both arrays are opened read-only with mmap: workers
+# (forked after `gunicorn --preload` or started separately) share one copy
+# through the page cache.
+VECTORS_FILE = "vectors.npy"
+VOCAB_FILE = "vocab.npy"
+META_FILE = "meta.json"
+
+
+class CompactVectors:
+    def __init__(self, vocab, vectors):
+        self.vocab = vocab
+        self.vectors = vectors
+        self.vector_size = vectors.shape[1]
+        # Query words are cast one byte wider than the longest vocabulary word,
+        # so longer words are truncated to something that cannot match
+        self._query_dtype = np.dtype(f"S{vocab.dtype.itemsize + 1}")
+
+    def __len__(self):
+        return len(self.vocab)
+
+    @classmethod
+    def load(cls, path):
+        return cls(
+            np.load(os.path.join(path, VOCAB_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r"),
+        )
+
+    @classmethod
+    def from_words(cls, words, vectors):
+        """In-memory instance from parallel word / vector sequences."""
+        vocab, order = _sorted_vocab(words)
+        return cls(vocab, np.asarray(vectors, dtype=np.float32)[order])
+
+    def lookup(self, words):
+        """Row index of each word in `vectors`, -1 for unknown words."""
+        if not len(words) or not len(self.vocab):
+            return np.full(len(words), -1, dtype=np.int64)
+        query = np.array([w.encode("utf-8") for w in words], dtype=self._query_dtype)
+        ids = np.searchsorted(self.vocab, query)
+        ids[ids >= len(self.vocab)] = 0
+        found = self.vocab[ids] == query
+        return np.where(found, ids, -1)
+
+
+def _sorted_vocab(words):
+    encoded = [w.encode("utf-8") for w in words]
+    width = max((len(w) for w in encoded), default=1) or 1
+    vocab = np.array(encoded, dtype=f"S{width}")
+    order = np.argsort(vocab, kind="stable")
+    return vocab[order], order
+
+
+def _read_keyed_vectors(kv_path):
+    """(words, vectors) from a KeyedVectors.save() file pair, without KeyedVectors.load."""
+    from gensim import utils
+
+    header = utils.unpickle(kv_path)
+    words = getattr(header, "index_to_key", None)
+    if words is None:
+        # Models saved by gensim 3 keep a word -> Vocab(index=...) dict instead
+        words = sorted(header.vocab, key=lambda w: header.vocab[w].index)
+    vectors = getattr(header, "vectors", None)
+    if vectors is None:
+        # Large arrays are saved next to the pickle rather than inside it
+        vectors_path = f"{kv_path}.vectors.npy"
+        try:
+            vectors = np.load(vectors_path, mmap_mode="r")
+        except ValueError:
+            vectors = np.load(vectors_path, allow_pickle=True)
+    return list(words), vectors
+
+
+def convert_keyed_vectors(kv_path, out_dir, block_rows=65536):
+    """
+    Write the compact layout for a saved KeyedVectors model to `out_dir`,
+    atomically: concurrent converters or readers never see a partial copy.
+    """
+    words, vectors = _read_keyed_vectors(kv_path)
+    vocab, order = _sorted_vocab(words)
+
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = os.path.join(parent, f".tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp_path)
+    try:
+        out = np.lib.format.open_memmap(
+            os.path.join(tmp_path, VECTORS_FILE), mode="w+", dtype=np.float32, shape=(len(words), vectors.shape[1]),
+        )
+        for start in range(0, len(words), block_rows):
+            out[start:start + block_rows] = vectors[order[start:start + block_rows]]
+        out.flush()
+        del out
+        np.save(os.path.join(tmp_path, VOCAB_FILE), vocab)
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.basename(kv_path), "words": len(words), "dim": int(vectors.shape[1])}, f)
+        try:
+            os.replace(tmp_path, out_dir)
+        except OSError:
+            # Another process finished converting first
+            if not os.path.exists(os.path.join(out_dir, VOCAB_FILE)):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
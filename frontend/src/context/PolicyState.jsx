@@ -6,6 +6,7 @@ const backendUrl = import.meta.env.VITE_API_BASE_URL;
 const PolicyState = (props) => {
   const [profile, setProfile] = useState(null);
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
 
   // Set default auth headers for all axios requests
   useEffect(() => {
@@ -38,7 +39,22 @@ const PolicyState = (props) => {
   const history_getter = async () => {
     try {
       const res = await axios.get(`${backendUrl}/api/my-queries/`);
-      setHistory(res.data);
+      setHistory(res.data.results);
+      setHistoryCursor(res.data.next_cursor);
+    } catch (err) {
+      console.error("History fetch error:", err);
+    }
+  };
+
+  // Appends the next page of history (the endpoint is cursor-paginated)
+  const history_more = async () => {
+    if (!historyCursor) return;
+    try {
+      const res = await axios.get(`${backendUrl}/api/my-queries/`, {
+        params: { cursor: historyCursor },
+      });
+      setHistory((prev) => [...prev, ...res.data.results]);
+      setHistoryCursor(res.data.next_cursor);
     } catch (err) {
       console.error("History fetch error:", err);
     }
@@ -49,8 +65,10 @@ const PolicyState = (props) => {
       value={{
         profile,
         history,
+        historyCursor,
         info_getter,
         history_getter,
+        history_more,
       }}
     >
       {props.children}
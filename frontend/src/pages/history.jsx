@@ -10,7 +10,8 @@ import PolicyContext from "../context/PolicyContext";
 
 const HistoryPage = () => {
   const navigate = useNavigate();
-  const { history, history_getter } = useContext(PolicyContext);
+  const { history, historyCursor, history_getter, history_more } =
+    useContext(PolicyContext);
 
   const [search, setSearch] = useState("");
   const [expandedId, setExpandedId] = useState(null);
@@ -217,6 +218,17 @@ const HistoryPage = () => {
             })}
           </div>
         )}
+
+        {historyCursor && (
+          <div className="mt-10 text-center">
+            <button
+              onClick={history_more}
+              className="text-sm border border-white/20 rounded px-4 py-2 hover:bg-white/10 transition hover:cursor-pointer"
+            >
+              Load more
+            </button>
+          </div>
+        )}
       </motion.div>
     </div>
   );
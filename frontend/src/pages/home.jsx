@@ -119,8 +119,18 @@ export default function Home() {
           },
         }
       );
-      const data = response.data;
-      setDocumentId(data.document_id);
+      // The upload is queued for processing; poll the job until it finishes
+      const jobUrl = `${backendUrl}/api/jobs/${response.data.job_id}/`;
+      let job = response.data;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        job = (await axios.get(jobUrl)).data;
+      }
+      if (job.status === "succeeded") {
+        setDocumentId(job.document_id);
+      } else {
+        console.error("Processing failed", job.error);
+      }
     } catch (error) {
       console.error("Upload failed", error);
     } finally {
@@ -152,7 +162,13 @@ export default function Home() {
       await new Promise((resolve) => setTimeout(resolve, 1500));
       setAnalysisResult(response.data);
     } catch (error) {
-      console.error("Analysis failed", error);
+      if (error.response?.data?.expired) {
+        // The server dropped the processed document; it has to be uploaded again
+        setDocumentId(null);
+        alert("This document has expired. Please upload it again.");
+      } else {
+        console.error("Analysis failed", error);
+      }
     } finally {
       setLoading(false);
     }